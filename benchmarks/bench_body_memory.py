@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""巨大な会話のリクエスト1件を処理する間のピークメモリを測るベンチマーク
+
+ボディを分割して受信するASGI呼び出しでオペレータに渡るまでを tracemalloc で計測し、
+ペイロードの大きさに対する倍率を表示する。比較のため、FastAPIの既定の処理
+(ボディをモデルの引数で受け取る) とTUI向けに model_dump() し直す従来の流れも計測する。
+
+    python benchmarks/bench_body_memory.py --size-mb 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from src.hal.server import ChatCompletionRequest, HALServer  # noqa: E402
+
+CHUNK = 64 * 1024
+
+
+def build_body(size: int) -> bytes:
+    turn = "エージェントのツール出力 tool output line\n" * 200
+    count = max(size // len(turn.encode("utf-8")), 1)
+    messages = [
+        {"role": ("user", "assistant", "tool")[i % 3], "content": f"#{i} {turn}"}
+        for i in range(count)
+    ]
+    return json.dumps({"model": "gpt-4", "messages": messages}, ensure_ascii=False).encode()
+
+
+async def call(app, body: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    offset = 0
+    status = 0
+
+    async def receive():
+        nonlocal offset
+        chunk = body[offset:offset + CHUNK]
+        offset += CHUNK
+        return {"type": "http.request", "body": chunk, "more_body": offset < len(body)}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def legacy_app() -> FastAPI:
+    """FastAPIにボディの解析を任せ、TUI向けに model_dump() し直す従来の流れ"""
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: ChatCompletionRequest):
+        request_data = request.model_dump()
+        return {"messages": len(request_data["messages"])}
+
+    return app
+
+
+def hal_app() -> FastAPI:
+    """現在のHALServer (オペレータはリクエストを受け取ってすぐ応答する)"""
+    server = HALServer()
+
+    async def handler(request, on_update=None):
+        return {"content": f"{len(request.messages)}件"}
+
+    server.operator_pool.operators[0].handler = handler
+    return server.app
+
+
+def measure(app, body: bytes) -> float:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    status = asyncio.run(call(app, body))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert status == 200, status
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=20, help="ペイロードの大きさ(MB)")
+    args = parser.parse_args()
+
+    logger.remove()
+    body = build_body(int(args.size_mb * 1024 * 1024))
+    size = len(body)
+    print(f"ペイロード: {size / 1024 / 1024:.1f}MB")
+    for name, factory in (("従来 (FastAPI既定 + model_dump)", legacy_app), ("HALServer", hal_app)):
+        app = factory()
+        # ルーティングやミドルウェアの初期化を計測から除く
+        asyncio.run(call(app, build_body(1024)))
+        peak = measure(app, body)
+        print(f"{name}: ピーク {peak / 1024 / 1024:.1f}MB ({peak / size:.2f}倍)")
+
+
+if __name__ == "__main__":
+    main()
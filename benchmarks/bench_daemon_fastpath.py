@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""--fix-reply-daemon の高速経路と通常経路の処理性能を比較するベンチマーク
+
+ネットワークやuvicornの影響を除くため、ASGIアプリを直接呼び出して1秒あたりの処理件数を測る。
+
+    python benchmarks/bench_daemon_fastpath.py --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger  # noqa: E402
+
+from src.hal.server import HALServer  # noqa: E402
+
+BODY = json.dumps({
+    "model": "gpt-4",
+    "messages": [
+        {"role": "system", "content": "あなたは役立つアシスタントです。"},
+        {"role": "user", "content": "こんにちは"}
+    ],
+    "max_tokens": 1000,
+    "temperature": 0.7
+}).encode("utf-8")
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "POST",
+    "scheme": "http",
+    "path": "/v1/chat/completions",
+    "raw_path": b"/v1/chat/completions",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(BODY)).encode()),
+        (b"authorization", b"Bearer fake-token"),
+    ],
+    "client": ("127.0.0.1", 50000),
+    "server": ("127.0.0.1", 8000),
+}
+
+
+async def call(app) -> int:
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": BODY, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(dict(SCOPE), receive, send)
+    return status
+
+
+async def run(app, requests: int) -> float:
+    # 起動処理やミドルウェア構築の影響を除くため最初に数回呼んでおく
+    for _ in range(100):
+        assert await call(app) == 200
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000, help="計測するリクエスト数")
+    args = parser.parse_args()
+
+    logger.remove()
+
+    results = {}
+    for name, fast_path in (("通常経路", False), ("高速経路", True)):
+        server = HALServer(fix_reply="こんにちは、休暇中です。", fast_path=fast_path)
+        results[name] = asyncio.run(run(server.app, args.requests))
+        print(f"{name}: {results[name]:,.0f} req/s")
+
+    print(f"高速化倍率: {results['高速経路'] / results['通常経路']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
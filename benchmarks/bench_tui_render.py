@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""TUIにリクエストを表示するまでの時間を会話の長さごとに測るベンチマーク
+
+メッセージ列を仮想化したリスト (MessageList) で表示する現在の方式と、全メッセージを
+1つの文字列にまとめて Static に渡す従来の方式を、ヘッドレスのTextualアプリで比較する。
+リクエストを渡してから画面の描画が終わるまでの時間の中央値を表示する。
+
+    python benchmarks/bench_tui_render.py --repeat 5
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from textual.app import App, ComposeResult  # noqa: E402
+from textual.containers import VerticalScroll  # noqa: E402
+from textual.widgets import Static  # noqa: E402
+
+from src.hal.message_list import MessageList  # noqa: E402
+
+SIZE = (120, 40)
+
+
+def build_messages(count: int, chars: int):
+    line = "ツールの出力 tool output 0123456789 " * 2
+    body = "\n".join([line] * (chars // len(line) + 1))[:chars]
+    return [
+        {"role": ("user", "assistant", "tool")[i % 3], "content": f"#{i}\n{body}"}
+        for i in range(count)
+    ]
+
+
+class LegacyApp(App):
+    """全メッセージを1つの文字列にまとめて表示する従来の方式"""
+
+    def compose(self) -> ComposeResult:
+        with VerticalScroll():
+            yield Static(id="messages", markup=False)
+
+    def show(self, messages) -> None:
+        text = "メッセージ:\n"
+        for message in messages:
+            text += f"- {message['role']}: {message['content']}\n"
+        self.query_one("#messages", Static).update(text)
+
+
+class VirtualizedApp(App):
+    """MessageList で見えている行だけを描画する現在の方式"""
+
+    def compose(self) -> ComposeResult:
+        yield MessageList(id="messages")
+
+    def show(self, messages) -> None:
+        self.query_one("#messages", MessageList).set_messages(messages)
+
+
+async def measure(app_class, messages, repeat: int) -> float:
+    app = app_class()
+    timings = []
+    async with app.run_test(size=SIZE) as pilot:
+        for _ in range(repeat):
+            app.show([])
+            await pilot.pause()
+            started = time.perf_counter()
+            app.show(messages)
+            # 描画を含め、アプリが待機状態に戻るまで待つ
+            await pilot.pause()
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="各条件の計測回数")
+    parser.add_argument("--skip-legacy", action="store_true", help="従来の方式を計測しない")
+    args = parser.parse_args()
+
+    cases = [(10, 200), (100, 2000), (500, 2000), (1000, 500), (10, 200_000)]
+    print(
+        f"{'メッセージ数':>10} {'1件の文字数':>10} {'合計(KB)':>9} "
+        f"{'MessageList':>12} {'従来':>10}"
+    )
+    for count, chars in cases:
+        messages = build_messages(count, chars)
+        total_kb = sum(len(message["content"]) for message in messages) / 1024
+        virtualized = await measure(VirtualizedApp, messages, args.repeat)
+        legacy = "-"
+        if not args.skip_legacy:
+            legacy = f"{await measure(LegacyApp, messages, args.repeat) * 1000:8.1f}ms"
+        print(
+            f"{count:>10} {chars:>10} {total_kb:>9.0f} "
+            f"{virtualized * 1000:>10.1f}ms {legacy:>10}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, TextIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def build_batch_payload(line: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """入力の1行からリクエストボディを組み立てる
+
+    行は次のいずれかのJSON:
+        "ユーザーメッセージ"
+        {"user": "...", "system": "...", ...}  (省略したキーは defaults を使う)
+        {"model": "...", "messages": [...], ...}  (そのまま送る。省略したキーは defaults を使う)
+
+    Raises:
+        ValueError: 行が上記のいずれでもない場合
+    """
+    data = json.loads(line)
+    if isinstance(data, str):
+        data = {"user": data}
+    if not isinstance(data, dict):
+        raise ValueError("入力行はJSON文字列かオブジェクトである必要があります")
+
+    if "messages" in data:
+        payload = dict(data)
+    elif "user" in data:
+        payload = {
+            key: value for key, value in data.items() if key not in ("system", "user")
+        }
+        payload["messages"] = [
+            {"role": "system", "content": data.get("system", defaults["system"])},
+            {"role": "user", "content": data["user"]}
+        ]
+    else:
+        raise ValueError("入力行に user または messages がありません")
+
+    for key in ("model", "max_tokens", "temperature"):
+        payload.setdefault(key, defaults[key])
+    return payload
+
+
+class BatchSender:
+    """入力行を順に送信し、応答を入力と同じ順序でndjsonとして書き出す
+
+    スレッドごとに requests.Session を持ち、keep-alive で接続を使い回す。
+    parallel 件まで同時に送信する。先読みは parallel の2倍までに抑えるため、
+    標準入力からも逐次処理できる。
+    """
+
+    def __init__(self, url: str, defaults: Dict[str, Any],
+                 headers: Optional[Dict[str, str]] = None, parallel: int = 1,
+                 timeout: Optional[float] = None):
+        self.url = url
+        self.defaults = defaults
+        self.headers = headers or {}
+        self.parallel = max(1, parallel)
+        self.timeout = timeout
+        self.failed = 0
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount("http://", HTTPAdapter(pool_maxsize=1))
+            session.mount("https://", HTTPAdapter(pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def send_line(self, line: str) -> Dict[str, Any]:
+        """1行分を送信し、書き出す結果を返す"""
+        try:
+            payload = build_batch_payload(line, self.defaults)
+        except ValueError as e:
+            return {"error": "invalid_input", "detail": str(e)}
+
+        try:
+            response = self._session().post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            return {"error": "request_failed", "detail": str(e)}
+
+        try:
+            return response.json()
+        except ValueError:
+            return {"error": "invalid_response", "status": response.status_code,
+                    "detail": response.text}
+
+    def run(self, lines: Iterable[str], out: TextIO) -> int:
+        """全ての行を送信して結果を out に書き出し、送信した件数を返す"""
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            pending = deque()
+            for line in lines:
+                if not line.strip():
+                    continue
+                pending.append(executor.submit(self.send_line, line))
+                count += 1
+                if len(pending) >= self.parallel * 2:
+                    self._write(pending.popleft().result(), out)
+            while pending:
+                self._write(pending.popleft().result(), out)
+        return count
+
+    def _write(self, result: Dict[str, Any], out: TextIO) -> None:
+        if "error" in result:
+            self.failed += 1
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
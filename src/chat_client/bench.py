@@ -0,0 +1,196 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+import httpx
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """HDR Histogram方式で値(マイクロ秒)を記録するヒストグラム
+
+    値の桁(2の冪)ごとに sub_bits ビット分の区間に分けて数えるため、
+    記録件数や値の範囲によらず一定の相対精度(sub_bits=7で約1.6%)でパーセンタイルを求められる。
+    """
+
+    def __init__(self, sub_bits: int = 7):
+        self.sub_bits = sub_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.sub_bits - 1)) + (value >> shift)
+
+    def _highest_equivalent(self, index: int) -> int:
+        """区間に入る値のうち最大のものを返す"""
+        if index < (1 << self.sub_bits):
+            return index
+        shift = (index >> (self.sub_bits - 1)) - 1
+        mantissa = index - (shift << (self.sub_bits - 1))
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile: float) -> int:
+        """percentile(0〜100)の位置の値を返す。記録が無ければ0"""
+        if self.count == 0:
+            return 0
+        target = max(1, int(self.count * percentile / 100.0 + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class BenchResult:
+    """負荷試験の結果"""
+
+    def __init__(self, mode: str, concurrency: int, rate: Optional[float]):
+        self.mode = mode
+        self.concurrency = concurrency
+        self.rate = rate
+        self.latency = LatencyHistogram()
+        self.statuses: Counter = Counter()
+        self.elapsed = 0.0
+
+    def record(self, status: str, latency_seconds: float) -> None:
+        self.statuses[status] += 1
+        self.latency.record(latency_seconds * 1_000_000)
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONで書き出す形式に変換する。レイテンシはミリ秒"""
+        latency = {
+            "min": (self.latency.min or 0) / 1000,
+            "mean": self.latency.mean / 1000,
+            "max": (self.latency.max or 0) / 1000,
+        }
+        for percentile in PERCENTILES:
+            latency[f"p{percentile:g}"] = self.latency.percentile(percentile) / 1000
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "requests": self.requests,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "status": dict(sorted(self.statuses.items())),
+            "latency_ms": latency,
+        }
+
+    def format_report(self) -> str:
+        """人が読むための結果の要約を返す"""
+        data = self.to_dict()
+        lines = [
+            f"モード: {self.mode} (同時接続数: {self.concurrency}"
+            + (f", 到着レート: {self.rate:g} req/s)" if self.rate else ")"),
+            f"リクエスト数: {data['requests']} ({data['elapsed']:.2f}秒, "
+            f"{data['throughput']:.1f} req/s)",
+            "ステータス:",
+        ]
+        for status, count in data["status"].items():
+            lines.append(f"  {status}: {count}")
+        lines.append("レイテンシ (ms):")
+        for name, value in data["latency_ms"].items():
+            lines.append(f"  {name}: {value:.3f}")
+        return "\n".join(lines)
+
+
+async def run_bench(
+    url: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    concurrency: int = 10,
+    requests: Optional[int] = 100,
+    duration: Optional[float] = None,
+    rate: Optional[float] = None,
+    timeout: float = 60.0,
+    transport: Optional[httpx.AsyncBaseTransport] = None
+) -> BenchResult:
+    """HALにリクエストを送り続けて、スループットとレイテンシを測る
+
+    rate を指定しない場合はクローズドループで、concurrency 個のワーカーが
+    応答を受け取るたびに次を送る。
+    rate を指定するとオープンループで、応答を待たずに毎秒 rate 件の一定間隔で送る。
+    オープンループのレイテンシは予定送信時刻から測るため、サーバーの詰まりで送信が遅れた分も含まれる。
+    requests (総件数) と duration (秒) のどちらか先に達した時点で送信をやめる。
+
+    Args:
+        transport: httpxのトランスポート (テストでASGIアプリを直接呼ぶ場合など)
+    """
+    if requests is None and duration is None:
+        raise ValueError("requests か duration のどちらかを指定してください")
+
+    result = BenchResult("open" if rate else "closed", concurrency, rate)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(
+        headers=headers, limits=limits, timeout=timeout, transport=transport
+    ) as client:
+
+        async def send(scheduled: float) -> None:
+            try:
+                response = await client.post(url, json=payload)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            result.record(status, time.perf_counter() - scheduled)
+
+        started = time.perf_counter()
+        deadline = started + duration if duration is not None else None
+
+        def should_send(sent: int, now: float) -> bool:
+            if requests is not None and sent >= requests:
+                return False
+            return deadline is None or now < deadline
+
+        if rate:
+            tasks = []
+            sent = 0
+            while should_send(sent, started + sent / rate):
+                scheduled = started + sent / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(scheduled)))
+                sent += 1
+            await asyncio.gather(*tasks)
+        else:
+            counter = {"sent": 0}
+
+            async def worker() -> None:
+                while should_send(counter["sent"], time.perf_counter()):
+                    counter["sent"] += 1
+                    await send(time.perf_counter())
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional
+
+import websockets
+from loguru import logger
+
+from src.hal.tui_fix import TUIApp
+
+
+class ConsoleApp(TUIApp):
+    """HALサーバーにWebSocketで接続し、届いたリクエストに応答するリモートのオペレータコンソール
+
+    画面と操作はサーバーのTUIと同じで、F12の送信やF1〜F3の判定をサーバーに送り返す。
+    接続が切れた場合は表示中のリクエストを取り下げ (サーバーが別のオペレータに割り当て直す)、
+    reconnect_interval 秒ごとに再接続する。
+
+    Args:
+        url: 接続先 (ws://host:port/v1/operators/ws?name=...)
+        headers: 接続時に送るHTTPヘッダ
+    """
+
+    reconnect_interval = 3.0
+
+    def __init__(
+        self, url: str, headers: Optional[Dict[str, str]] = None, verbose: bool = False
+    ):
+        super().__init__(verbose=verbose)
+        self.url = url
+        self.headers = headers or {}
+        # リクエストID -> TUIの応答を受け取るFuture
+        self._futures: Dict[str, asyncio.Future] = {}
+        # リクエストID -> 未送信の入力中の応答文 (送信が追いつかない間は最新のものだけを送る)
+        self._drafts: Dict[str, str] = {}
+
+    def on_mount(self) -> None:
+        # TUIApp.on_mount もTextualが呼び出すため、ここでは接続だけを始める
+        self.sub_title = f"接続中: {self.url}"
+        self.run_worker(self.relay(), group="remote")
+
+    async def relay(self) -> None:
+        """サーバーに接続してリクエストを受け取り続ける。切断されたら再接続する"""
+        while True:
+            try:
+                async with websockets.connect(
+                    self.url, additional_headers=self.headers, max_size=None
+                ) as websocket:
+                    await self._session(websocket)
+            except (OSError, websockets.WebSocketException) as e:
+                logger.debug(f"サーバーとの接続が切れました: {e}")
+            if self._futures:
+                self.notify(
+                    "サーバーとの接続が切れたため、リクエストを取り下げました", severity="warning"
+                )
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._drafts.clear()
+            self.sub_title = f"再接続を待っています: {self.url}"
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def _session(self, websocket) -> None:
+        outbox: asyncio.Queue = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send_loop(websocket, outbox))
+        try:
+            async for text in websocket:
+                frame = json.loads(text)
+                kind = frame.get("type")
+                if kind == "ping":
+                    outbox.put_nowait({"type": "pong"})
+                elif kind == "hello":
+                    self.sub_title = f"{frame.get('operator')} として接続しました: {self.url}"
+                elif kind == "request":
+                    self._accept(frame, outbox)
+                elif kind == "cancel":
+                    future = self._futures.pop(frame.get("id"), None)
+                    if future is not None:
+                        future.cancel()
+        finally:
+            sender.cancel()
+
+    async def _send_loop(self, websocket, outbox: asyncio.Queue) -> None:
+        while True:
+            frame = await outbox.get()
+            if frame["type"] == "draft":
+                content = self._drafts.pop(frame["id"], None)
+                if content is None:
+                    continue
+                frame = {**frame, "content": content}
+            await websocket.send(json.dumps(frame, ensure_ascii=False, separators=(",", ":")))
+
+    def _accept(self, frame: Dict[str, Any], outbox: asyncio.Queue) -> None:
+        """request フレームをTUIに渡し、応答が確定したら reply / verdict を送り返す"""
+        request_id = frame["id"]
+        request_data = {
+            "model": frame.get("model", ""),
+            "messages": [{"role": role, "content": text} for role, text in frame["messages"]],
+            "max_tokens": frame.get("max_tokens", 1000),
+            "temperature": frame.get("temperature", 0.7)
+        }
+
+        on_update = None
+        if frame.get("stream"):
+            def on_update(text: str) -> None:
+                if request_id not in self._drafts:
+                    outbox.put_nowait({"type": "draft", "id": request_id})
+                self._drafts[request_id] = text
+
+        def on_done(future: asyncio.Future) -> None:
+            self._futures.pop(request_id, None)
+            self._drafts.pop(request_id, None)
+            if future.cancelled():
+                return
+            result = future.result()
+            if result.get("error"):
+                outbox.put_nowait({"type": "verdict", "id": request_id, "error": result["error"]})
+            else:
+                outbox.put_nowait({"type": "reply", "id": request_id, "content": result["content"]})
+
+        future = self.submit_request(
+            request_data, on_update, frame.get("suggestions"), frame.get("seen", 0)
+        )
+        future.add_done_callback(on_done)
+        self._futures[request_id] = future
+
+
+def run_console(url: str, headers: Optional[Dict[str, str]] = None, verbose: bool = False) -> None:
+    ConsoleApp(url, headers=headers, verbose=verbose).run()
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import sys
 
@@ -5,6 +6,27 @@ import click
 import requests
 from loguru import logger
 
+from .batch import BatchSender
+from .bench import run_bench
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer fake-token"
+}
+
+
+def build_payload(model, system, user, max_tokens, temperature):
+    """chat/completions のリクエストボディを組み立てる"""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+
 
 @click.group()
 @click.option("-v", "--verbose", is_flag=True, help="詳細なログ出力")
@@ -27,39 +49,45 @@ def cli(ctx, verbose, host, port):
 @cli.command()
 @click.option("--model", default="gpt-4", help="使用するモデル")
 @click.option("--system", default="あなたは役立つアシスタントです。", help="システムプロンプト")
-@click.option("--user", required=True, help="ユーザーメッセージ (必須)")
+@click.option("--user", help="ユーザーメッセージ (--input を使わない場合は必須)")
 @click.option("--max-tokens", default=1000, help="最大トークン数")
 @click.option("--temperature", default=0.7, help="温度パラメータ")
+@click.option(
+    "--input", "input_file", type=click.File("r", encoding="utf-8"),
+    help="1行1リクエストのndjsonファイルから続けて送信する (-で標準入力)"
+)
+@click.option("--parallel", default=1, help="--input 使用時に同時に送信する件数")
+@click.option("--timeout", type=float, help="--input 使用時の1リクエストのタイムアウト(秒)")
 @click.pass_context
-def send(ctx, model, system, user, max_tokens, temperature):
-    """メッセージをHALに送信する (--user オプションが必須)"""
+def send(ctx, model, system, user, max_tokens, temperature, input_file, parallel, timeout):
+    """メッセージをHALに送信する (--user または --input が必須)"""
     host = ctx.obj["HOST"]
     port = ctx.obj["PORT"]
     verbose = ctx.obj["VERBOSE"]
     
     url = f"http://{host}:{port}/v1/chat/completions"
     
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user}
-        ],
-        "max_tokens": max_tokens,
-        "temperature": temperature
-    }
+    if input_file is not None:
+        defaults = {
+            "model": model, "system": system, "max_tokens": max_tokens, "temperature": temperature
+        }
+        sender = BatchSender(url, defaults, headers=HEADERS, parallel=parallel, timeout=timeout)
+        count = sender.run(input_file, sys.stdout)
+        if verbose or sender.failed:
+            logger.info(f"{count}件を送信しました (エラー: {sender.failed}件)")
+        return
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": "Bearer fake-token"
-    }
+    if user is None:
+        raise click.UsageError("--user または --input を指定してください")
+    
+    payload = build_payload(model, system, user, max_tokens, temperature)
     
     if verbose:
         logger.info(f"リクエスト: {url}")
         logger.info(f"ペイロード: {json.dumps(payload, indent=2, ensure_ascii=False)}")
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = requests.post(url, json=payload, headers=HEADERS)
         
         if verbose:
             logger.info(f"ステータスコード: {response.status_code}")
@@ -74,6 +102,62 @@ def send(ctx, model, system, user, max_tokens, temperature):
         logger.error(f"エラー発生: {e}")
         sys.exit(1)
 
+@cli.command()
+@click.option("--model", default="gpt-4", help="使用するモデル")
+@click.option("--system", default="あなたは役立つアシスタントです。", help="システムプロンプト")
+@click.option("--user", default="こんにちは", help="ユーザーメッセージ")
+@click.option("--max-tokens", default=1000, help="最大トークン数")
+@click.option("--temperature", default=0.7, help="温度パラメータ")
+@click.option("-c", "--concurrency", default=10, help="同時接続数")
+@click.option("-n", "--requests", "total", default=100, help="送信するリクエストの総数")
+@click.option(
+    "-d", "--duration", type=float, help="送信を続ける秒数 (--requests より先に達したら終了)"
+)
+@click.option("--rate", type=float, help="毎秒の送信件数。指定するとオープンループで送る")
+@click.option("--timeout", default=60.0, help="1リクエストのタイムアウト(秒)")
+@click.option("--json-output", type=click.Path(), help="結果をJSONで書き出すファイル (-で標準出力)")
+@click.pass_context
+def bench(ctx, model, system, user, max_tokens, temperature, concurrency, total, duration, rate,
+          timeout, json_output):
+    """HALに並行してリクエストを送り、スループットとレイテンシを測る"""
+    url = f"http://{ctx.obj['HOST']}:{ctx.obj['PORT']}/v1/chat/completions"
+    payload = build_payload(model, system, user, max_tokens, temperature)
+    # --duration だけを指定した場合は時間で打ち切る
+    if duration is not None and ctx.get_parameter_source("total").name == "DEFAULT":
+        total = None
+    
+    if ctx.obj["VERBOSE"]:
+        logger.info(f"負荷試験開始: {url}")
+    
+    result = asyncio.run(run_bench(
+        url, payload, headers=HEADERS, concurrency=concurrency, requests=total,
+        duration=duration, rate=rate, timeout=timeout
+    ))
+    
+    if json_output == "-":
+        print(json.dumps(result.to_dict(), indent=2, ensure_ascii=False))
+        return
+    print(result.format_report())
+    if json_output:
+        with open(json_output, "w", encoding="utf-8") as f:
+            json.dump(result.to_dict(), f, indent=2, ensure_ascii=False)
+        logger.info(f"結果を書き出しました: {json_output}")
+
+@cli.command()
+@click.option("--name", default="remote", help="オペレータ名")
+@click.pass_context
+def console(ctx, name):
+    """HALサーバーにオペレータとして接続し、届いたリクエストにTUIで応答する"""
+    from urllib.parse import quote
+
+    from .console import run_console
+    
+    url = f"ws://{ctx.obj['HOST']}:{ctx.obj['PORT']}/v1/operators/ws?name={quote(name)}"
+    if ctx.obj["VERBOSE"]:
+        logger.info(f"オペレータとして接続します: {url}")
+    headers = {"Authorization": HEADERS["Authorization"]}
+    run_console(url, headers=headers, verbose=ctx.obj["VERBOSE"])
+
 @cli.command()
 @click.option("--kill", is_flag=True, help="既存のデーモンを終了する")
 @click.pass_context
@@ -0,0 +1,86 @@
+from typing import Optional
+
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import JSONResponse
+
+
+class RequestTooLarge(StarletteHTTPException):
+    """リクエストボディが上限を超えた"""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="request_too_large")
+
+
+class BodySizeLimit:
+    """リクエストボディの大きさを max_bytes までに制限するASGIミドルウェア
+
+    Content-Length が上限を超えていればボディを読まずに413を返す。Content-Length が無い
+    (chunked) 場合や偽っている場合も、受信した合計が上限を超えた時点で RequestTooLarge を送出し、
+    残りを読み込まない。アプリ側で処理されなかった場合はここで413を返す。
+    requests_total を渡すと、拒否した件数を request_too_large として記録する。
+    """
+
+    def __init__(self, app, max_bytes: int, requests_total=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.requests_total = requests_total
+
+    @staticmethod
+    def _content_length(scope) -> Optional[int]:
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = self._content_length(scope)
+        if content_length is not None and content_length > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise RequestTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestTooLarge:
+            if started:
+                raise
+            await self._reject(scope, receive, send)
+            return
+        if exceeded and self.requests_total is not None:
+            self.requests_total.inc("request_too_large")
+
+    async def _reject(self, scope, receive, send) -> None:
+        if self.requests_total is not None:
+            self.requests_total.inc("request_too_large")
+        response = JSONResponse(
+            status_code=413,
+            content={"error": "request_too_large"},
+            headers={"Connection": "close"}
+        )
+        await response(scope, receive, send)
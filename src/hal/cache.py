@@ -0,0 +1,93 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from loguru import logger
+
+
+class ResponseCache:
+    """オペレータの応答を会話ハッシュごとに保持するLRU + TTLキャッシュ
+
+    Args:
+        max_entries: 保持する最大件数。超えた分は最も長く使われていないものから捨てる
+        ttl: 応答を保持する秒数
+        file_path: 指定すると起動時に読み込み、save() で書き出す
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0,
+                 file_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (有効期限のUNIX時刻, 応答本文)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        if file_path and os.path.exists(file_path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの応答を返す。無いか期限切れならNone"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, content = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content
+
+    def put(self, key: str, content: str) -> None:
+        """応答を保存する"""
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.time() + self.ttl, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def load(self) -> None:
+        """file_path から有効期限内の応答を読み込む"""
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)["entries"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"応答キャッシュの読み込みに失敗しました: {e}")
+            return
+
+        now = time.time()
+        for key, expires_at, content in entries:
+            if expires_at > now:
+                self._entries[key] = (expires_at, content)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"応答キャッシュを読み込みました: {len(self._entries)}件")
+
+    def save(self) -> None:
+        """有効期限内の応答を file_path に書き出す"""
+        if not self.file_path:
+            return
+        now = time.time()
+        entries = [
+            [key, expires_at, content]
+            for key, (expires_at, content) in self._entries.items()
+            if expires_at > now
+        ]
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.file_path)
+        logger.info(f"応答キャッシュを書き出しました: {len(entries)}件")
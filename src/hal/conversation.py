@@ -0,0 +1,69 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from .utils import normalize_messages
+
+
+class ConversationTracker:
+    """回答済みの会話をメッセージ列の先頭部分 (prefix) のハッシュで覚え、続きの会話を見分ける
+
+    エージェントは毎回会話の履歴全体を送り直すため、届いたリクエストが回答済みの会話の続きなら
+    前回までのメッセージを省いて新しいメッセージだけをオペレータに見せられる。
+    ハッシュは1件目から順に「直前までのハッシュ + そのメッセージ」をつないだ連鎖で、
+    k件目のハッシュが一致すれば先頭k件が一致している。回答済みの会話は各位置のハッシュと、
+    オペレータの応答を続けたハッシュを登録しておき、照合では末尾から遡って最初に見つかった
+    位置を既読の件数とする。連鎖の計算はメッセージ1件につき1回のハッシュで済み、
+    照合は新しいメッセージの件数分だけ辞書を引けばよい。
+
+    Args:
+        max_prefixes: 覚えておくハッシュの最大件数。超えたら古いものから忘れる
+    """
+
+    def __init__(self, max_prefixes: int = 100000):
+        self.max_prefixes = max_prefixes
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._prefixes)
+
+    @staticmethod
+    def _root(model: str) -> str:
+        return hashlib.sha256(model.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _next(previous: str, role: str, text: str) -> str:
+        digest = hashlib.sha256(previous.encode("ascii"))
+        digest.update(json.dumps([role, text], ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def chain(self, model: str, messages: List[Any]) -> List[str]:
+        """メッセージ列の各位置までのハッシュのリスト (i番目は先頭 i+1 件のハッシュ)"""
+        current = self._root(model)
+        hashes = []
+        for role, text in normalize_messages(messages):
+            current = self._next(current, role, text)
+            hashes.append(current)
+        return hashes
+
+    def seen_count(self, model: str, messages: List[Any]) -> int:
+        """messages の先頭のうち、回答済みの会話で既に表示した件数を返す"""
+        hashes = self.chain(model, messages)
+        for index in range(len(hashes) - 1, -1, -1):
+            if hashes[index] in self._prefixes:
+                self._prefixes.move_to_end(hashes[index])
+                return index + 1
+        return 0
+
+    def record(self, model: str, messages: List[Any], reply: Optional[str] = None) -> None:
+        """回答済みの会話を登録する。reply を渡すと、応答を続けた会話も既読として登録する"""
+        hashes = self.chain(model, messages)
+        if reply is not None:
+            previous = hashes[-1] if hashes else self._root(model)
+            hashes.append(self._next(previous, "assistant", reply))
+        for value in hashes:
+            self._prefixes[value] = None
+            self._prefixes.move_to_end(value)
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
@@ -0,0 +1,156 @@
+import json
+import time
+import uuid
+from typing import Optional
+
+from starlette.responses import Response
+
+from .tokenizer import TokenCounter
+
+_ID = "\x00id\x00"
+_CREATED = 1234567890123
+_MODEL = "\x00model\x00"
+_PROMPT_TOKENS = 2345678901234
+_TOTAL_TOKENS = 3456789012345
+
+
+def _dumps(data) -> bytes:
+    # FastAPIのJSONResponseと同じ形式でシリアライズする
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FixedReplyFastPath:
+    """--fix-reply-daemon 用の高速応答ASGIミドルウェア
+
+    起動時に応答ボディのテンプレートを一度だけ組み立てておき、
+    POST /v1/chat/completions にはid・created・modelとプロンプトのトークン数だけを埋め込んだ
+    バイト列を直接返す。pydanticによる検証・応答モデルの構築・ロックの取得は行わない。
+    modelが取り出せないリクエスト、ストリーミング要求、固定返答が max_tokens を超える
+    (切り詰めが必要な) リクエストは通常の経路に回す。
+    requests_total・serialization_seconds を渡すと、応答件数と組み立て時間を記録する。
+    """
+
+    path = "/v1/chat/completions"
+
+    def __init__(
+        self,
+        app,
+        fix_reply: str,
+        requests_total=None,
+        serialization_seconds=None,
+        token_counter: Optional[TokenCounter] = None
+    ):
+        self.app = app
+        self.requests_total = requests_total
+        self.serialization_seconds = serialization_seconds
+        self.token_counter = token_counter or TokenCounter()
+        self.completion_tokens = self.token_counter.count(fix_reply)
+        template = _dumps({
+            "id": _ID,
+            "object": "chat.completion",
+            "created": _CREATED,
+            "model": _MODEL,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": fix_reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": _PROMPT_TOKENS,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": _TOTAL_TOKENS
+            }
+        })
+        parts = []
+        for marker in (_ID, _CREATED, _MODEL, _PROMPT_TOKENS, _TOTAL_TOKENS):
+            head, template = template.split(_dumps(marker), 1)
+            parts.append(head)
+        parts.append(template)
+        self._parts = tuple(parts)
+
+    def render(self, model: str, prompt_tokens: int = 0) -> bytes:
+        """テンプレートにid・created・modelとトークン数を埋め込んだ応答ボディを返す"""
+        head, after_id, after_created, after_model, after_prompt, end = self._parts
+        return b"".join((
+            head,
+            _dumps(f"chatcmpl-{uuid.uuid4().hex[:5]}"),
+            after_id,
+            str(int(time.time())).encode(),
+            after_created,
+            _dumps(model),
+            after_model,
+            str(prompt_tokens).encode(),
+            after_prompt,
+            str(prompt_tokens + self.completion_tokens).encode(),
+            end,
+        ))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                # 受信途中で切断された
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        parsed = self._parse(body)
+        if parsed is None:
+            await self.app(scope, self._replay(body, receive), send)
+            return
+
+        started = time.perf_counter()
+        response = Response(self.render(*parsed), media_type="application/json")
+        if self.serialization_seconds is not None:
+            self.serialization_seconds.observe(time.perf_counter() - started)
+        if self.requests_total is not None:
+            self.requests_total.inc("ok")
+        await response(scope, receive, send)
+
+    def _parse(self, body: bytes):
+        """高速経路で応答できるリクエストであれば (model, プロンプトのトークン数) を返す"""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or data.get("stream"):
+            return None
+        model = data.get("model")
+        messages = data.get("messages")
+        if not isinstance(model, str) or not isinstance(messages, list):
+            return None
+        # max_tokens が指定されていなければ切り詰めない
+        max_tokens = data.get("max_tokens")
+        if "max_tokens" in data and (
+            type(max_tokens) is not int or max_tokens < self.completion_tokens
+        ):
+            return None
+        if not all(isinstance(message, dict) for message in messages):
+            return None
+        try:
+            prompt_tokens = self.token_counter.prompt_tokens(messages)
+        except (AttributeError, TypeError):
+            # contentの形式が不正なリクエストは通常の経路で検証エラーにする
+            return None
+        return model, prompt_tokens
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        """読み取り済みのボディを通常の経路にもう一度渡すreceive関数を作る"""
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
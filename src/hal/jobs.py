@@ -0,0 +1,131 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Optional
+
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+
+class Job:
+    """非同期モードで受け付けたリクエストの処理
+
+    task はHTTP応答を返すタスクで、完了すると response にその応答が入る。
+    """
+
+    __slots__ = ("id", "created", "task", "response", "finished_at")
+
+    def __init__(self, job_id: str, task: asyncio.Future):
+        self.id = job_id
+        self.created = int(time.time())
+        self.task = task
+        self.response: Optional[Any] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def status_body(self, status: str) -> dict:
+        return {
+            "id": self.id,
+            "object": "chat.completion.job",
+            "created": self.created,
+            "status": status
+        }
+
+
+class JobStore:
+    """非同期モードのジョブを保持する、件数の上限と有効期間付きのストア
+
+    完了したジョブは ttl 秒後に捨てる。max_jobs 件に達したら完了済みのものを古い順に捨て、
+    全件が処理中の場合は新しいジョブを受け付けない。
+
+    Args:
+        max_jobs: 保持するジョブの最大件数 (処理中のものを含む)
+        ttl: 完了したジョブの結果を保持する秒数
+    """
+
+    def __init__(self, max_jobs: int = 1000, ttl: float = 3600.0):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # 完了したジョブを完了順に並べる (job_id -> 完了時刻)
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def pending(self) -> int:
+        """処理中のジョブ数"""
+        return len(self._jobs) - len(self._finished)
+
+    def submit(self, coro: Awaitable[Any]) -> Optional[Job]:
+        """HTTP応答を返すコルーチンをジョブとして開始する。満杯ならNone"""
+        self._expire()
+        if len(self._jobs) >= self.max_jobs and self._finished:
+            self._discard(next(iter(self._finished)))
+            self.evictions += 1
+        if len(self._jobs) >= self.max_jobs:
+            coro.close()
+            return None
+        job = Job(f"job-{uuid.uuid4().hex}", asyncio.ensure_future(coro))
+        self._jobs[job.id] = job
+        job.task.add_done_callback(lambda task: self._finish(job, task))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """ジョブを返す。無いか有効期間が過ぎていればNone"""
+        self._expire()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> bool:
+        """ジョブの完了を最大 timeout 秒待つ。完了していればTrue"""
+        if not job.done and timeout > 0:
+            await asyncio.wait([job.task], timeout=timeout)
+        return job.done
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """ジョブを取り消してストアから取り除く。無ければNone"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        self._discard(job_id)
+        job.task.cancel()
+        return job
+
+    def cancel_all(self) -> None:
+        for job in list(self._jobs.values()):
+            job.task.cancel()
+        self._jobs.clear()
+        self._finished.clear()
+
+    def _finish(self, job: Job, task: asyncio.Future) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.opt(exception=error).error(f"ジョブ {job.id} の処理中にエラーが発生しました")
+            job.response = JSONResponse(status_code=500, content={"error": "internal_error"})
+        else:
+            job.response = task.result()
+        job.finished_at = time.monotonic()
+        if job.id in self._jobs:
+            self._finished[job.id] = job.finished_at
+
+    def _discard(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._finished.pop(job_id, None)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at > deadline:
+                break
+            self._discard(job_id)
+            self.expirations += 1
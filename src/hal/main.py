@@ -12,22 +12,155 @@ from .server import HALServer
 @click.option("--fix-reply-daemon", help="固定返答を返すデーモンモード")
 @click.option("--log", help="ログを出力するファイルパス")
 @click.option("--json-dump-log", help="JSONボディをndjson形式で出力するファイル")
-def main(host, port, verbose, fix_reply_daemon, log, json_dump_log):
+@click.option(
+    "--json-dump-fsync",
+    type=click.Choice(["never", "batch", "always"]),
+    default="never",
+    help="JSONダンプのfsync方針 (never: OS任せ, batch: 書き出しごと, always: 1件ごと)"
+)
+@click.option("--queue-depth", default=0, help="処理中に待たせるリクエストの最大件数 (0で即時503)")
+@click.option("--queue-timeout", default=30.0, help="待ち行列での最大待ち時間(秒)。超過時は429")
+@click.option("--cache-size", default=0, help="オペレータの応答をキャッシュする最大件数 (0で無効)")
+@click.option("--cache-ttl", default=3600.0, help="キャッシュした応答の有効期間(秒)")
+@click.option("--cache-file", help="応答キャッシュを保存・読み込みするファイル")
+@click.option(
+    "--replay-from",
+    help="--json-dump-logで記録したndjsonから一致するリクエストに記録済みの応答を返す"
+)
+@click.option(
+    "--max-concurrency", default=1,
+    help="デーモンモードで同時に処理するリクエスト数 (0で無制限、TUIモードでは常に1)"
+)
+@click.option(
+    "--rules", type=click.Path(exists=True, dir_okay=False),
+    help="キーワード・正規表現で自動応答するルールファイル (YAML/JSON)"
+)
+@click.option(
+    "--operator-timeout", type=float,
+    help="オペレータの応答期限(秒)。X-HAL-Timeout ヘッダで1件ごとに変更できる"
+)
+@click.option(
+    "--timeout-fallback",
+    type=click.Choice(["504", "500", "cache", "reply"]),
+    default="504",
+    help="応答期限切れ時の応答 (504/500: エラー, cache: キャッシュした応答, reply: 固定の応答文)"
+)
+@click.option("--timeout-reply", help="--timeout-fallback reply の場合に返す応答文")
+@click.option(
+    "--max-body-size", default="64M",
+    help="リクエストボディの最大サイズ (例: 64M, 512K)。超えた場合は413。0で無制限"
+)
+@click.option(
+    "--max-jobs", default=1000,
+    help="Prefer: respond-async で受け付けて保持するジョブの最大件数"
+)
+@click.option("--job-ttl", default=3600.0, help="完了したジョブの結果を保持する時間(秒)")
+@click.option(
+    "--headless", is_flag=True,
+    help="ローカルのTUIを起動せず、WebSocket (/v1/operators/ws) で接続したオペレータだけが応答する"
+)
+@click.option(
+    "--caller-weight", "caller_weights", multiple=True, metavar="TOKEN=WEIGHT",
+    help="待ち行列で呼び出し元 (Authorizationのトークン) ごとに割り当てる重み。繰り返し指定できる"
+)
+@click.option(
+    "--suggestion-size", default=100000,
+    help="TUIに過去の似た応答を提示するために保持する応答の最大件数"
+)
+@click.option("--workers", default=1, help="デーモンモードで起動するワーカープロセス数")
+@click.option(
+    "--shared-lock", is_flag=True,
+    help="ロックファイルで処理枠をプロセス間で共有し、同時処理数を全ワーカーの合計で制限する"
+)
+def main(
+    host, port, verbose, fix_reply_daemon, log, json_dump_log, json_dump_fsync,
+    queue_depth, queue_timeout, cache_size, cache_ttl, cache_file, replay_from,
+    max_concurrency, rules, operator_timeout, timeout_fallback, timeout_reply,
+    max_body_size, max_jobs, job_ttl, headless, caller_weights, suggestion_size, workers,
+    shared_lock
+):
     """HAL - Humans Are Listening - CLI/TUIアプリケーション"""
     
-    from .utils import setup_logging
+    from .utils import parse_size, parse_weight, setup_logging
+    if workers > 1 or shared_lock:
+        # fcntl の無い環境でも起動できるよう、必要な場合だけ読み込む
+        from .workers import default_lock_file, flock_available, serve_workers
+        if shared_lock and not flock_available():
+            raise click.UsageError(
+                "--shared-lock は flock (fcntl) が使えない環境では使用できません"
+            )
+    
+    if workers > 1:
+        if not fix_reply_daemon:
+            raise click.UsageError("--workers は --fix-reply-daemon と併用してください")
+        if json_dump_log or cache_file:
+            raise click.UsageError(
+                "--workers は --json-dump-log / --cache-file と併用できません"
+            )
+    
+    if timeout_fallback == "reply" and timeout_reply is None:
+        raise click.UsageError("--timeout-fallback reply には --timeout-reply を指定してください")
+    
+    try:
+        max_body_bytes = parse_size(max_body_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--max-body-size")
+    
+    try:
+        weights = dict(parse_weight(value) for value in caller_weights)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--caller-weight")
+    
+    if rules:
+        from .rules import RuleSet
+        try:
+            RuleSet.load(rules)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--rules")
     
     setup_logging(verbose=verbose, log_file=log)
     
     logger.info("HALを起動します")
     
-    server = HALServer(verbose=verbose, fix_reply=fix_reply_daemon, json_dump_log=json_dump_log)
+    server_options = dict(
+        verbose=verbose,
+        fix_reply=fix_reply_daemon,
+        json_dump_log=json_dump_log,
+        json_dump_fsync=json_dump_fsync,
+        queue_depth=queue_depth,
+        queue_timeout=queue_timeout,
+        cache_size=cache_size,
+        cache_ttl=cache_ttl,
+        cache_file=cache_file,
+        replay_from=replay_from,
+        slot_lock_file=default_lock_file(port) if shared_lock else None,
+        max_concurrency=max_concurrency or None,
+        rules_file=rules,
+        operator_timeout=operator_timeout,
+        timeout_fallback=timeout_fallback,
+        timeout_reply=timeout_reply,
+        max_body_size=max_body_bytes or None,
+        max_jobs=max_jobs,
+        job_ttl=job_ttl,
+        headless=headless,
+        caller_weights=weights or None,
+        suggestion_size=suggestion_size
+    )
+    
+    if workers > 1:
+        logger.info(f"HALサーバーを起動します(デーモンモード, {workers}プロセス) - {host}:{port}")
+        serve_workers(server_options, host, port, workers)
+        return
+    
+    server = HALServer(**server_options)
     
     mode = "デーモンモード" if fix_reply_daemon else "通常モード"
     logger.info(f"HALサーバーを起動します({mode}) - {host}:{port}")
     
     if json_dump_log:
         logger.info(f"JSONダンプログを出力します: {json_dump_log}")
+    if replay_from:
+        logger.info(f"記録済みの応答をリプレイします: {replay_from}")
     
     uvicorn.run(server.app, host=host, port=port)
 
@@ -0,0 +1,300 @@
+from bisect import bisect_right
+from typing import Any, List, Optional, Tuple
+
+from rich.cells import cell_len, chop_cells, set_cell_size
+from rich.segment import Segment
+from rich.style import Style
+from textual import events
+from textual.binding import Binding
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+from .utils import normalize_messages
+
+
+class _Item:
+    """MessageList の1件のメッセージと、表示幅ごとに組み立てた本文の行
+
+    group を持つ項目は既読のメッセージをまとめて1行に折りたたんだもので、展開すると
+    group のメッセージに置き換わる。
+    """
+
+    __slots__ = (
+        "number", "role", "text", "line_count", "collapsible", "expanded", "new", "group",
+        "_width", "_lines"
+    )
+
+    def __init__(
+        self,
+        number: int,
+        role: str,
+        text: str,
+        collapsible: bool,
+        new: bool = False,
+        group: Optional[List["_Item"]] = None
+    ):
+        self.number = number
+        self.role = role
+        self.text = text
+        self.line_count = text.count("\n") + 1
+        self.collapsible = collapsible
+        self.expanded = not collapsible
+        self.new = new
+        self.group = group
+        self._width = -1
+        self._lines: List[str] = []
+
+    def lines(self, width: int, preview_lines: int) -> List[str]:
+        """見出しを除いた本文の行。展開時は折り返した全文、折りたたみ時は先頭の数行"""
+        if self._width == width:
+            return self._lines
+        if self.expanded:
+            lines = []
+            for line in _clean(self.text).split("\n"):
+                lines.extend(chop_cells(line, width) if line else [""])
+        else:
+            head = _clean(self.text).split("\n", preview_lines)[:preview_lines]
+            lines = [_crop(line, width) for line in head]
+            lines.append(_crop(f"… 全{self.line_count}行 / {len(self.text)}文字", width))
+        self._width = width
+        self._lines = lines
+        return lines
+
+    def height(self, width: int, preview_lines: int) -> int:
+        if self.group is not None:
+            return 1
+        if not self.expanded:
+            # 折りたたみ時は本文を組み立てずに高さが決まる
+            return 1 + min(self.line_count, preview_lines) + 1
+        return 1 + len(self.lines(width, preview_lines))
+
+    def toggle(self) -> None:
+        self.expanded = not self.expanded
+        self._width = -1
+
+
+def _clean(text: str) -> str:
+    return text.replace("\r", "").replace("\t", "    ")
+
+
+def _crop(line: str, width: int) -> str:
+    if cell_len(line) <= width:
+        return line
+    return set_cell_size(line, max(width - 1, 0)) + "…"
+
+
+class MessageList(ScrollView, can_focus=True):
+    """リクエストのメッセージ列を表示する仮想化したリスト
+
+    TextualのLine APIで画面に見えている行だけを描画するため、メッセージの件数や長さが増えても
+    1画面分の描画にかかる時間は変わらない。collapse_lines 行または collapse_chars 文字を超える
+    メッセージは先頭の preview_lines 行だけを表示し、選択してスペースキー・Enter (またはクリック) で
+    展開する。折りたたんだメッセージは本文を組み立てずに高さが決まるので、表示の準備は
+    メッセージ数に比例するわずかな計算だけで済む。
+
+    回答済みの会話の続きのリクエストでは、既読のメッセージを1行にまとめて折りたたみ、
+    新しいメッセージだけを強調して表示する。
+    """
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "前のメッセージ", show=False),
+        Binding("down", "cursor_down", "次のメッセージ", show=False),
+        Binding("space", "toggle", "展開/折りたたみ", show=False),
+        Binding("enter", "toggle", "展開/折りたたみ", show=False),
+    ]
+
+    COMPONENT_CLASSES = {
+        "message-list--header",
+        "message-list--cursor",
+        "message-list--hint",
+        "message-list--new",
+    }
+
+    DEFAULT_CSS = """
+    MessageList {
+        height: 1fr;
+        scrollbar-gutter: stable;
+        overflow-x: hidden;
+    }
+    MessageList > .message-list--header {
+        color: $accent;
+        text-style: bold;
+    }
+    MessageList > .message-list--cursor {
+        background: $boost;
+        text-style: reverse;
+    }
+    MessageList > .message-list--new {
+        color: $success;
+        text-style: bold;
+    }
+    MessageList > .message-list--hint {
+        color: $text-muted;
+        text-style: italic;
+    }
+    """
+
+    # 折りたたむメッセージの行数・文字数と、折りたたみ時に表示する行数
+    collapse_lines = 8
+    collapse_chars = 1000
+    preview_lines = 3
+
+    def __init__(self, *, id: Optional[str] = None, classes: Optional[str] = None):
+        super().__init__(id=id, classes=classes)
+        self._items: List[_Item] = []
+        # メッセージごとの先頭行の位置 (累積の行数)
+        self._starts: List[int] = []
+        self._total = 0
+        self._layout_width = 0
+        self._message_count = 0
+        # 既読のメッセージ数。既読の行を展開した後も、これより後のメッセージを新規として強調する
+        self._seen = 0
+        self.cursor = 0
+
+    @property
+    def item_count(self) -> int:
+        return len(self._items)
+
+    def is_expanded(self, index: int) -> bool:
+        return self._items[index].expanded
+
+    def set_messages(self, messages: List[Any], seen: int = 0) -> None:
+        """表示するメッセージ列 (pydanticモデルまたはdict) を差し替える
+
+        seen に既読のメッセージ数を渡すと、先頭の seen 件を1行にまとめて折りたたみ、
+        残りを新しいメッセージとして強調し、その先頭を選択する。
+        それ以外の場合は最後のメッセージを選択する。
+        """
+        if seen >= len(messages):
+            seen = 0
+        items = []
+        for number, (role, text) in enumerate(normalize_messages(messages), 1):
+            collapsible = (
+                len(text) > self.collapse_chars
+                or text.count("\n", 0, self.collapse_chars) >= self.collapse_lines
+            )
+            items.append(
+                _Item(number, str(role or ""), text, collapsible, new=number > seen)
+            )
+        self._message_count = len(items)
+        self._seen = seen
+        if seen:
+            group = _Item(0, "", "", collapsible=True, group=items[:seen])
+            self._items = [group] + items[seen:]
+            self.cursor = 1
+        else:
+            self._items = items
+            self.cursor = max(len(items) - 1, 0)
+        self._relayout()
+        if self._items:
+            self.scroll_to(y=self._starts[self.cursor], animate=False, force=True, immediate=True)
+
+    def _content_width(self) -> int:
+        return max(self.scrollable_content_region.width, 1)
+
+    def _relayout(self) -> None:
+        width = self._content_width()
+        self._layout_width = width
+        starts = []
+        total = 0
+        for item in self._items:
+            starts.append(total)
+            total += item.height(width, self.preview_lines)
+        self._starts = starts
+        self._total = total
+        self.virtual_size = Size(width, total)
+        self.refresh()
+
+    def on_resize(self, event: events.Resize) -> None:
+        if self._content_width() != self._layout_width:
+            self._relayout()
+
+    def _header(self, item: _Item) -> str:
+        if item.group is not None:
+            return f"▶ 前回までのメッセージ {len(item.group)}件 (Spaceで展開)"
+        marker = " "
+        if item.collapsible:
+            marker = "▼" if item.expanded else "▶"
+        label = " 新規" if item.new and self._seen else ""
+        return f"{marker} [{item.number}/{self._message_count}]{label} {item.role}"
+
+    def _line(self, line_no: int) -> Tuple[str, Style]:
+        index = bisect_right(self._starts, line_no) - 1
+        item = self._items[index]
+        offset = line_no - self._starts[index]
+        if offset == 0:
+            delta = item.new and self._seen
+            style = self.get_component_rich_style(
+                "message-list--new" if delta else "message-list--header"
+            )
+            if item.group is not None:
+                style = self.get_component_rich_style("message-list--hint")
+            if index == self.cursor and self.has_focus:
+                style += self.get_component_rich_style("message-list--cursor")
+            return self._header(item), style
+        lines = item.lines(self._layout_width, self.preview_lines)
+        if not item.expanded and offset == len(lines):
+            return lines[-1], self.get_component_rich_style("message-list--hint")
+        return lines[offset - 1], self.rich_style
+
+    def render_line(self, y: int) -> Strip:
+        width = self._content_width()
+        line_no = self.scroll_offset.y + y
+        if line_no >= self._total:
+            return Strip.blank(width, self.rich_style)
+        text, style = self._line(line_no)
+        text = _crop(text, width)
+        return Strip([Segment(text, style)], cell_len(text)).extend_cell_length(
+            width, self.rich_style
+        )
+
+    def _scroll_to_cursor(self) -> None:
+        start = self._starts[self.cursor]
+        end = start + self._items[self.cursor].height(self._layout_width, self.preview_lines)
+        height = self.scrollable_content_region.height
+        if start < self.scroll_y or end - start > height:
+            self.scroll_to(y=start, animate=False, force=True, immediate=True)
+        elif end > self.scroll_y + height:
+            self.scroll_to(y=end - height, animate=False, force=True, immediate=True)
+        self.refresh()
+
+    def action_cursor_up(self) -> None:
+        if self._items and self.cursor > 0:
+            self.cursor -= 1
+            self._scroll_to_cursor()
+
+    def action_cursor_down(self) -> None:
+        if self._items and self.cursor < len(self._items) - 1:
+            self.cursor += 1
+            self._scroll_to_cursor()
+
+    def action_toggle(self) -> None:
+        """選択中のメッセージを展開・折りたたむ"""
+        if not self._items or not self._items[self.cursor].collapsible:
+            return
+        item = self._items[self.cursor]
+        if item.group is not None:
+            # 既読のメッセージを元の位置に戻し、強調は続けて表示する
+            self._items[self.cursor:self.cursor + 1] = item.group
+        else:
+            item.toggle()
+        self._relayout()
+        self._scroll_to_cursor()
+
+    def on_click(self, event: events.Click) -> None:
+        offset = event.get_content_offset(self)
+        if offset is None or not self._items:
+            return
+        line_no = self.scroll_offset.y + offset.y
+        if line_no >= self._total:
+            return
+        self.cursor = bisect_right(self._starts, line_no) - 1
+        self.action_toggle()
+        self.refresh()
+
+    def on_focus(self) -> None:
+        self.refresh()
+
+    def on_blur(self) -> None:
+        self.refresh()
@@ -0,0 +1,130 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0
+)
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """単調増加するカウンター。ラベルの値ごとに数える"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: Dict[str, float] = {}
+
+    def inc(self, label_value: str = "", amount: float = 1) -> None:
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self) -> List[str]:
+        lines = []
+        for label_value, value in sorted(self.values.items()):
+            labels = ((self.label, label_value),) if self.label else ()
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """スクレイプ時に関数を呼んで現在値を得るゲージ"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.function())}"]
+
+
+class FunctionCounter(Gauge):
+    """スクレイプ時に関数を呼んで累計値を得るカウンター。他のオブジェクトが数えている件数を公開する"""
+
+    type = "counter"
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスをまとめ、Prometheusのテキスト形式で出力する"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        return self._register(Counter(name, help, label))
+
+    def gauge(self, name: str, help: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, help, function))
+
+    def counter_function(
+        self, name: str, help: str, function: Callable[[], float]
+    ) -> FunctionCounter:
+        return self._register(FunctionCounter(name, help, function))
+
+    def histogram(self, name: str, help: str,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
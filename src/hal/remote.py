@@ -0,0 +1,169 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from .utils import normalize_messages
+
+# オペレータが返せる応答以外の判定 (TUIの F1/F2/F3 に対応)
+VERDICTS = ("cannot_answer", "internal_error", "forbidden")
+
+
+class OperatorDisconnected(Exception):
+    """リクエストを処理中のリモートオペレータが切断した"""
+
+
+def encode_frame(frame: Dict[str, Any]) -> str:
+    return json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+
+
+class RemoteConsole:
+    """WebSocketで接続したオペレータのコンソール
+
+    リクエストを request フレームで送り、コンソールから reply (応答文) または
+    verdict (対応不可・内部エラー・権限なし) のフレームが届くまで待つ。
+    フレームはすべて1行のJSONで、次のものをやり取りする。
+
+    サーバー → コンソール:
+        {"type": "hello", "operator": 名前, "heartbeat": 秒}
+        {"type": "request", "id": ID, "model": ..., "messages": [[role, 本文], ...],
+         "max_tokens": ..., "temperature": ..., "stream": bool, "seen": 既読数,
+         "suggestions": [...]}
+        {"type": "cancel", "id": ID}  (応答期限切れ・クライアントの切断でリクエストを取り下げた)
+        {"type": "ping"}
+    コンソール → サーバー:
+        {"type": "reply", "id": ID, "content": 応答文}
+        {"type": "verdict", "id": ID, "error": "cannot_answer" | "internal_error" | "forbidden"}
+        {"type": "draft", "id": ID, "content": 入力中の応答文}  (stream が true の場合のみ)
+        {"type": "pong"}
+
+    Args:
+        websocket: accept() 済みのWebSocket
+        name: オペレータ名
+    """
+
+    def __init__(self, websocket: WebSocket, name: str):
+        self.websocket = websocket
+        self.name = name
+        self.closed = False
+        # リクエストID -> (応答を受け取るFuture, 入力中の応答文の通知先)
+        self._pending: Dict[str, Tuple[asyncio.Future, Optional[Callable[[str], None]]]] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(encode_frame(frame))
+
+    async def _send_quietly(self, frame: Dict[str, Any]) -> None:
+        try:
+            await self.send(frame)
+        except Exception as e:
+            logger.debug(f"オペレータ {self.name} への送信に失敗しました: {e}")
+
+    async def ask(
+        self,
+        request: Any,
+        on_update: Optional[Callable[[str], None]] = None,
+        suggestions: Optional[List[str]] = None,
+        seen_messages: int = 0
+    ) -> Dict[str, Any]:
+        """リクエストをコンソールに送り、応答結果を返す (tui_fix.process_request と同じ形)
+
+        Raises:
+            OperatorDisconnected: 応答の前にコンソールが切断した
+        """
+        if self.closed:
+            raise OperatorDisconnected(self.name)
+        request_id = uuid.uuid4().hex[:12]
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, on_update)
+        try:
+            await self.send({
+                "type": "request",
+                "id": request_id,
+                "model": request.model,
+                "messages": normalize_messages(request.messages),
+                "max_tokens": request.max_tokens,
+                "temperature": request.temperature,
+                "stream": on_update is not None,
+                "seen": seen_messages,
+                "suggestions": suggestions or []
+            })
+            return await future
+        except asyncio.CancelledError:
+            if not self.closed:
+                asyncio.ensure_future(self._send_quietly({"type": "cancel", "id": request_id}))
+            raise
+        except WebSocketDisconnect:
+            raise OperatorDisconnected(self.name) from None
+        finally:
+            self._pending.pop(request_id, None)
+
+    def dispatch(self, text: str) -> None:
+        """コンソールから届いたフレームを処理する。不正なフレームは警告して無視する"""
+        try:
+            frame = json.loads(text)
+            kind = frame["type"]
+        except (ValueError, TypeError, KeyError):
+            logger.warning(f"オペレータ {self.name} から不正なフレームを受信しました")
+            return
+        if kind == "pong":
+            return
+        pending = self._pending.get(frame.get("id"))
+        if pending is None:
+            # 取り下げ済みのリクエストへの応答
+            return
+        future, on_update = pending
+        content = frame.get("content")
+        if kind == "draft" and isinstance(content, str):
+            if on_update is not None:
+                on_update(content)
+        elif kind == "reply" and isinstance(content, str):
+            if not future.done():
+                future.set_result({"content": content})
+        elif kind == "verdict" and frame.get("error") in VERDICTS:
+            if not future.done():
+                future.set_result({"error": frame["error"]})
+        else:
+            logger.warning(f"オペレータ {self.name} から不正なフレームを受信しました: {kind}")
+
+    async def serve(self, heartbeat_interval: float) -> None:
+        """切断されるまでフレームを受信する。終了後は呼び出し元が close() する
+
+        heartbeat_interval ごとに ping を送り、その2倍の時間何も届かなければ切断したとみなす。
+        """
+        heartbeat = asyncio.ensure_future(self._heartbeat(heartbeat_interval))
+        try:
+            while True:
+                message = await asyncio.wait_for(
+                    self.websocket.receive(), heartbeat_interval * 2
+                )
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is not None:
+                    self.dispatch(message["text"])
+        except asyncio.TimeoutError:
+            logger.warning(f"オペレータ {self.name} からの応答が途絶えたため切断します")
+            try:
+                await self.websocket.close(code=1001)
+            except Exception:
+                pass
+        except WebSocketDisconnect:
+            pass
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self._send_quietly({"type": "ping"})
+
+    def close(self) -> None:
+        """切断を記録し、処理中のリクエストを OperatorDisconnected で終わらせる"""
+        self.closed = True
+        for future, _ in list(self._pending.values()):
+            if not future.done():
+                future.set_exception(OperatorDisconnected(self.name))
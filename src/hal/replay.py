@@ -0,0 +1,108 @@
+import json
+import mmap
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from .utils import conversation_key
+
+# JsonDumpWriterが書くレコードの先頭部分 ({"type": ..., "id": ...)
+_HEADER = re.compile(rb'\{"type": "(request|response)"(?:, "id": "([^"]*)")?')
+# 応答期限切れの記録。オペレータの応答ではないため索引しない
+_TIMEOUT = re.compile(rb', "data": \{"error": "timeout"\}')
+
+_ERRORS = ("cannot_answer", "internal_error", "forbidden")
+
+
+class ReplayIndex:
+    """--json-dump-log で記録したndjsonから、リクエスト→記録済み応答の索引を作る
+
+    ファイルはメモリマップして走査し、全体を読み込まない。
+    リクエスト行だけを解析して会話ハッシュを求め、応答行はファイル上の位置だけを記録しておき、
+    一致したときに初めて解析する。同じ会話が複数回記録されている場合は最後の応答を使う。
+    応答期限切れ ({"error": "timeout"}) の記録は、それ以前の応答を上書きしないよう読み飛ばす。
+    リクエストと応答はレコードのidで対応付け、idの無い古い記録は直前のリクエストと対応付ける。
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        # 会話ハッシュ -> 応答行の (開始位置, 終了位置)
+        self._offsets: Dict[str, tuple] = {}
+        self._file = open(file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空ファイルはメモリマップできない
+            self._map = None
+
+        started = time.monotonic()
+        self._build()
+        logger.info(
+            f"リプレイ索引を作成しました: {len(self._offsets)}件 "
+            f"({time.monotonic() - started:.2f}秒) - {file_path}"
+        )
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _build(self) -> None:
+        if self._map is None:
+            return
+        data = self._map
+        size = len(data)
+        pending_by_id: Dict[str, str] = {}
+        last_request: Optional[str] = None
+        pos = 0
+        while pos < size:
+            end = data.find(b"\n", pos)
+            if end == -1:
+                end = size
+            header = _HEADER.match(data, pos, end)
+            if header is not None:
+                record_type, record_id = header.group(1), header.group(2)
+                if record_type == b"request":
+                    key = self._request_key(data[pos:end])
+                    if record_id is not None:
+                        pending_by_id[record_id.decode()] = key
+                    else:
+                        last_request = key
+                else:
+                    if record_id is not None:
+                        key = pending_by_id.pop(record_id.decode(), None)
+                    else:
+                        key, last_request = last_request, None
+                    if key is not None and not _TIMEOUT.match(data, header.end(), end):
+                        self._offsets[key] = (pos, end)
+            pos = end + 1
+
+    @staticmethod
+    def _request_key(line: bytes) -> Optional[str]:
+        try:
+            request = json.loads(line)["data"]
+            return conversation_key(request["model"], request["messages"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def lookup(self, model: str, messages: List[Any]) -> Optional[Dict[str, Any]]:
+        """記録済みの応答を、オペレータの応答と同じ形式 ({"content"} / {"error"}) で返す"""
+        offsets = self._offsets.get(conversation_key(model, messages))
+        if offsets is None:
+            self.misses += 1
+            return None
+
+        start, end = offsets
+        data = json.loads(self._map[start:end])["data"]
+        self.hits += 1
+        if "error" in data:
+            error = data["error"]
+            return {"error": error if error in _ERRORS else "internal_error"}
+        return {"content": data.get("content", "")}
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
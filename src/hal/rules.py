@@ -0,0 +1,220 @@
+import json
+import re
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .utils import message_text
+
+_ERRORS = ("cannot_answer", "internal_error", "forbidden")
+_ROLES = ("user", "system", "assistant", "any")
+_KEYS = {"name", "keywords", "regex", "ignore_case", "role", "model", "reply", "error"}
+
+
+class AhoCorasick:
+    """複数のキーワードを1回の走査でまとめて探すAho-Corasickオートマトン
+
+    走査にかかる時間は本文の長さと一致件数に比例し、キーワードの数にはよらない。
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, int]]):
+        # 状態ごとの遷移・失敗遷移・その状態で見つかるキーワードの値
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for keyword, value in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(value)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[int]:
+        """text に含まれるキーワードの値を返す"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class Rule:
+    """1件の自動応答ルール"""
+
+    def __init__(self, index: int, data: Dict[str, Any]):
+        if not isinstance(data, dict):
+            raise ValueError(f"ルール{index + 1}: オブジェクトである必要があります")
+        self.name = str(data.get("name", f"rule-{index + 1}"))
+        unknown = set(data) - _KEYS
+        if unknown:
+            raise ValueError(f"ルール {self.name}: 不明なキー {sorted(unknown)}")
+
+        self.index = index
+        self.keywords = [keyword.casefold() for keyword in _as_list(data.get("keywords"))]
+        flags = re.IGNORECASE if data.get("ignore_case") else 0
+        try:
+            self.patterns = [re.compile(pattern, flags) for pattern in _as_list(data.get("regex"))]
+        except re.error as e:
+            raise ValueError(f"ルール {self.name}: 正規表現が不正です: {e}") from e
+        self.role = data.get("role", "user")
+        if self.role not in _ROLES:
+            raise ValueError(f"ルール {self.name}: role は {', '.join(_ROLES)} のいずれかです")
+        self.models = _as_list(data.get("model"))
+
+        if ("reply" in data) == ("error" in data):
+            raise ValueError(f"ルール {self.name}: reply と error のどちらか一方を指定してください")
+        if "error" in data:
+            if data["error"] not in _ERRORS:
+                raise ValueError(
+                    f"ルール {self.name}: error は {', '.join(_ERRORS)} のいずれかです"
+                )
+            self.result = {"error": data["error"]}
+        else:
+            self.result = {"content": str(data["reply"])}
+
+    def matches_model(self, model: str) -> bool:
+        return not self.models or any(fnmatchcase(model, pattern) for pattern in self.models)
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [str(item) for item in value]
+
+
+class _RoleGroup:
+    """同じ role を対象とするルールのキーワードと正規表現をまとめたもの"""
+
+    def __init__(self, rules: List[Rule]):
+        keywords = [(keyword, rule.index) for rule in rules for keyword in rule.keywords]
+        self.automaton = AhoCorasick(keywords) if keywords else None
+        self.regex_rules = [rule for rule in rules if rule.patterns]
+        patterns = [pattern for rule in self.regex_rules for pattern in rule.patterns]
+        # グループを含む正規表現は結合するとグループの番号がずれ、後方参照が別のグループを
+        # 指してしまうため、結合せずに個別に評価する
+        self.separate = [pattern for pattern in patterns if pattern.groups]
+        patterns = [pattern for pattern in patterns if not pattern.groups]
+        self.combined = None
+        if patterns:
+            try:
+                self.combined = re.compile(
+                    "|".join(f"(?:{pattern.pattern})" for pattern in patterns),
+                    re.IGNORECASE if any(p.flags & re.IGNORECASE for p in patterns) else 0
+                )
+            except re.error:
+                # インラインフラグなどで結合できない場合は個別に評価する
+                self.separate.extend(patterns)
+
+    def _regex_may_match(self, text: str) -> bool:
+        if self.combined is not None and self.combined.search(text):
+            return True
+        return any(pattern.search(text) for pattern in self.separate)
+
+    def search(self, text: str) -> Set[int]:
+        found = self.automaton.search(text.casefold()) if self.automaton else set()
+        if self.regex_rules and self._regex_may_match(text):
+            for rule in self.regex_rules:
+                if any(pattern.search(text) for pattern in rule.patterns):
+                    found.add(rule.index)
+        return found
+
+
+class RuleSet:
+    """起動時にまとめてコンパイルした自動応答ルール
+
+    ルールは上から順に優先され、最初に一致したルールの応答 (reply) またはエラー (error) を返す。
+    キーワード (大文字小文字を区別しない部分一致) は role ごとに1つのAho-Corasickオートマトンに、
+    正規表現は1つの結合した正規表現にまとめるため、ルールの数によらず本文を1回走査するだけで判定できる。
+    結合した正規表現は一致の有無の判定に使い、一致した時だけ個々の正規表現でどのルールかを調べる。
+    グループを含む正規表現は、後方参照の番号がずれないよう結合せずに個別に評価する。
+
+    ルールのキー:
+        name: ルール名 (ログとメトリクスに使う)
+        keywords: 部分一致させる文字列 (文字列またはリスト)
+        regex: 一致させる正規表現 (文字列またはリスト)。ignore_case: true で大文字小文字を区別しない
+        role: 対象のメッセージ。user / system / assistant はその role の最後のメッセージ、
+            any は全メッセージ (既定: user)
+        model: 対象のモデル名 (文字列またはリスト、* などのワイルドカード可)
+        reply: 返す応答文
+        error: 返すエラー (cannot_answer / internal_error / forbidden)
+    keywords と regex はどちらかに一致すればよく、両方省略した場合は model だけで判定する。
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = [Rule(index, data) for index, data in enumerate(rules)]
+        self._unconditional = {
+            rule.index for rule in self.rules if not rule.keywords and not rule.patterns
+        }
+        self._groups = {
+            role: _RoleGroup([rule for rule in self.rules if rule.role == role])
+            for role in _ROLES
+            if any(rule.role == role and (rule.keywords or rule.patterns) for rule in self.rules)
+        }
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @classmethod
+    def load(cls, file_path: str) -> "RuleSet":
+        """YAML (.yaml / .yml) またはJSONのルールファイルを読み込む
+
+        ファイルはルールのリスト、または {"rules": [...]} の形式
+        """
+        with open(file_path, "r", encoding="utf-8") as f:
+            if file_path.endswith((".yaml", ".yml")):
+                import yaml
+                try:
+                    data = yaml.safe_load(f)
+                except yaml.YAMLError as e:
+                    raise ValueError(f"ルールファイルを解析できません: {e}") from e
+            else:
+                data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get("rules")
+        if not isinstance(data, list):
+            raise ValueError(f"ルールファイルにルールのリストがありません: {file_path}")
+        return cls(data)
+
+    @staticmethod
+    def _text(messages: List[Any], role: str) -> str:
+        if role == "any":
+            return "\n".join(message_text(message.content) for message in messages)
+        for message in reversed(messages):
+            if message.role == role:
+                return message_text(message.content)
+        return ""
+
+    def match(self, model: str, messages: List[Any]) -> Optional[Rule]:
+        """最初に一致したルールを返す。一致しなければNone"""
+        candidates = set(self._unconditional)
+        for role, group in self._groups.items():
+            candidates |= group.search(self._text(messages, role))
+        for index in sorted(candidates):
+            rule = self.rules[index]
+            if rule.matches_model(model):
+                return rule
+        return None
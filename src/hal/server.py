@@ -1,16 +1,37 @@
-import threading
+import asyncio
+import heapq
+import itertools
+import json
 import time
 import uuid
-from typing import Any, Dict, List, Optional, Union
+from functools import partial
+from typing import (
+    Annotated,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, WebSocket
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from loguru import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-request_lock = threading.Lock()
+from .jobs import JobStore
+from .metrics import MetricsRegistry
+from .remote import OperatorDisconnected, RemoteConsole
+from .tokenizer import TokenCounter, Tokenizer
+from .utils import conversation_key, message_text, truncate_for_log
+
 
 class MessageContentPart(BaseModel):
     type: str
@@ -23,38 +44,692 @@ class Message(BaseModel):
 class ChatCompletionRequest(BaseModel):
     model: str
     messages: List[Message]
+    # 応答を切り詰めるのはクライアントが指定した場合だけ (_max_tokens)。既定値はTUIの表示用
     max_tokens: int = 1000
     temperature: float = 0.7
+    stream: bool = False
+    stream_options: Optional[Dict[str, Any]] = None
+
+def _max_tokens(request: ChatCompletionRequest) -> Optional[int]:
+    """応答の上限トークン数。max_tokens が指定されていなければ切り詰めないためNone"""
+    return request.max_tokens if "max_tokens" in request.model_fields_set else None
+
+def _new_completion_id() -> str:
+    return f"chatcmpl-{uuid.uuid4().hex[:5]}"
 
 class ChatCompletionResponse(BaseModel):
-    id: str = Field(default_factory=lambda: f"chatcmpl-{uuid.uuid4().hex[:5]}")
+    id: str = Field(default_factory=_new_completion_id)
     object: str = "chat.completion"
     created: int = Field(default_factory=lambda: int(time.time()))
     model: str
     choices: List[Dict[str, Any]]
+    usage: Optional[Dict[str, int]] = None
+
+UpdateCallback = Callable[[str], None]
+Handler = Callable[..., Awaitable[Dict[str, Any]]]
+
+# 応答期限を過ぎた時に返すもの: 504 / 500 エラー、キャッシュ済みの応答、固定の応答文
+TIMEOUT_FALLBACKS = ("504", "500", "cache", "reply")
+
+class ConcurrencyLimiter:
+    """オペレータが同時に処理するリクエスト数を制限する処理枠
+
+    イベントループ内だけで使うため、スレッドのロックは取らずに処理中の件数だけを数える。
+    枠が空くのを待つ処理は AdmissionQueue がasyncioのFutureで行う。
+
+    Args:
+        limit: 同時に処理する最大件数。Noneなら無制限
+    """
+
+    def __init__(self, limit: Optional[int] = 1):
+        self.limit = limit
+        self.in_use = 0
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """枠を確保する。イベントループを止めないよう、空きが無ければ待たずにFalseを返す"""
+        if self.locked():
+            return False
+        self.in_use += 1
+        return True
+
+    def release(self) -> None:
+        if self.in_use <= 0:
+            raise RuntimeError("確保されていない枠を解放しようとしました")
+        self.in_use -= 1
+
+    def locked(self) -> bool:
+        """全ての枠が使用中ならTrue"""
+        return self.limit is not None and self.in_use >= self.limit
+
+class Operator:
+    """リクエストに応答するオペレータ(ローカルTUI、接続されたコンソール、固定返答など)
+
+    オペレータごとに処理枠(slot)を持ち、枠が空いている時だけリクエストを割り当てる。
+    枠は既定で1件 (仕様どおり処理中は他のリクエストを受け付けない) で、
+    ConcurrencyLimiter や workers.FileSlot を渡して同時処理数や排他の範囲を変えられる。
+    """
+
+    def __init__(self, name: str, handler: Handler, slot=None):
+        self.name = name
+        self.handler = handler
+        self.slot = slot if slot is not None else ConcurrencyLimiter(1)
+        self.handled = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def busy(self) -> bool:
+        return self.slot.locked()
+
+    async def handle(
+        self, request: ChatCompletionRequest, on_update: Optional[UpdateCallback] = None
+    ) -> Dict[str, Any]:
+        """リクエストをハンドラに渡し、結果を返す
+
+        Args:
+            request: 処理するリクエスト
+            on_update: 作成途中の応答文を受け取るコールバック(ストリーミング時のみ)
+        """
+        started = time.monotonic()
+        try:
+            return await self.handler(request, on_update=on_update)
+        finally:
+            self.handled += 1
+            self.busy_seconds += time.monotonic() - started
+
+class OperatorPool:
+    """オペレータの集合。空いているオペレータのうち最も負荷の少ないものに割り当てる"""
+
+    def __init__(self, operators: Optional[List[Operator]] = None):
+        self.operators: List[Operator] = list(operators or [])
+
+    def add(self, operator: Operator) -> None:
+        self.operators.append(operator)
+
+    def remove(self, operator: Operator) -> None:
+        if operator in self.operators:
+            self.operators.remove(operator)
+
+    @property
+    def idle_count(self) -> int:
+        return sum(1 for operator in self.operators if not operator.busy)
+
+    def try_acquire(self) -> Optional[Operator]:
+        """空いているオペレータの枠を確保する。全員が処理中ならNoneを返す"""
+        for operator in sorted(self.operators, key=lambda o: (o.busy_seconds, o.handled)):
+            if operator.slot.acquire(blocking=False):
+                return operator
+        return None
+
+class SchedulingKey(NamedTuple):
+    """待ち行列での順番を決める、リクエストごとの情報
+
+    Attributes:
+        priority: 優先度。大きいほど先に割り当てる (X-HAL-Priority ヘッダ)
+        deadline: 応答期限 (time.monotonic() の値)。同じ呼び出し元の中では期限の早い順に割り当てる
+        caller: 呼び出し元 (Authorization ヘッダのトークン)。呼び出し元ごとに公平に割り当てる
+    """
+
+    priority: int = 0
+    deadline: Optional[float] = None
+    caller: str = ""
+
+class _Flow:
+    """優先度と呼び出し元ごとの待ち手の列 (期限・到着順のヒープ)"""
+
+    __slots__ = ("key", "weight", "finish", "scheduled", "waiters")
+
+    def __init__(self, key: Tuple[int, str], weight: float):
+        self.key = key
+        self.weight = weight
+        # 重み付き公平キューイングの仮想終了時刻
+        self.finish = 0.0
+        self.scheduled = False
+        self.waiters: List[Tuple[float, int, asyncio.Future]] = []
+
+class AdmissionQueue:
+    """オペレータの空き待ちを優先度・呼び出し元ごとの公平さ・期限の順に並べる待ち行列
+
+    全オペレータが処理中の間に届いたリクエストを最大 max_depth 件まで待たせ、
+    オペレータが空いた時点で次の待ち手へ枠を確保したまま直接引き渡す。
+
+    次の待ち手は、優先度の高いものから順に、同じ優先度の中では呼び出し元ごとの
+    重み付き公平キューイング (自己クロック型のWFQ) で選ぶ。呼び出し元は待ち手の列の先頭に
+    仮想終了時刻 (max(仮想時刻, 前回の終了時刻) + 1/重み) を付けてヒープに並び、
+    最も早いものから割り当てられるため、大量に送る呼び出し元がいても他の呼び出し元は
+    重みに応じた割合で割り当てられる。同じ呼び出し元の中では応答期限の早いもの、
+    次に到着の早いものから割り当てる。追加と取り出しはどちらも O(log n) で、
+    待ち時間切れなどで抜けた待ち手は取り出す時に読み飛ばす。
+
+    Args:
+        weights: 呼び出し元 (SchedulingKey.caller) ごとの重み。指定の無い呼び出し元は1
+        poll_interval: 待ち手がいる間に空いたオペレータを探す間隔(秒)。他のプロセスと共有する枠
+            (workers.FileSlot) は解放されても通知が届かないため、その場合に指定する
+    """
+
+    def __init__(
+        self,
+        pool: OperatorPool,
+        max_depth: int = 0,
+        max_wait: Optional[float] = None,
+        weights: Optional[Dict[str, float]] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.pool = pool
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self.weights = dict(weights or {})
+        for weight in self.weights.values():
+            if weight <= 0:
+                raise ValueError(f"重みは正の数を指定してください: {weight}")
+        # 待ち手のいる (または読み飛ばす待ち手の残っている) 優先度・呼び出し元ごとの列
+        self._flows: Dict[Tuple[int, str], _Flow] = {}
+        # (-優先度, 仮想終了時刻, 追加順, 列) のヒープ。1つの列は高々1回だけ並ぶ
+        self._schedule: List[Tuple[int, float, int, _Flow]] = []
+        self._virtual_time = 0.0
+        self._depth = 0
+        self._sequence = itertools.count()
+        self.poll_interval = poll_interval
+        self._poller: Optional[asyncio.Future] = None
+
+    @property
+    def depth(self) -> int:
+        """現在の待ち件数"""
+        return self._depth
+
+    async def acquire(
+        self, key: SchedulingKey = SchedulingKey()
+    ) -> Tuple[Optional[Operator], Optional[int]]:
+        """オペレータを確保する
+
+        Returns:
+            (確保したオペレータ, None)、確保できなかった場合は (None, 返すべきHTTPステータスコード)
+            待ち行列が満杯なら503、待ち時間切れなら429
+        """
+        if not self._depth:
+            operator = self.pool.try_acquire()
+            if operator is not None:
+                return operator, None
+
+        if self._depth >= self.max_depth:
+            return None, 503
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(key, future)
+        try:
+            operator = await asyncio.wait_for(future, self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 枠を受け取った直後にタイムアウト・キャンセルされた場合は次へ回す
+                self.release(future.result())
+            else:
+                # ヒープに残った待ち手は取り出す時に読み飛ばす
+                future.cancel()
+                self._depth -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                return None, 429
+            raise
+        return operator, None
+
+    def _enqueue(self, key: SchedulingKey, future: asyncio.Future) -> None:
+        flow_key = (key.priority, key.caller)
+        flow = self._flows.get(flow_key)
+        if flow is None:
+            flow = self._flows[flow_key] = _Flow(flow_key, self.weights.get(key.caller, 1.0))
+        deadline = float("inf") if key.deadline is None else key.deadline
+        heapq.heappush(flow.waiters, (deadline, next(self._sequence), future))
+        self._depth += 1
+        if not flow.scheduled:
+            self._push(flow)
+        if self.poll_interval is not None and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self) -> None:
+        """待ち手がいる間、poll_interval ごとに空いたオペレータを探して引き渡す"""
+        while self._depth:
+            await asyncio.sleep(self.poll_interval)
+            self.dispatch()
+
+    def _push(self, flow: _Flow) -> None:
+        """列の先頭の待ち手に仮想終了時刻を付けてヒープに並べる"""
+        flow.finish = max(self._virtual_time, flow.finish) + 1.0 / flow.weight
+        flow.scheduled = True
+        heapq.heappush(self._schedule, (-flow.key[0], flow.finish, next(self._sequence), flow))
+
+    @staticmethod
+    def _discard_abandoned(flow: _Flow) -> None:
+        while flow.waiters and flow.waiters[0][2].done():
+            heapq.heappop(flow.waiters)
+
+    def _pop_waiter(self) -> Optional[asyncio.Future]:
+        """次に割り当てる待ち手を取り出す。いなければNone"""
+        while self._schedule:
+            _, finish, _, flow = heapq.heappop(self._schedule)
+            flow.scheduled = False
+            self._discard_abandoned(flow)
+            if not flow.waiters:
+                # 全員が抜けた列は、割り当てなかった分を負担させずに忘れる
+                del self._flows[flow.key]
+                continue
+            _, _, future = heapq.heappop(flow.waiters)
+            self._virtual_time = finish
+            self._discard_abandoned(flow)
+            if flow.waiters:
+                self._push(flow)
+            else:
+                del self._flows[flow.key]
+            return future
+        return None
+
+    def release(self, operator: Operator) -> None:
+        """オペレータの枠を解放する。待ち手がいれば枠を確保したまま引き渡す"""
+        if operator not in self.pool.operators:
+            # 切断などで外されたオペレータは引き渡さず、空いている別のオペレータを探す
+            operator.slot.release()
+            self.dispatch()
+            return
+        future = self._pop_waiter()
+        if future is not None:
+            self._depth -= 1
+            future.set_result(operator)
+            return
+        operator.slot.release()
+
+    def dispatch(self) -> None:
+        """空いているオペレータを待ち手に引き渡す。オペレータが加わった時に呼ぶ"""
+        while self._depth:
+            operator = self.pool.try_acquire()
+            if operator is None:
+                return
+            self.release(operator)
+
+class SingleFlight:
+    """同じキーの処理が実行中なら新たに始めず、その結果を共有する
+
+    処理は呼び出し元とは別のタスクで実行し、待っている呼び出し元が全員いなくなった時だけ取り消す。
+    """
+
+    def __init__(self):
+        # key -> [実行中のタスク, 待っている呼び出し元の数]
+        self._calls: Dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """key の処理結果を返す
+
+        Returns:
+            (処理結果, 実行中の処理の結果を共有したかどうか)
+        """
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            task = asyncio.ensure_future(factory())
+            call = self._calls[key] = [task, 0]
+
+            def forget(_):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+            task.add_done_callback(forget)
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                task.cancel()
 
 def authenticate(token: Optional[str] = Header(None, alias="Authorization")) -> bool:
     return True
 
+def _sse_event(data: Any) -> bytes:
+    """Server-Sent Eventsのdataフレームを組み立てる"""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"data: {data}\n\n".encode("utf-8")
+
+def _chunk_event(
+    request: ChatCompletionRequest,
+    completion_id: str,
+    created: int,
+    delta: Dict[str, Any],
+    finish_reason: Optional[str] = None
+) -> bytes:
+    """chat.completion.chunk のSSEフレームを組み立てる"""
+    return _sse_event({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": request.model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    })
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """送信の終了時に on_close を呼ぶ StreamingResponse
+
+    本文の送信を始める前にクライアントが切断した場合、Starletteはジェネレータを一度も実行せずに
+    終わるため、ジェネレータの finally では後始末ができない。
+    """
+
+    def __init__(self, content: Any, on_close: Callable[[], Any], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+def _last_user_text(request: ChatCompletionRequest) -> str:
+    """最後のuserメッセージの本文を返す"""
+    for message in reversed(request.messages):
+        if message.role == "user":
+            return message_text(message.content)
+    return ""
+
+async def _debug_log_request(request: Request) -> None:
+    """リクエストヘッダーとボディをDEBUGレベルで記録する
+
+    DEBUGが出力されない設定では整形を行わないよう遅延評価し、大きなボディは切り詰める。
+    """
+    lazy_logger = logger.opt(lazy=True)
+    lazy_logger.debug("リクエストヘッダー: {}", lambda: dict(request.headers))
+    try:
+        body = await request.body()
+        if body:
+            lazy_logger.debug("リクエストボディ: {}", lambda: truncate_for_log(body))
+    except Exception as e:
+        logger.debug(f"リクエストボディの取得に失敗: {e}")
+
 class HALServer:
+    # ストリーミング時に作成途中の応答文の差分をまとめて送る間隔(秒)
+    stream_interval = 0.3
+    # オペレータの応答を待っている間にクライアントの切断を確認する間隔(秒)
+    disconnect_poll_interval = 0.5
+    # GET /v1/jobs/{id} の wait で完了を待つ最大時間(秒)
+    job_max_wait = 60.0
+    # リモートオペレータに ping を送る間隔(秒)。この2倍の間応答が無ければ切断したとみなす
+    heartbeat_interval = 15.0
+    # --shared-lock で待ち行列を使う場合に、他のプロセスが解放した枠を確認する間隔(秒)
+    slot_poll_interval = 0.05
+
     def __init__(
         self, 
         verbose: bool = False, 
         fix_reply: Optional[str] = None, 
-        json_dump_log: Optional[str] = None
+        json_dump_log: Optional[str] = None,
+        queue_depth: int = 0,
+        queue_timeout: Optional[float] = 30.0,
+        fast_path: bool = True,
+        json_dump_fsync: str = "never",
+        cache_size: int = 0,
+        cache_ttl: float = 3600.0,
+        cache_file: Optional[str] = None,
+        replay_from: Optional[str] = None,
+        slot_lock_file: Optional[str] = None,
+        max_concurrency: Optional[int] = 1,
+        rules_file: Optional[str] = None,
+        operator_timeout: Optional[float] = None,
+        timeout_fallback: str = "504",
+        timeout_reply: Optional[str] = None,
+        tokenizer: Optional[Tokenizer] = None,
+        max_body_size: Optional[int] = None,
+        max_jobs: int = 1000,
+        job_ttl: float = 3600.0,
+        headless: bool = False,
+        caller_weights: Optional[Dict[str, float]] = None,
+        suggestion_size: int = 100000
     ):
+        if timeout_fallback not in TIMEOUT_FALLBACKS:
+            raise ValueError(
+                f"timeout_fallback は {', '.join(TIMEOUT_FALLBACKS)} のいずれかです: "
+                f"{timeout_fallback}"
+            )
+        if timeout_fallback == "reply" and timeout_reply is None:
+            raise ValueError("timeout_fallback が reply の場合は timeout_reply を指定してください")
         self.app = FastAPI()
         self.verbose = verbose
         self.fix_reply = fix_reply
+        self.operator_timeout = operator_timeout
+        self.timeout_fallback = timeout_fallback
+        self.timeout_reply = timeout_reply
+        # usage の計算と max_tokens での切り詰めに使う。メッセージごとのトークン数はメモ化される
+        self.token_counter = TokenCounter(tokenizer)
         self.json_dump_log = json_dump_log
+        self.json_dump_writer = None
+        if json_dump_log:
+            from .utils import JsonDumpWriter
+            self.json_dump_writer = JsonDumpWriter(json_dump_log, fsync=json_dump_fsync)
+            self.app.add_event_handler("shutdown", self.json_dump_writer.close)
+        self.rules = None
+        if rules_file:
+            from .rules import RuleSet
+            self.rules = RuleSet.load(rules_file)
+            logger.info(f"自動応答ルールを読み込みました: {len(self.rules)}件 - {rules_file}")
+        self.replay_index = None
+        if replay_from:
+            from .replay import ReplayIndex
+            self.replay_index = ReplayIndex(replay_from)
+            self.app.add_event_handler("shutdown", self.replay_index.close)
+        self.response_cache = None
+        if cache_size > 0:
+            from .cache import ResponseCache
+            self.response_cache = ResponseCache(cache_size, cache_ttl, cache_file)
+            self.app.add_event_handler("shutdown", self.response_cache.save)
+        self.daemon_mode = fix_reply is not None
+        # TUIでは一人のオペレータが1件ずつ応答するため、同時処理数は常に1とする
+        if not self.daemon_mode and max_concurrency != 1:
+            logger.warning("TUIモードでは同時処理数の指定を無視し、1件ずつ処理します")
+            max_concurrency = 1
+        self.max_concurrency = max_concurrency
+        # 複数プロセスで起動する場合は、ロックファイルでプロセス間の排他を行う
+        shared_slot = slot_lock_file and max_concurrency is not None
+        if shared_slot:
+            from .workers import FileSlot
+            slot = FileSlot(slot_lock_file, max_concurrency)
+            self.app.add_event_handler("shutdown", slot.close)
+        else:
+            slot = ConcurrencyLimiter(max_concurrency)
+        # headless ではローカルのTUIを起動せず、WebSocketで接続したオペレータだけが応答する
+        self.headless = headless and not self.daemon_mode
+        if self.daemon_mode:
+            operators = [Operator("fix-reply", self._fix_reply_handler, slot)]
+        elif self.headless:
+            operators = []
+        else:
+            operators = [Operator("local-tui", self._tui_handler, slot)]
+        self.operator_pool = OperatorPool(operators)
+        # TUIのオペレータに過去の似た応答を提示するための索引
+        self.suggestion_index = None
+        # 回答済みの会話の続きのリクエストで、新しいメッセージだけをTUIで強調するための記録
+        self.conversations = None
+        if not self.daemon_mode:
+            from .conversation import ConversationTracker
+            from .suggest import SuggestionIndex
+            self.suggestion_index = SuggestionIndex(max_entries=suggestion_size)
+            self.conversations = ConversationTracker()
+        # 待ち行列は優先度・呼び出し元ごとの公平さ・期限の順に並べる
+        self.admission = AdmissionQueue(
+            self.operator_pool, max_depth=queue_depth, max_wait=queue_timeout,
+            weights=caller_weights, poll_interval=self.slot_poll_interval if shared_slot else None
+        )
+        self.single_flight = SingleFlight()
+        # Prefer: respond-async で受け付けたリクエストの処理と結果
+        self.jobs = JobStore(max_jobs, job_ttl)
+        self.app.add_event_handler("shutdown", self.jobs.cancel_all)
+        self.setup_metrics()
         self.setup_exception_handlers()
         self.setup_routes()
-        self.daemon_mode = fix_reply is not None
+        
+        # ログやダンプ、プロセス間の排他が不要なデーモンモードでは、
+        # 検証やロックを省いた高速経路で応答する
+        self.fast_path = (
+            self.daemon_mode and fast_path and not verbose and not json_dump_log
+            and self.replay_index is None and self.rules is None and not shared_slot
+        )
+        if self.fast_path:
+            from .fastpath import FixedReplyFastPath
+            self.app.add_middleware(
+                FixedReplyFastPath,
+                fix_reply=fix_reply,
+                requests_total=self.requests_total,
+                serialization_seconds=self.serialization_seconds,
+                token_counter=self.token_counter
+            )
+        # 高速経路にも適用されるよう、最も外側のミドルウェアとして追加する
+        self.max_body_size = max_body_size
+        if max_body_size:
+            from .body_limit import BodySizeLimit
+            self.app.add_middleware(
+                BodySizeLimit, max_bytes=max_body_size, requests_total=self.requests_total
+            )
         
         if verbose:
             logger.info("Verbose mode enabled")
         if self.daemon_mode:
             logger.info(f"デーモンモード有効 - 固定返答: {fix_reply}")
+        if self.response_cache is not None:
+            logger.info(f"応答キャッシュ有効 - 最大{cache_size}件, 有効期間: {cache_ttl}秒")
+        if max_concurrency != 1:
+            limit = "無制限" if max_concurrency is None else f"{max_concurrency}件"
+            logger.info(f"同時処理数: {limit}")
+        if queue_depth > 0:
+            logger.info(f"待ち行列有効 - 最大{queue_depth}件, 最大待ち時間: {queue_timeout}秒")
+        if operator_timeout is not None:
+            logger.info(f"応答期限: {operator_timeout}秒, 期限切れ時の応答: {timeout_fallback}")
+
+    async def _tui_handler(
+        self, request: ChatCompletionRequest, on_update: Optional[UpdateCallback] = None
+    ) -> Dict[str, Any]:
+        from .tui_fix import process_request
+        return await self._ask_human(process_request, request, on_update)
+
+    async def _ask_human(
+        self,
+        ask: Callable[..., Awaitable[Dict[str, Any]]],
+        request: ChatCompletionRequest,
+        on_update: Optional[UpdateCallback] = None
+    ) -> Dict[str, Any]:
+        """人のオペレータ (ローカルTUIまたはリモートのコンソール) にリクエストを見せて応答を待つ
+
+        ask は tui_fix.process_request と同じ引数を受け取る。過去の似た応答と既読の件数を添え、
+        応答後は会話を回答済みとして記録する。
+        """
+        suggestions = None
+        if self.suggestion_index is not None:
+            suggestions = [
+                reply for _, reply in self.suggestion_index.search(_last_user_text(request))
+            ]
+        seen_messages = self.conversations.seen_count(request.model, request.messages)
+        result = await ask(
+            request, on_update=on_update, suggestions=suggestions, seen_messages=seen_messages
+        )
+        self.conversations.record(
+            request.model, request.messages,
+            None if result.get("error") else result.get("content")
+        )
+        return result
+
+    def setup_metrics(self):
+        """/metrics で公開するメトリクスを登録する
+
+        カウンターとヒストグラムの更新は辞書・リストへの加算だけで済むため、高速経路でも常に記録する。
+        ゲージはスクレイプ時に現在の状態から計算する。
+        """
+        self.metrics = MetricsRegistry()
+        self.requests_total = self.metrics.counter(
+            "hal_requests_total", "結果別のリクエスト数", label="outcome"
+        )
+        self.coalesced_total = self.metrics.counter(
+            "hal_coalesced_requests_total", "処理中の同じリクエストの応答を共有したリクエスト数"
+        )
+        self.reassigned_total = self.metrics.counter(
+            "hal_reassigned_requests_total",
+            "処理中のリモートオペレータが切断したため、別のオペレータに割り当て直したリクエスト数"
+        )
+        self.rule_hits_total = self.metrics.counter(
+            "hal_rule_hits_total", "自動応答ルールごとの一致数", label="rule"
+        )
+        self.lock_held_seconds = self.metrics.histogram(
+            "hal_lock_held_seconds", "オペレータの枠(ロック)を保持していた時間(秒)"
+        )
+        self.think_seconds = self.metrics.histogram(
+            "hal_operator_think_seconds", "オペレータがリクエストを受けてから応答するまでの時間(秒)"
+        )
+        self.serialization_seconds = self.metrics.histogram(
+            "hal_serialization_seconds", "応答ボディの組み立てにかかった時間(秒)",
+            buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+        )
+        self.metrics.gauge(
+            "hal_operators", "登録されているオペレータ数",
+            lambda: len(self.operator_pool.operators)
+        )
+        self.metrics.gauge(
+            "hal_operators_busy", "処理中(枠のロックを保持中)のオペレータ数",
+            lambda: len(self.operator_pool.operators) - self.operator_pool.idle_count
+        )
+        self.metrics.gauge(
+            "hal_slots_in_use", "処理中のリクエスト数 (確保されている処理枠の数)",
+            lambda: sum(operator.slot.in_use for operator in self.operator_pool.operators)
+        )
+        self.metrics.gauge(
+            "hal_queue_depth", "オペレータの空きを待っているリクエスト数",
+            lambda: self.admission.depth
+        )
+        self.metrics.gauge(
+            "hal_jobs_pending", "非同期モードで受け付け、応答を待っているジョブ数",
+            lambda: self.jobs.pending
+        )
+        # 応答キャッシュとリプレイ索引の件数は、それぞれが数えている値をスクレイプ時に読む
+        cache = self.response_cache
+        if cache is not None:
+            self.metrics.counter_function(
+                "hal_cache_hits_total", "応答キャッシュから返した件数", lambda: cache.hits
+            )
+            self.metrics.counter_function(
+                "hal_cache_misses_total", "応答キャッシュに無かった件数", lambda: cache.misses
+            )
+            self.metrics.counter_function(
+                "hal_cache_evictions_total", "件数の上限で応答キャッシュから捨てた件数",
+                lambda: cache.evictions
+            )
+        replay = self.replay_index
+        if replay is not None:
+            self.metrics.counter_function(
+                "hal_replay_hits_total", "記録済みの応答を返した件数", lambda: replay.hits
+            )
+            self.metrics.counter_function(
+                "hal_replay_misses_total", "記録に無かった件数", lambda: replay.misses
+            )
+
+    async def _handle(
+        self,
+        operator: Operator,
+        request: ChatCompletionRequest,
+        on_update: Optional[UpdateCallback] = None
+    ) -> Dict[str, Any]:
+        """オペレータにリクエストを渡し、応答までの時間を記録する"""
+        started = time.perf_counter()
+        try:
+            return await operator.handle(request, on_update=on_update)
+        finally:
+            self.think_seconds.observe(time.perf_counter() - started)
+
+    def _release(self, operator: Operator, acquired_at: float) -> None:
+        """オペレータの枠を解放し、保持していた時間を記録する"""
+        self.lock_held_seconds.observe(time.perf_counter() - acquired_at)
+        self.admission.release(operator)
+
+    async def _fix_reply_handler(
+        self, request: ChatCompletionRequest, on_update: Optional[UpdateCallback] = None
+    ) -> Dict[str, Any]:
+        if self.verbose:
+            logger.info(f"デーモンモードで固定返答を返します: {self.fix_reply}")
+        return {"content": self.fix_reply}
             
     def setup_exception_handlers(self):
         @self.app.exception_handler(StarletteHTTPException)
@@ -63,14 +738,7 @@ class HALServer:
                 logger.warning(f"HTTPエラー: {exc.status_code} - {exc.detail}")
                 logger.debug(f"リクエストURL: {request.url}")
                 logger.debug(f"リクエストメソッド: {request.method}")
-                logger.debug(f"リクエストヘッダー: {dict(request.headers)}")
-                
-                try:
-                    body = await request.body()
-                    if body:
-                        logger.debug(f"リクエストボディ: {body.decode('utf-8', errors='replace')}")
-                except Exception as e:
-                    logger.debug(f"リクエストボディの取得に失敗: {e}")
+                await _debug_log_request(request)
             
             return JSONResponse(
                 status_code=exc.status_code,
@@ -79,18 +747,12 @@ class HALServer:
         
         @self.app.exception_handler(RequestValidationError)
         async def validation_exception_handler(request: Request, exc: RequestValidationError):
+            self.requests_total.inc("validation_error")
             if self.verbose:
                 logger.warning(f"リクエスト検証エラー: {exc}")
                 logger.debug(f"リクエストURL: {request.url}")
                 logger.debug(f"リクエストメソッド: {request.method}")
-                logger.debug(f"リクエストヘッダー: {dict(request.headers)}")
-                
-                try:
-                    body = await request.body()
-                    if body:
-                        logger.debug(f"リクエストボディ: {body.decode('utf-8', errors='replace')}")
-                except Exception as e:
-                    logger.debug(f"リクエストボディの取得に失敗: {e}")
+                await _debug_log_request(request)
             
             return JSONResponse(
                 status_code=422,
@@ -102,14 +764,7 @@ class HALServer:
             if self.verbose:
                 logger.warning(f"未対応のURL: {request.url}")
                 logger.debug(f"リクエストメソッド: {request.method}")
-                logger.debug(f"リクエストヘッダー: {dict(request.headers)}")
-                
-                try:
-                    body = await request.body()
-                    if body:
-                        logger.debug(f"リクエストボディ: {body.decode('utf-8', errors='replace')}")
-                except Exception as e:
-                    logger.debug(f"リクエストボディの取得に失敗: {e}")
+                await _debug_log_request(request)
             
             return JSONResponse(
                 status_code=404,
@@ -120,14 +775,7 @@ class HALServer:
         async def method_not_allowed_exception_handler(request: Request, exc: HTTPException):
             if self.verbose:
                 logger.warning(f"未対応のメソッド: {request.method} for URL {request.url}")
-                logger.debug(f"リクエストヘッダー: {dict(request.headers)}")
-                
-                try:
-                    body = await request.body()
-                    if body:
-                        logger.debug(f"リクエストボディ: {body.decode('utf-8', errors='replace')}")
-                except Exception as e:
-                    logger.debug(f"リクエストボディの取得に失敗: {e}")
+                await _debug_log_request(request)
             
             error_detail = f"Method '{request.method}' not allowed for URL '{request.url}'"
             return JSONResponse(
@@ -138,95 +786,161 @@ class HALServer:
     def setup_routes(self):
         @self.app.post("/v1/chat/completions")
         async def chat_completions(
-            request: ChatCompletionRequest,
+            request: Annotated[ChatCompletionRequest, Depends(self._read_request)],
             raw_request: Request,
             authenticated: bool = Depends(authenticate)
         ):
+            # ボディは _read_request で一度だけ読み込み・解析している。ダンプ・詳細ログが有効な
+            # 場合だけボディのbytesを保持し、raw_request.body() はそれを返す。ダンプには解析し直さず
+            # そのbytesを書き出す
+            deadline = self._deadline(raw_request)
+            scheduling = self._scheduling_key(raw_request, deadline)
+            record_id = None
+            if self.json_dump_writer:
+                record_id = uuid.uuid4().hex
+                self.json_dump_writer.write(
+                    await raw_request.body(), is_request=True, record_id=record_id
+                )
+            
             if self.verbose:
-                logger.info(f"リクエスト受信: {request}")
-                logger.debug(f"HTTPリクエストヘッダー: {dict(raw_request.headers)}")
+                lazy_logger = logger.opt(lazy=True)
+                lazy_logger.info("リクエスト受信: {}", lambda: truncate_for_log(repr(request)))
+                lazy_logger.debug("HTTPリクエストヘッダー: {}", lambda: dict(raw_request.headers))
                 body = await raw_request.body()
                 if body:
-                    logger.debug(f"HTTPリクエストボディ: {body.decode('utf-8', errors='replace')}")
-                    if self.json_dump_log:
-                        from .utils import dump_json_to_file
-                        request_data = await raw_request.json()
-                        dump_json_to_file(self.json_dump_log, request_data, is_request=True)
+                    lazy_logger.debug("HTTPリクエストボディ: {}", lambda: truncate_for_log(body))
             
-            if not request_lock.acquire(blocking=False):
+            if self.rules is not None:
+                rule = self.rules.match(request.model, request.messages)
+                if rule is not None:
+                    if self.verbose:
+                        logger.info(f"自動応答ルール {rule.name} に一致しました")
+                    self.rule_hits_total.inc(rule.name)
+                    self._dump_result(rule.result, record_id)
+                    self.requests_total.inc(rule.result.get("error") or "ok")
+                    if request.stream:
+                        return self._stream_result(request, rule.result)
+                    return self._result_response(request, rule.result)
+            
+            if self.replay_index is not None:
+                result = self.replay_index.lookup(request.model, request.messages)
+                if result is not None:
+                    if self.verbose:
+                        logger.info("記録済みの応答を返します")
+                    self._dump_result(result, record_id)
+                    self.requests_total.inc(result.get("error") or "ok")
+                    if request.stream:
+                        return self._stream_result(request, result)
+                    return self._result_response(request, result)
+            
+            cache_key = None
+            if self.response_cache is not None and not request.stream:
+                cache_control = raw_request.headers.get("cache-control", "").lower()
+                if "no-store" not in cache_control:
+                    cache_key = conversation_key(request.model, request.messages)
+                if cache_key and "no-cache" not in cache_control:
+                    content = self.response_cache.get(cache_key)
+                    if content is not None:
+                        if self.verbose:
+                            logger.info("キャッシュ済みの応答を返します")
+                        self._dump_result({"content": content}, record_id)
+                        self.requests_total.inc("ok")
+                        response = self._completion_response(request, content)
+                        return JSONResponse(
+                            content=response.model_dump(), headers={"X-HAL-Cache": "hit"}
+                        )
+            
+            if request.stream:
+                operator, busy_status = await self.admission.acquire(scheduling)
+                if operator is None:
+                    return self._busy_response(busy_status)
                 if self.verbose:
-                    logger.warning("別のリクエストが処理中のため、このリクエストは拒否されました")
-                return JSONResponse(
-                    status_code=503,
-                    content={"error": "server_busy"}
+                    logger.info(f"オペレータ {operator.name} に割り当てました")
+                return self._stream_response(
+                    request, operator, time.perf_counter(), record_id, deadline
                 )
             
-            try:
-                if self.daemon_mode:
-                    if self.verbose:
-                        logger.info(f"デーモンモードで固定返答を返します: {self.fix_reply}")
-                    
-                    return ChatCompletionResponse(
-                        model=request.model,
-                        choices=[{
-                            "index": 0,
-                            "message": {"role": "assistant", "content": self.fix_reply},
-                            "finish_reason": "stop"
-                        }]
-                    )
-                
-                from .tui_fix import process_request
-                result = await process_request(request)
-                
+            # Prefer: respond-async なら、オペレータの応答を待たずにジョブとして受け付ける
+            if self._prefers_async(raw_request):
+                job = self.jobs.submit(self._operator_response(
+                    request, None, deadline, cache_key, record_id, scheduling
+                ))
+                if job is None:
+                    return self._busy_response(503)
                 if self.verbose:
-                    logger.info(f"応答結果: {result}")
-                
-                if self.json_dump_log and not result.get("error"):
-                    from .utils import dump_json_to_file
-                    response_data = {"role": "assistant", "content": result["content"]}
-                    dump_json_to_file(self.json_dump_log, response_data, is_request=False)
-                
-                if result.get("error") == "cannot_answer":
-                    if self.json_dump_log:
-                        from .utils import dump_json_to_file
-                        error_data = {"error": "cannot_answer"}
-                        dump_json_to_file(self.json_dump_log, error_data, is_request=False)
-                    return JSONResponse(
-                        status_code=200,
-                        content={"error": "cannot_answer"}
-                    )
-                elif result.get("error") == "internal_error":
-                    if self.json_dump_log:
-                        from .utils import dump_json_to_file
-                        error_data = {"error": "internal_error"}
-                        dump_json_to_file(self.json_dump_log, error_data, is_request=False)
-                    return JSONResponse(
-                        status_code=500,
-                        content={"error": "internal_error"}
-                    )
-                elif result.get("error") == "forbidden":
-                    if self.json_dump_log:
-                        from .utils import dump_json_to_file
-                        error_data = {"error": "forbidden"}
-                        dump_json_to_file(self.json_dump_log, error_data, is_request=False)
-                    return JSONResponse(
-                        status_code=403,
-                        content={"error": "forbidden"}
-                    )
-                
-                return ChatCompletionResponse(
-                    model=request.model,
-                    choices=[{
-                        "index": 0,
-                        "message": {"role": "assistant", "content": result["content"]},
-                        "finish_reason": "stop"
-                    }]
+                    logger.info(f"ジョブ {job.id} として受け付けました")
+                return JSONResponse(
+                    status_code=202,
+                    content=job.status_body("pending"),
+                    headers={
+                        "Location": f"/v1/jobs/{job.id}",
+                        "Preference-Applied": "respond-async"
+                    }
                 )
             
-            finally:
-                request_lock.release()
+            return await self._operator_response(
+                request, raw_request, deadline, cache_key, record_id, scheduling
+            )
+        
+        @self.app.get("/v1/jobs/{job_id}")
+        async def get_job(
+            job_id: str,
+            wait: float = 0.0,
+            authenticated: bool = Depends(authenticate)
+        ):
+            job = self.jobs.get(job_id)
+            if job is None:
+                return JSONResponse(status_code=404, content={"error": "job_not_found"})
+            # wait 秒まで完了を待つ (ロングポーリング)
+            if not await self.jobs.wait(job, min(wait, self.job_max_wait)):
+                return JSONResponse(
+                    status_code=202,
+                    content=job.status_body("pending"),
+                    headers={"Retry-After": "1"}
+                )
+            return job.response
+        
+        @self.app.delete("/v1/jobs/{job_id}")
+        async def cancel_job(job_id: str, authenticated: bool = Depends(authenticate)):
+            job = self.jobs.cancel(job_id)
+            if job is None:
+                return JSONResponse(status_code=404, content={"error": "job_not_found"})
+            if not job.done:
+                self.requests_total.inc("cancelled")
                 if self.verbose:
-                    logger.info("リクエスト処理完了、ロック解放")
+                    logger.info(f"ジョブ {job.id} を取り消しました")
+            return JSONResponse(content=job.status_body("cancelled"))
+        
+        if not self.daemon_mode:
+            @self.app.websocket("/v1/operators/ws")
+            async def operator_console(
+                websocket: WebSocket,
+                name: str = "remote",
+                authenticated: bool = Depends(authenticate)
+            ):
+                await websocket.accept()
+                console = RemoteConsole(websocket, name)
+                operator = Operator(f"remote:{name}", partial(self._ask_human, console.ask))
+                self.operator_pool.add(operator)
+                # 空きを待っているリクエストがあれば、すぐに割り当てる
+                self.admission.dispatch()
+                logger.info(f"リモートオペレータ {operator.name} が接続しました")
+                try:
+                    await console.send({
+                        "type": "hello",
+                        "operator": operator.name,
+                        "heartbeat": self.heartbeat_interval
+                    })
+                    await console.serve(self.heartbeat_interval)
+                finally:
+                    # 先にプールから外し、処理中のリクエストを別のオペレータへ割り当て直させる
+                    self.operator_pool.remove(operator)
+                    console.close()
+                    logger.info(f"リモートオペレータ {operator.name} が切断しました")
+        
+        @self.app.get("/metrics")
+        async def metrics():
+            return Response(self.metrics.render(), media_type=self.metrics.content_type)
         
         @self.app.delete("/api/you")
         async def shutdown_daemon():
@@ -247,8 +961,461 @@ class HALServer:
                 content={"message": "shutting_down"}
             )
     
+    async def _operator_response(
+        self,
+        request: ChatCompletionRequest,
+        raw_request: Optional[Request],
+        deadline: Optional[float],
+        cache_key: Optional[str] = None,
+        record_id: Optional[str] = None,
+        scheduling: SchedulingKey = SchedulingKey()
+    ):
+        """オペレータの応答を期限まで待ち、HTTP応答を返す
+
+        処理中の同じ会話があれば、その応答を待って同じ内容を返す。
+        raw_request がNone (非同期モードのジョブ) の場合はクライアントの切断を監視しない。
+        """
+        flight = asyncio.ensure_future(self.single_flight.do(
+            conversation_key(request.model, request.messages),
+            lambda: self._complete(request, cache_key, scheduling)
+        ))
+        outcome = await self._wait_for_operator(flight, raw_request, deadline)
+        if outcome == "client_disconnected":
+            self.requests_total.inc(outcome)
+            if self.verbose:
+                logger.warning("クライアントが切断したため、オペレータへのリクエストを取り下げました")
+            return Response(status_code=499)
+        if outcome == "timeout":
+            self.requests_total.inc(outcome)
+            if self.verbose:
+                logger.warning("応答期限を過ぎたため、オペレータへのリクエストを取り下げました")
+            # 代わりに返す応答はオペレータの応答ではないため、期限切れとして記録する
+            self._dump_result({"error": "timeout"}, record_id)
+            result = self._timeout_result(request)
+            if result is None:
+                return JSONResponse(status_code=504, content={"error": "timeout"})
+            return self._result_response(request, result)
+        
+        (result, busy_status), shared = flight.result()
+        if result is None:
+            return self._busy_response(busy_status)
+        if shared:
+            self.coalesced_total.inc()
+            if self.verbose:
+                logger.info("処理中の同じリクエストの応答を返します")
+        
+        self.requests_total.inc(result.get("error") or "ok")
+        self._dump_result(result, record_id)
+        return self._result_response(request, result)
+
+    async def _complete(
+        self,
+        request: ChatCompletionRequest,
+        cache_key: Optional[str] = None,
+        scheduling: SchedulingKey = SchedulingKey()
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """オペレータを確保してリクエストを処理する
+
+        処理中のリモートオペレータが切断した場合は、別のオペレータを確保し直して処理する。
+
+        Returns:
+            (応答結果, None)、オペレータを確保できなかった場合は (None, HTTPステータスコード)
+        """
+        while True:
+            operator, busy_status = await self.admission.acquire(scheduling)
+            if operator is None:
+                return None, busy_status
+            
+            if self.verbose:
+                logger.info(f"オペレータ {operator.name} に割り当てました")
+            
+            acquired_at = time.perf_counter()
+            try:
+                result = await self._handle(operator, request)
+            except OperatorDisconnected:
+                self.reassigned_total.inc()
+                logger.warning(
+                    f"オペレータ {operator.name} が切断したため、リクエストを割り当て直します"
+                )
+                continue
+            finally:
+                self._release(operator, acquired_at)
+                if self.verbose:
+                    logger.info("リクエスト処理完了、オペレータの枠を解放")
+            
+            if self.verbose:
+                logger.opt(lazy=True).info("応答結果: {}", lambda: truncate_for_log(repr(result)))
+            
+            if cache_key and not result.get("error"):
+                self.response_cache.put(cache_key, result["content"])
+            if self.suggestion_index is not None and not result.get("error"):
+                self.suggestion_index.add(_last_user_text(request), result["content"])
+            return result, None
+
+    async def _read_request(self, raw_request: Request) -> ChatCompletionRequest:
+        """リクエストボディを読み込み、JSONから直接 ChatCompletionRequest を組み立てる
+
+        FastAPIの既定の処理はボディのbytes・json.loadsしたdict・検証済みのモデルをそれぞれ
+        リクエストの処理が終わるまで保持するが、ここでは中間のdictを作らず、ダンプや詳細ログで
+        使う場合を除いてbytesも解析後に手放す。ボディの大きさの上限は BodySizeLimit が
+        受信しながら確認する。
+        """
+        if self.json_dump_writer or self.verbose:
+            body = await raw_request.body()
+        else:
+            body = bytearray()
+            async for chunk in raw_request.stream():
+                body += chunk
+        try:
+            return ChatCompletionRequest.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]) from None
+
+    @staticmethod
+    def _prefers_async(raw_request: Request) -> bool:
+        """Prefer ヘッダ (RFC 7240) で respond-async が指定されているか"""
+        if not isinstance(raw_request, Request):
+            return False
+        return any(
+            preference.split("=", 1)[0].strip().lower() == "respond-async"
+            for header in raw_request.headers.getlist("prefer")
+            for preference in header.split(",")
+        )
+
+    def _scheduling_key(self, raw_request: Request, deadline: Optional[float]) -> SchedulingKey:
+        """待ち行列での順番を決める情報をリクエストヘッダから組み立てる
+
+        X-HAL-Priority ヘッダ (整数、既定0) を優先度、Authorization ヘッダのトークンを
+        呼び出し元とする。authenticate と同じく、トークンの検証はしない。
+        """
+        if not isinstance(raw_request, Request):
+            return SchedulingKey(deadline=deadline)
+        priority = 0
+        header = raw_request.headers.get("x-hal-priority")
+        if header:
+            try:
+                priority = int(header)
+            except ValueError:
+                logger.warning(f"X-HAL-Priority ヘッダが整数ではないため無視します: {header}")
+        authorization = raw_request.headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        caller = token.strip() if scheme.lower() == "bearer" else authorization
+        return SchedulingKey(priority, deadline, caller)
+
+    def _deadline(self, raw_request: Request) -> Optional[float]:
+        """このリクエストの応答期限 (time.monotonic() の値) を返す。期限が無ければNone
+
+        X-HAL-Timeout ヘッダ (秒) があれば --operator-timeout の代わりに使う。
+        """
+        timeout = self.operator_timeout
+        header = None
+        if isinstance(raw_request, Request):
+            header = raw_request.headers.get("x-hal-timeout")
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                logger.warning(f"X-HAL-Timeout ヘッダが数値ではないため無視します: {header}")
+        if timeout is None or timeout <= 0:
+            return None
+        return time.monotonic() + timeout
+
+    async def _wait_for_operator(
+        self, flight: asyncio.Future, raw_request: Request, deadline: Optional[float]
+    ) -> str:
+        """オペレータの応答を期限まで待ち、その間クライアントの切断を監視する
+
+        期限切れや切断の場合は flight を取り消す。他に同じ応答を待つリクエストが無ければ
+        オペレータへのリクエストも取り消され、TUIの表示の取り下げと枠の解放が行われる。
+
+        Returns:
+            "done"、"timeout"、"client_disconnected" のいずれか
+        """
+        watchers = [flight]
+        # テストなどでRequest以外が渡された場合は切断を監視しない
+        disconnect = None
+        if isinstance(raw_request, Request):
+            disconnect = asyncio.ensure_future(self._wait_disconnect(raw_request))
+            watchers.append(disconnect)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            done, _ = await asyncio.wait(
+                watchers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if disconnect is not None:
+                disconnect.cancel()
+            if not flight.done():
+                flight.cancel()
+        if flight in done:
+            return "done"
+        # 取り消しが反映され、枠が解放されるまで待つ
+        await asyncio.wait([flight])
+        if not flight.cancelled():
+            return "done"
+        return "client_disconnected" if disconnect in done else "timeout"
+
+    async def _wait_disconnect(self, raw_request: Request) -> None:
+        while not await raw_request.is_disconnected():
+            await asyncio.sleep(self.disconnect_poll_interval)
+
+    def _timeout_result(self, request: ChatCompletionRequest) -> Optional[Dict[str, Any]]:
+        """応答期限を過ぎたリクエストに返す応答結果。504を返す場合はNone"""
+        if self.timeout_fallback == "reply":
+            return {"content": self.timeout_reply}
+        if self.timeout_fallback == "500":
+            return {"error": "internal_error"}
+        if self.timeout_fallback == "cache":
+            if self.response_cache is not None:
+                content = self.response_cache.get(
+                    conversation_key(request.model, request.messages)
+                )
+                if content is not None:
+                    return {"content": content}
+            if self.replay_index is not None:
+                return self.replay_index.lookup(request.model, request.messages)
+        return None
+
+    def _busy_response(self, busy_status: int) -> JSONResponse:
+        """オペレータを確保できなかったリクエストへの応答"""
+        self.requests_total.inc("server_busy")
+        if self.verbose:
+            if busy_status == 429:
+                logger.warning("待ち時間の上限を超えたため、このリクエストは拒否されました")
+            else:
+                logger.warning("全オペレータが処理中のため、このリクエストは拒否されました")
+        return JSONResponse(
+            status_code=busy_status,
+            content={"error": "server_busy"}
+        )
+
+    def _result_response(self, request: ChatCompletionRequest, result: Dict[str, Any]):
+        """オペレータの応答結果をHTTP応答に変換し、組み立てにかかった時間を記録する"""
+        started = time.perf_counter()
+        try:
+            return self._build_result_response(request, result)
+        finally:
+            self.serialization_seconds.observe(time.perf_counter() - started)
+
+    def _build_result_response(self, request: ChatCompletionRequest, result: Dict[str, Any]):
+        if result.get("error") == "cannot_answer":
+            return JSONResponse(
+                status_code=200,
+                content={"error": "cannot_answer"}
+            )
+        elif result.get("error") == "internal_error":
+            return JSONResponse(
+                status_code=500,
+                content={"error": "internal_error"}
+            )
+        elif result.get("error") == "forbidden":
+            return JSONResponse(
+                status_code=403,
+                content={"error": "forbidden"}
+            )
+        
+        return self._completion_response(request, result["content"])
+
+    def _limit_reply(self, request: ChatCompletionRequest, content: str) -> Tuple[str, str]:
+        """応答文を max_tokens までに切り詰め、(応答文, finish_reason) を返す"""
+        max_tokens = _max_tokens(request)
+        if max_tokens is None:
+            return content, "stop"
+        content, truncated = self.token_counter.truncate(content, max_tokens)
+        return content, "length" if truncated else "stop"
+
+    def _usage(self, request: ChatCompletionRequest, content: str) -> Dict[str, int]:
+        prompt_tokens = self.token_counter.prompt_tokens(request.messages)
+        completion_tokens = self.token_counter.count(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _completion_response(
+        self, request: ChatCompletionRequest, content: str
+    ) -> ChatCompletionResponse:
+        """応答文から usage 付きの chat.completion を組み立てる"""
+        content, finish_reason = self._limit_reply(request, content)
+        return ChatCompletionResponse(
+            model=request.model,
+            choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason
+            }],
+            usage=self._usage(request, content)
+        )
+
+    def _dump_result(self, result: Dict[str, Any], record_id: Optional[str] = None) -> None:
+        """オペレータの応答結果をJSONダンプログに書き出す"""
+        if not self.json_dump_writer:
+            return
+        if result.get("error"):
+            response_data = {"error": result["error"]}
+        else:
+            response_data = {"role": "assistant", "content": result["content"]}
+        self.json_dump_writer.write(response_data, is_request=False, record_id=record_id)
+
+    def _stream_response(
+        self,
+        request: ChatCompletionRequest,
+        operator: Operator,
+        acquired_at: float,
+        record_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> StreamingResponse:
+        """確保したオペレータに処理を始めさせ、その応答を送るSSEのレスポンスを返す
+
+        処理はレスポンスを返す前に始め、完了した時点で枠を解放する。本文を送り始める前に
+        クライアントが切断してジェネレータが一度も実行されなかった場合も、レスポンスの終了時に
+        処理を取り消すため枠は解放される。
+        """
+        latest = {"text": ""}
+
+        def on_update(text: str) -> None:
+            latest["text"] = text
+
+        task = asyncio.create_task(self._handle(operator, request, on_update=on_update))
+        task.add_done_callback(lambda _: self._release(operator, acquired_at))
+        return _ClosingStreamingResponse(
+            self._stream_completion(request, operator, task, latest, record_id, deadline),
+            on_close=task.cancel,
+            media_type="text/event-stream"
+        )
+
+    async def _stream_completion(
+        self,
+        request: ChatCompletionRequest,
+        operator: Operator,
+        task: asyncio.Task,
+        latest: Dict[str, str],
+        record_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ):
+        """オペレータの入力途中の応答文を chat.completion.chunk のSSEとして送る
+
+        stream_interval ごとに入力内容を確認し、送信済みの部分に続く差分だけを送る。
+        送信済みの部分が書き換えられた場合は、確定まで送信を保留する。
+        deadline (time.monotonic() の値) を過ぎたらオペレータへのリクエストを取り消し、
+        期限切れ時の応答を送る。クライアントが切断した場合はStarletteがこのジェネレータを止める。
+        応答文は max_tokens を超えた部分を送らず、stream_options.include_usage が指定されていれば
+        最後に usage だけのチャンクを送る。
+        """
+        completion_id = _new_completion_id()
+        created = int(time.time())
+        max_tokens = _max_tokens(request)
+        chunk = partial(_chunk_event, request, completion_id, created)
+
+        sent = ""
+        try:
+            yield chunk({"role": "assistant", "content": ""})
+            timed_out = False
+            while not task.done():
+                interval = self.stream_interval
+                if deadline is not None:
+                    interval = min(interval, max(0.0, deadline - time.monotonic()))
+                await asyncio.wait([task], timeout=interval)
+                if deadline is not None and not task.done() and time.monotonic() >= deadline:
+                    task.cancel()
+                    await asyncio.wait([task])
+                    timed_out = task.cancelled()
+                    break
+                text = latest["text"]
+                if len(text) > len(sent) and max_tokens is not None:
+                    text = self.token_counter.truncate(text, max_tokens)[0]
+                if not task.done() and len(text) > len(sent) and text.startswith(sent):
+                    yield chunk({"content": text[len(sent):]})
+                    sent = text
+
+            if timed_out:
+                self.requests_total.inc("timeout")
+                if self.verbose:
+                    logger.warning("応答期限を過ぎたため、オペレータへのリクエストを取り下げました")
+                self._dump_result({"error": "timeout"}, record_id)
+                result = self._timeout_result(request) or {"error": "timeout"}
+            else:
+                try:
+                    result = task.result()
+                except OperatorDisconnected:
+                    # 送信済みの差分があるため、別のオペレータには割り当て直さない
+                    logger.warning(f"オペレータ {operator.name} が応答の途中で切断しました")
+                    result = {"error": "internal_error"}
+                self.requests_total.inc(result.get("error") or "ok")
+                if self.verbose:
+                    logger.opt(lazy=True).info(
+                        "応答結果: {}", lambda: truncate_for_log(repr(result))
+                    )
+                self._dump_result(result, record_id)
+                if self.suggestion_index is not None and not result.get("error"):
+                    self.suggestion_index.add(_last_user_text(request), result["content"])
+
+            for event in self._result_events(request, result, completion_id, created, sent):
+                yield event
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def _result_events(
+        self,
+        request: ChatCompletionRequest,
+        result: Dict[str, Any],
+        completion_id: str,
+        created: int,
+        sent: str = ""
+    ) -> Iterator[bytes]:
+        """確定した応答結果のうち、送信済みの sent に続く部分と終端をSSEのフレームにする"""
+        if result.get("error"):
+            yield _sse_event({"error": result["error"]})
+        else:
+            chunk = partial(_chunk_event, request, completion_id, created)
+            content, finish_reason = self._limit_reply(request, result["content"])
+            if not content.startswith(sent):
+                logger.warning("送信済みの応答が確定時に書き換えられていました")
+                common = 0
+                while common < min(len(sent), len(content)) and sent[common] == content[common]:
+                    common += 1
+                sent = sent[:common]
+            if len(content) > len(sent):
+                yield chunk({"content": content[len(sent):]})
+            yield chunk({}, finish_reason=finish_reason)
+            if (request.stream_options or {}).get("include_usage"):
+                yield _sse_event({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": request.model,
+                    "choices": [],
+                    "usage": self._usage(request, content)
+                })
+        yield _sse_event("[DONE]")
+
+    def _stream_result(
+        self, request: ChatCompletionRequest, result: Dict[str, Any]
+    ) -> StreamingResponse:
+        """自動応答ルールやリプレイで即座に決まった応答結果を、ストリーミングと同じSSEで返す"""
+        completion_id = _new_completion_id()
+        created = int(time.time())
+
+        async def events():
+            yield _chunk_event(
+                request, completion_id, created, {"role": "assistant", "content": ""}
+            )
+            for event in self._result_events(request, result, completion_id, created):
+                yield event
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
     async def _shutdown(self):
         import asyncio
         await asyncio.sleep(1)
+        if self.json_dump_writer:
+            self.json_dump_writer.close()
+        if self.response_cache is not None:
+            self.response_cache.save()
         import sys
         sys.exit(0)
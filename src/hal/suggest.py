@@ -0,0 +1,146 @@
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+class SuggestionIndex:
+    """過去のリクエストと応答を文字n-gramの転置索引に積み、似た応答をBM25で探す
+
+    索引には各リクエストの最後のuserメッセージと応答を、それぞれ先頭 max_chars 文字まで登録する。
+    BM25の文書長による正規化は登録時の平均文書長で計算して重みとして持っておく。
+    検索では文書頻度の低い(識別力の高い)n-gramから順に転置リストを読み、読んだ件数の合計が
+    max_postings に達したところで打ち切るため、件数が増えても検索時間はほぼ一定になる。
+    残りの件数より長い転置リストは、新しい文書 (末尾) から残りの件数だけを読む。
+
+    登録が max_entries 件を超えたら古いものから捨てる。文書番号は登録順に振るため、転置リストは
+    文書番号の昇順に並び、捨てた文書は先頭にまとまる。転置リストからは検索で読む時に先頭を
+    切り詰めて取り除き、読まれない転置リストも max_entries 件捨てるごとにまとめて切り詰める。
+
+    Args:
+        n: n-gramの文字数
+        max_chars: 1件あたり索引に登録する最大文字数
+        max_query_grams: 検索に使うn-gramの最大数
+        max_postings: 1回の検索で読む転置リストの合計件数の上限
+        max_entries: 保持する最大件数
+    """
+
+    def __init__(
+        self,
+        n: int = 3,
+        max_chars: int = 200,
+        max_query_grams: int = 32,
+        max_postings: int = 10000,
+        max_entries: int = 100000,
+        k1: float = 1.2,
+        b: float = 0.75
+    ):
+        self.n = n
+        self.max_chars = max_chars
+        self.max_query_grams = max_query_grams
+        self.max_postings = max_postings
+        self.max_entries = max_entries
+        self.k1 = k1
+        self.b = b
+        # 直近 max_entries 件の応答と文書長。文書番号を max_entries で割った余りの位置に置く
+        self._replies: List[str] = []
+        self._lengths: List[int] = []
+        # 保持している最も古い文書番号と、次に振る文書番号
+        self._first_id = 0
+        self._next_id = 0
+        self._total_length = 0
+        # n-gram -> (文書番号の配列, 文書長で正規化した出現回数の重みの配列)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+
+    def __len__(self) -> int:
+        return self._next_id - self._first_id
+
+    def _grams(self, text: str) -> Counter:
+        text = " ".join(text[:self.max_chars].lower().split())
+        if len(text) < self.n:
+            return Counter([text]) if text else Counter()
+        return Counter(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+
+    def add(self, request_text: str, reply: str) -> None:
+        """回答済みのリクエストと応答を索引に加える"""
+        grams = self._grams(request_text) + self._grams(reply)
+        if len(self) >= self.max_entries:
+            self._evict()
+        doc_id = self._next_id
+        self._next_id += 1
+        length = sum(grams.values())
+        if len(self._replies) < self.max_entries:
+            self._replies.append(reply)
+            self._lengths.append(length)
+        else:
+            self._replies[doc_id % self.max_entries] = reply
+            self._lengths[doc_id % self.max_entries] = length
+        self._total_length += length
+        norm = self.k1 * (1 - self.b + self.b * length * len(self) / self._total_length)
+        for gram, count in grams.items():
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = (array("I"), array("f"))
+            postings[0].append(doc_id)
+            postings[1].append(count * (self.k1 + 1) / (count + norm))
+
+    def _evict(self) -> None:
+        """最も古い1件を捨てる"""
+        slot = self._first_id % self.max_entries
+        self._total_length -= self._lengths[slot]
+        self._replies[slot] = ""
+        self._first_id += 1
+        if self._first_id % self.max_entries == 0:
+            for gram in list(self._postings):
+                self._trim(gram)
+
+    def _trim(self, gram: str) -> Optional[Tuple[array, array]]:
+        """転置リストの先頭から捨てた文書を取り除く。空になった転置リストは消してNoneを返す"""
+        postings = self._postings[gram]
+        doc_ids, weights = postings
+        if doc_ids[0] < self._first_id:
+            stale = bisect_left(doc_ids, self._first_id)
+            if stale == len(doc_ids):
+                del self._postings[gram]
+                return None
+            del doc_ids[:stale]
+            del weights[:stale]
+        return postings
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[float, str]]:
+        """text に似た過去のリクエスト・応答を探し、(スコア, 応答) を重複なしで最大k件返す"""
+        total = len(self)
+        if total == 0 or k <= 0:
+            return []
+
+        candidates = []
+        for gram in self._grams(text):
+            postings = self._trim(gram) if gram in self._postings else None
+            if postings is not None:
+                candidates.append((len(postings[0]), gram))
+        candidates.sort()
+
+        scores: Dict[int, float] = {}
+        budget = self.max_postings
+        for df, gram in candidates[:self.max_query_grams]:
+            if budget <= 0:
+                break
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            doc_ids, weights = self._postings[gram]
+            start = max(df - budget, 0)
+            budget -= df - start
+            for doc_id, weight in zip(doc_ids[start:], weights[start:]):
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * weight
+
+        results = []
+        seen = set()
+        for doc_id in sorted(scores, key=scores.get, reverse=True):
+            reply = self._replies[doc_id % self.max_entries]
+            if reply in seen:
+                continue
+            seen.add(reply)
+            results.append((scores[doc_id], reply))
+            if len(results) >= k:
+                break
+        return results
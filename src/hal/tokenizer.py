@@ -0,0 +1,112 @@
+import hashlib
+import re
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from .utils import normalize_messages
+
+# かな・漢字・ハングル・全角文字 (BPEでは概ね1文字が1トークン以上になる)
+_CJK = "぀-ヿ㐀-䶿一-鿿가-힯＀-￯"
+
+
+class Tokenizer(ABC):
+    """トークナイザの抽象基底クラス
+
+    tokenize を実装すれば、トークン数の計算と指定したトークン数での切り詰めに使える。
+    tokenize が返すトークンはつなげると元の文字列に戻る必要がある。
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[str]:
+        """text をトークンに分割する"""
+
+    def count(self, text: str) -> int:
+        return len(self.tokenize(text))
+
+    def truncate(self, text: str, max_tokens: int) -> Tuple[str, bool]:
+        """text を先頭 max_tokens トークンまでに切り詰める
+
+        Returns:
+            (切り詰めた文字列, 切り詰めたかどうか)
+        """
+        tokens = self.tokenize(text)
+        if len(tokens) <= max_tokens:
+            return text, False
+        return "".join(tokens[:max(max_tokens, 0)]), True
+
+
+class ApproximateTokenizer(Tokenizer):
+    """BPE系のトークナイザ (cl100k_baseなど) の分割を正規表現1つで近似するトークナイザ
+
+    語彙ファイルを使わずオフラインで動く。BPEの事前分割と同じく、英単語 (前の空白を含む)、
+    3桁ずつの数字、記号の並び、空白をそれぞれ1トークンとし、BPEで複数に分かれる長い単語は
+    10文字ごと、かなや漢字は1文字ごとに区切る。
+    """
+
+    name = "approx"
+
+    _pattern = re.compile(
+        rf"[{_CJK}]"
+        r"|'(?:[sdmt]|ll|ve|re)"
+        rf"| ?[^\W\d_{_CJK}]{{1,10}}"
+        r"| ?\d{1,3}"
+        rf"| ?[^\s\w{_CJK}]{{1,4}}"
+        r"|\s+(?!\S)|\s+"
+        r"|[\s\S]",
+        re.IGNORECASE
+    )
+
+    def tokenize(self, text: str) -> List[str]:
+        return self._pattern.findall(text)
+
+
+class TokenCounter:
+    """リクエストのトークン数を数える。メッセージごとのトークン数はメモ化する
+
+    エージェントは毎回会話の履歴全体を送り直すため、一度数えたメッセージは本文のハッシュから
+    トークン数を引き、新しいメッセージだけをトークナイズする。
+    1件あたりの付加トークン数はOpenAIのchatフォーマットの数え方に合わせている。
+
+    Args:
+        tokenizer: 使うトークナイザ。省略時は ApproximateTokenizer
+        max_entries: メモ化するメッセージの最大件数。超えたら古いものから忘れる
+    """
+
+    tokens_per_message = 3
+    # 応答の書き出し (<|start|>assistant<|message|>) の分
+    reply_priming = 3
+
+    def __init__(self, tokenizer: Optional[Tokenizer] = None, max_entries: int = 10000):
+        self.tokenizer = tokenizer or ApproximateTokenizer()
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def truncate(self, text: str, max_tokens: int) -> Tuple[str, bool]:
+        return self.tokenizer.truncate(text, max_tokens)
+
+    def count_message(self, role: str, text: str) -> int:
+        """1件のメッセージのトークン数 (付加トークンを含む)"""
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+        key.update(role.encode("utf-8"))
+        digest = key.digest()
+        count = self._counts.get(digest)
+        if count is not None:
+            self._counts.move_to_end(digest)
+            return count
+        count = self.tokens_per_message + self.tokenizer.count(role) + self.tokenizer.count(text)
+        self._counts[digest] = count
+        if len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+        return count
+
+    def prompt_tokens(self, messages: List[Any]) -> int:
+        """メッセージ列 (pydanticモデルまたはdict) のトークン数"""
+        return self.reply_priming + sum(
+            self.count_message(role or "", text) for role, text in normalize_messages(messages)
+        )
@@ -1,5 +1,5 @@
 import asyncio
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 from loguru import logger
 from pydantic import BaseModel
@@ -8,6 +8,8 @@ from textual.containers import Container
 from textual.reactive import reactive
 from textual.widgets import Footer, Header, Label, Static, TextArea
 
+from .utils import normalize_messages, request_field
+
 
 class MessageContentPart(BaseModel):
     type: str
@@ -53,11 +55,14 @@ class TUIApp(App):
     current_request = reactive(None)
     response_data = None
     
-    def __init__(self, request_data: Dict[str, Any], verbose: bool = False):
+    def __init__(self, request_data: Optional[Dict[str, Any]] = None, verbose: bool = False):
         super().__init__()
         self.request_data = request_data
         self.verbose = verbose
         self.response_ready = asyncio.Event()
+        # 常駐中のアプリへリクエストを渡すチャネル (リクエスト, 結果を受け取るFuture)
+        self.requests: asyncio.Queue = asyncio.Queue()
+        self.current_future: Optional[asyncio.Future] = None
         if verbose:
             logger.info("TUIを初期化しました")
     
@@ -85,8 +90,45 @@ class TUIApp(App):
         yield Footer()
     
     def on_mount(self) -> None:
-        """アプリが起動したときにリクエストデータを表示"""
+        """アプリが起動したときにリクエストデータを表示し、リクエストの受け付けを始める"""
         self.update_request_display()
+        self.run_worker(self.serve_requests(), exclusive=True)
+    
+    def submit_request(self, request_data: Any) -> asyncio.Future:
+        """リクエストを常駐中のアプリに渡し、応答を受け取るFutureを返す
+
+        request_data は検証済みの ChatCompletionRequest をそのまま渡す (dictも可)。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.requests.put_nowait((request_data, future))
+        return future
+    
+    async def serve_requests(self) -> None:
+        """チャネルからリクエストを1件ずつ取り出し、画面を差し替えて応答を待つ"""
+        while True:
+            request_data, future = await self.requests.get()
+            if future.done():
+                continue
+            
+            self.current_future = future
+            self.request_data = request_data
+            self.response_data = None
+            self.response_ready.clear()
+            self.query_one("#response-input").load_text("")
+            self.update_request_display()
+            self.query_one("#response-input").focus()
+            
+            ready = asyncio.ensure_future(self.response_ready.wait())
+            await asyncio.wait([ready, future], return_when=asyncio.FIRST_COMPLETED)
+            if future.done():
+                ready.cancel()
+            else:
+                future.set_result(self.response_data)
+            
+            self.current_future = None
+            self.request_data = None
+            self.query_one("#response-input").load_text("")
+            self.update_request_display()
     
     def update_request_display(self) -> None:
         """リクエスト情報を画面に表示"""
@@ -94,26 +136,22 @@ class TUIApp(App):
         messages_display = self.query_one("#messages")
         params_display = self.query_one("#params")
         
-        model_display.update(f"モデル: {self.request_data['model']}")
+        if self.request_data is None:
+            model_display.update("リクエストを待っています...")
+            messages_display.update("")
+            params_display.update("")
+            return
+        
+        model_display.update(f"モデル: {request_field(self.request_data, 'model', '')}")
         
         messages_text = "メッセージ:\n"
-        for msg in self.request_data["messages"]:
-            role = msg['role']
-            content = msg['content']
-            
-            if isinstance(content, list):
-                content_text = ""
-                for part in content:
-                    if part.get('type') == 'text':
-                        content_text += part.get('text', '') + " "
-                content = content_text.strip()
-                
+        for role, content in normalize_messages(request_field(self.request_data, "messages", [])):
             messages_text += f"- {role}: {content}\n"
         messages_display.update(messages_text)
         
         params_text = "パラメータ:\n"
-        params_text += f"- max_tokens: {self.request_data.get('max_tokens', 1000)}\n"
-        params_text += f"- temperature: {self.request_data.get('temperature', 0.7)}\n"
+        params_text += f"- max_tokens: {request_field(self.request_data, 'max_tokens', 1000)}\n"
+        params_text += f"- temperature: {request_field(self.request_data, 'temperature', 0.7)}\n"
         params_display.update(params_text)
         
         if self.verbose:
@@ -122,17 +160,11 @@ class TUIApp(App):
     def on_key(self, event) -> None:
         """キーボードショートカットの処理"""
         if event.key == "f1":
-            self.response_data = {"error": "cannot_answer"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "cannot_answer"})
         elif event.key == "f2":
-            self.response_data = {"error": "internal_error"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "internal_error"})
         elif event.key == "f3":
-            self.response_data = {"error": "forbidden"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "forbidden"})
         elif (event.key == "ctrl+enter" or event.key == "ctrl+m" or 
               event.key == "cmd+enter" or event.key == "cmd+m"):
             self.submit_response()
@@ -142,26 +174,60 @@ class TUIApp(App):
     def submit_response(self) -> None:
         """応答を送信する"""
         response_text = self.query_one("#response-input").text
-        self.response_data = {"content": response_text}
-        self.response_ready.set()
+        self.respond({"content": response_text})
         if self.verbose:
             logger.info(f"応答を送信: {response_text}")
-        self.exit()
+    
+    def respond(self, response_data: Dict[str, Any]) -> None:
+        """表示中のリクエストへの応答を確定する。待機中は何もしない"""
+        if self.request_data is None:
+            return
+        self.response_data = response_data
+        self.response_ready.set()
+
+
+_resident_app: Optional[TUIApp] = None
+_resident_task: Optional[asyncio.Task] = None
+
+
+def _get_resident_app(verbose: bool = False) -> TUIApp:
+    """常駐TUIアプリを返す。まだ起動していなければ起動する"""
+    global _resident_app, _resident_task
+    
+    if _resident_app is not None and _resident_task is not None and not _resident_task.done():
+        return _resident_app
+    
+    app = TUIApp(verbose=verbose)
+    
+    def on_exit(_):
+        # オペレータがアプリを終了した場合、処理中・待機中のリクエストは内部エラーとして返す
+        futures = [app.current_future]
+        while not app.requests.empty():
+            futures.append(app.requests.get_nowait()[1])
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_result({"error": "internal_error"})
+    
+    _resident_task = asyncio.create_task(app.run_async())
+    _resident_task.add_done_callback(on_exit)
+    _resident_app = app
+    return app
+
 
 async def process_request(request_data, verbose=False):
-    """リクエストをTUIで処理し、結果を返す"""
+    """リクエストを常駐TUIで処理し、結果を返す"""
     if verbose:
         logger.info("TUIでリクエストの処理を開始")
     
-    app = TUIApp(request_data.model_dump(), verbose)
-    async def run_app():
-        await app.run_async()
-    
-    asyncio.create_task(run_app())
-    
-    await app.response_ready.wait()
+    app = _get_resident_app(verbose)
+    future = app.submit_request(request_data)
+    try:
+        response_data = await future
+    finally:
+        if not future.done():
+            future.cancel()
     
     if verbose:
-        logger.info(f"TUIからの応答: {app.response_data}")
+        logger.info(f"TUIからの応答: {response_data}")
     
-    return app.response_data
+    return response_data
@@ -1,13 +1,17 @@
 import asyncio
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Optional
 
 from loguru import logger
 from pydantic import BaseModel
+from rich.markup import escape
 from textual.app import App, ComposeResult
 from textual.containers import Container
 from textual.reactive import reactive
 from textual.widgets import Button, Header, Label, Static, TextArea
 
+from .message_list import MessageList
+from .utils import request_field
+
 
 class Message(BaseModel):
     role: str
@@ -22,15 +26,18 @@ class TUIApp(App):
     Screen {
         layout: grid;
         grid-size: 1;
-        grid-rows: 1fr 3fr 1;
+        grid-rows: 1fr 1fr 1;
     }
     
     #request-container {
         height: 100%;
-        overflow-y: scroll;
         border: solid green;
     }
     
+    .request-item {
+        height: auto;
+    }
+    
     #response-container {
         height: 100%;
         border: solid blue;
@@ -54,12 +61,23 @@ class TUIApp(App):
     current_request = reactive(None)
     response_data = None
     
-    def __init__(self, request_data: Dict[str, Any], verbose: bool = False):
+    def __init__(
+        self,
+        request_data: Any = None,
+        verbose: bool = False,
+        on_update: Optional[Callable[[str], None]] = None
+    ):
         super().__init__()
         self.title = "Write Response"  # インスタンス変数として明示的に設定
         self.request_data = request_data
         self.verbose = verbose
+        self.on_update = on_update
+        self.suggestions: List[str] = []
+        self.seen_messages = 0
         self.response_ready = asyncio.Event()
+        # 常駐中のアプリへリクエストを渡すチャネル (リクエスト, 更新通知, 結果を受け取るFuture)
+        self.requests: asyncio.Queue = asyncio.Queue()
+        self.current_future: Optional[asyncio.Future] = None
         if verbose:
             logger.info("TUIを初期化しました")
     
@@ -70,41 +88,132 @@ class TUIApp(App):
         with Container(id="request-container"):
             yield Label("受信したリクエスト:")
             yield Static(id="model", classes="request-item")
-            yield Static(id="messages", classes="request-item")
             yield Static(id="params", classes="request-item")
+            yield MessageList(id="messages")
+            yield Static(id="suggestions", classes="request-item")
         
         with Container(id="response-container"):
             yield Label("応答の入力:")
             yield TextArea(id="response-input")
         
         with Container(id="help-container"):
-            yield Static("F1:対応不可 F2:内部エラー F3:権限なし F12:送信")
+            yield Static(
+                "F1:対応不可 F2:内部エラー F3:権限なし F5-F7:候補を挿入 F12:送信 "
+                "Tab→↑↓/Space:メッセージを選択・展開"
+            )
     
     def on_mount(self) -> None:
-        """アプリが起動したときにリクエストデータを表示"""
+        """アプリが起動したときにリクエストデータを表示し、リクエストの受け付けを始める"""
         self.update_request_display()
+        self.run_worker(self.serve_requests(), exclusive=True)
+    
+    def submit_request(
+        self,
+        request_data: Any,
+        on_update: Optional[Callable[[str], None]] = None,
+        suggestions: Optional[List[str]] = None,
+        seen_messages: int = 0
+    ) -> asyncio.Future:
+        """リクエストを常駐中のアプリに渡し、応答を受け取るFutureを返す
+
+        request_data は検証済みの ChatCompletionRequest をそのまま渡す (dictも可)。
+
+        suggestions には過去の似た応答を渡すと、F5〜F7で応答欄に挿入できるよう表示する。
+        seen_messages には回答済みの会話で既に表示した先頭のメッセージ数を渡すと、
+        それらを折りたたみ、新しいメッセージだけを強調して表示する。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.requests.put_nowait(
+            (request_data, on_update, suggestions or [], seen_messages, future)
+        )
+        return future
+    
+    async def serve_requests(self) -> None:
+        """チャネルからリクエストを1件ずつ取り出し、画面を差し替えて応答を待つ"""
+        while True:
+            request_data, on_update, suggestions, seen_messages, future = await self.requests.get()
+            if future.done():
+                # 待っている間に呼び出し元がキャンセルされた
+                continue
+            
+            self.current_future = future
+            self.request_data = request_data
+            self.on_update = on_update
+            self.suggestions = suggestions
+            self.seen_messages = seen_messages
+            self.response_data = None
+            self.response_ready.clear()
+            self.query_one("#response-input").load_text("")
+            self.update_request_display()
+            self.query_one("#response-input").focus()
+            
+            ready = asyncio.ensure_future(self.response_ready.wait())
+            await asyncio.wait([ready, future], return_when=asyncio.FIRST_COMPLETED)
+            if future.done():
+                ready.cancel()
+                if self.verbose:
+                    logger.info("呼び出し元がキャンセルされたため、表示中のリクエストを取り下げます")
+                self.notify(
+                    "応答期限切れまたは切断のため、リクエストを取り下げました", severity="warning"
+                )
+            else:
+                future.set_result(self.response_data)
+            
+            self.current_future = None
+            self.request_data = None
+            self.on_update = None
+            self.suggestions = []
+            self.seen_messages = 0
+            self.query_one("#response-input").load_text("")
+            self.update_request_display()
     
     def update_request_display(self) -> None:
         """リクエスト情報を画面に表示"""
         model_display = self.query_one("#model")
         messages_display = self.query_one("#messages")
         params_display = self.query_one("#params")
+        suggestions_display = self.query_one("#suggestions")
         
-        model_display.update(f"モデル: {self.request_data['model']}")
+        if self.request_data is None:
+            model_display.update("リクエストを待っています...")
+            messages_display.set_messages([])
+            params_display.update("")
+            suggestions_display.update("")
+            return
         
-        messages_text = "メッセージ:\n"
-        for msg in self.request_data["messages"]:
-            messages_text += f"- {msg['role']}: {msg['content']}\n"
-        messages_display.update(messages_text)
+        model_display.update(f"モデル: {escape(request_field(self.request_data, 'model', ''))}")
         
-        params_text = "パラメータ:\n"
-        params_text += f"- max_tokens: {self.request_data.get('max_tokens', 1000)}\n"
-        params_text += f"- temperature: {self.request_data.get('temperature', 0.7)}\n"
+        # メッセージは見えている行だけを描画するリストに渡し、全文の文字列は組み立てない
+        messages = request_field(self.request_data, "messages", [])
+        messages_display.set_messages(messages, seen=self.seen_messages)
+        
+        params_text = (
+            f"パラメータ: max_tokens={request_field(self.request_data, 'max_tokens', 1000)}, "
+            f"temperature={request_field(self.request_data, 'temperature', 0.7)}, "
+            f"メッセージ{len(messages)}件"
+        )
+        if 0 < self.seen_messages < len(messages):
+            params_text += f" (前回からの新規{len(messages) - self.seen_messages}件)"
         params_display.update(params_text)
         
+        suggestions_text = ""
+        if self.suggestions:
+            suggestions_text = "過去の似た応答:\n"
+            for i, suggestion in enumerate(self.suggestions):
+                preview = " ".join(suggestion.split())
+                if len(preview) > 80:
+                    preview = preview[:80] + "..."
+                suggestions_text += f"- F{5 + i}: {escape(preview)}\n"
+        suggestions_display.update(suggestions_text)
+        
         if self.verbose:
             logger.info("TUIにリクエスト情報を表示しました")
     
+    def on_text_area_changed(self, event: TextArea.Changed) -> None:
+        """入力中の応答文をストリーミング用に通知する"""
+        if self.on_update is not None:
+            self.on_update(event.text_area.text)
+    
     def on_button_pressed(self, event: Button.Pressed) -> None:
         """ボタンが押されたときの処理"""
         button_id = event.button.id
@@ -112,61 +221,101 @@ class TUIApp(App):
         if button_id == "send":
             self.submit_response()
         elif button_id == "cannot-answer":
-            self.response_data = {"error": "cannot_answer"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "cannot_answer"})
         elif button_id == "internal-error":
-            self.response_data = {"error": "internal_error"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "internal_error"})
         elif button_id == "forbidden":
-            self.response_data = {"error": "forbidden"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "forbidden"})
     
     def on_key(self, event) -> None:
         """キーボードショートカットの処理"""
         if event.key == "f1":
-            self.response_data = {"error": "cannot_answer"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "cannot_answer"})
         elif event.key == "f2":
-            self.response_data = {"error": "internal_error"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "internal_error"})
         elif event.key == "f3":
-            self.response_data = {"error": "forbidden"}
-            self.response_ready.set()
-            self.exit()
+            self.respond({"error": "forbidden"})
+        elif event.key in ("f5", "f6", "f7"):
+            self.insert_suggestion(int(event.key[1:]) - 5)
         elif event.key == "f12":
             self.submit_response()
-        elif event.key == "enter" and not isinstance(self.focused, TextArea):
+        elif event.key == "enter" and not isinstance(self.focused, (TextArea, MessageList)):
+            # メッセージ一覧では Enter でメッセージを展開・折りたたむ
             self.submit_response()
     
+    def insert_suggestion(self, index: int) -> None:
+        """過去の似た応答を応答欄のカーソル位置に挿入する"""
+        if index >= len(self.suggestions):
+            return
+        text_area = self.query_one("#response-input")
+        text_area.insert(self.suggestions[index])
+        text_area.focus()
+    
     def submit_response(self) -> None:
         """応答を送信する"""
         response_text = self.query_one("#response-input").text
-        self.response_data = {"content": response_text}
-        self.response_ready.set()
+        self.respond({"content": response_text})
         if self.verbose:
             logger.info(f"応答を送信: {response_text}")
-        self.exit()
+    
+    def respond(self, response_data: Dict[str, Any]) -> None:
+        """表示中のリクエストへの応答を確定する。待機中は何もしない"""
+        if self.request_data is None:
+            return
+        self.response_data = response_data
+        self.response_ready.set()
 
 
-async def process_request(request_data, verbose=False):
-    """リクエストをTUIで処理し、結果を返す"""
-    if verbose:
-        logger.info("TUIでリクエストの処理を開始")
+_resident_app: Optional[TUIApp] = None
+_resident_task: Optional[asyncio.Task] = None
+
+
+def _get_resident_app(verbose: bool = False) -> TUIApp:
+    """常駐TUIアプリを返す。まだ起動していなければ起動する"""
+    global _resident_app, _resident_task
+    
+    if _resident_app is not None and _resident_task is not None and not _resident_task.done():
+        return _resident_app
+    
+    app = TUIApp(verbose=verbose)
     
-    app = TUIApp(request_data.model_dump(), verbose)
-    async def run_app():
-        await app.run_async()
+    def on_exit(_):
+        # オペレータがアプリを終了した場合、処理中・待機中のリクエストは内部エラーとして返す
+        futures = [app.current_future]
+        while not app.requests.empty():
+            futures.append(app.requests.get_nowait()[-1])
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_result({"error": "internal_error"})
     
-    asyncio.create_task(run_app())
+    _resident_task = asyncio.create_task(app.run_async())
+    _resident_task.add_done_callback(on_exit)
+    _resident_app = app
+    return app
+
+
+async def process_request(
+    request_data, verbose=False, on_update=None, suggestions=None, seen_messages=0
+):
+    """リクエストを常駐TUIで処理し、結果を返す
+
+    on_update を指定すると、入力中の応答文が変わるたびにその全文で呼び出される。
+    suggestions には過去の似た応答のリストを渡す。
+    seen_messages には回答済みの会話で既に表示した先頭のメッセージ数を渡す。
+    """
+    if verbose:
+        logger.info("TUIでリクエストの処理を開始")
     
-    await app.response_ready.wait()
+    app = _get_resident_app(verbose)
+    # 巨大な会話でもコピーを作らないよう、検証済みのモデルをそのまま渡す
+    future = app.submit_request(request_data, on_update, suggestions, seen_messages)
+    try:
+        response_data = await future
+    finally:
+        if not future.done():
+            future.cancel()
     
     if verbose:
-        logger.info(f"TUIからの応答: {app.response_data}")
+        logger.info(f"TUIからの応答: {response_data}")
     
-    return app.response_data
+    return response_data
@@ -1,6 +1,10 @@
+import hashlib
 import json
+import os
+import queue
+import threading
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from loguru import logger
 
@@ -9,6 +13,90 @@ def format_json_response(data: Dict[str, Any], indent: int = 2) -> str:
     """JSON応答を整形して返す"""
     return json.dumps(data, indent=indent, ensure_ascii=False)
 
+def message_text(content: Any) -> str:
+    """メッセージのcontentを文字列にまとめる
+
+    文字列はそのまま、MessageContentPartのリストはtextパートを改行でつないだものを返す。
+    """
+    if isinstance(content, str):
+        return content
+    texts = []
+    for part in content:
+        part_type = part.get("type") if isinstance(part, dict) else part.type
+        if part_type == "text":
+            texts.append(part.get("text", "") if isinstance(part, dict) else part.text)
+    return "\n".join(texts)
+
+def request_field(request_data: Any, name: str, default: Any = None) -> Any:
+    """リクエストの項目を返す (検証済みの ChatCompletionRequest とdictの両方に対応)"""
+    if isinstance(request_data, dict):
+        return request_data.get(name, default)
+    return getattr(request_data, name, default)
+
+def normalize_messages(messages: List[Any]) -> List[List[str]]:
+    """メッセージ列を [role, 本文] のリストに正規化する (pydanticモデル・dictの両方に対応)"""
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict):
+            role, content = message.get("role"), message.get("content", "")
+        else:
+            role, content = message.role, message.content
+        normalized.append([role, message_text(content)])
+    return normalized
+
+_CANONICAL_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+def conversation_key(model: str, messages: List[Any]) -> str:
+    """model と正規化したメッセージ列から会話を識別するハッシュを作る
+
+    巨大な会話でも全体を1つの文字列にしないよう、JSONを少しずつ組み立てながらハッシュする。
+    """
+    digest = hashlib.sha256()
+    for chunk in _CANONICAL_ENCODER.iterencode([model, normalize_messages(messages)]):
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parse_size(value: str) -> int:
+    """"64M" や "512K" のような大きさの指定をバイト数に変換する (単位は1024倍、B は省略可)"""
+    text = value.strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ""
+    number = text[:len(text) - len(unit)]
+    try:
+        size = float(number) * _SIZE_UNITS[unit]
+    except ValueError:
+        raise ValueError(f"大きさの指定が不正です: {value}") from None
+    if size < 0:
+        raise ValueError(f"大きさの指定が不正です: {value}")
+    return int(size)
+
+def parse_weight(value: str) -> Tuple[str, float]:
+    """"トークン=重み" の指定を (トークン, 重み) に変換する"""
+    token, separator, weight = value.rpartition("=")
+    try:
+        number = float(weight)
+    except ValueError:
+        number = 0.0
+    if not separator or not token or number <= 0:
+        raise ValueError(f"重みの指定が不正です (トークン=正の数): {value}")
+    return token, number
+
+def truncate_for_log(value: Union[str, bytes], limit: int = 2000) -> str:
+    """ログ出力用に文字列・バイト列を先頭 limit 文字(バイト)までに切り詰める"""
+    if len(value) <= limit:
+        if isinstance(value, bytes):
+            return value.decode("utf-8", errors="replace")
+        return value
+    
+    head = value[:limit]
+    if isinstance(head, bytes):
+        head = head.decode("utf-8", errors="replace")
+    unit = "bytes" if isinstance(value, bytes) else "chars"
+    return f"{head}... (truncated, {len(value)} {unit})"
+
 def setup_logging(verbose: bool = False, log_file: Optional[str] = None):
     """ロギングの設定"""
     import sys
@@ -41,3 +129,149 @@ def dump_json_to_file(file_path: str, data: Dict[str, Any], is_request: bool = T
             "timestamp": int(time.time())
         }
         f.write(json.dumps(dump_data, ensure_ascii=False) + "\n")
+
+
+class JsonDumpWriter:
+    """JSONデータをバックグラウンドスレッドでまとめてndjsonファイルに追記する
+
+    write() はバッファに積むだけでイベントループを止めない。
+    バックグラウンドスレッドが batch_size 件たまるか flush_interval 秒経つごとにまとめて書き出す。
+    バッファが満杯の場合、そのレコードは捨てて dropped を数える。
+
+    Args:
+        file_path: 出力先ファイルパス
+        max_buffer: バッファに積める最大件数
+        batch_size: 一度に書き出す最大件数
+        flush_interval: 書き出しまでに待つ最大秒数
+        fsync: fsyncの方針。"never"はOS任せ、"batch"は書き出しごと、"always"は1件ごと
+    """
+
+    FSYNC_POLICIES = ("never", "batch", "always")
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(
+        self,
+        file_path: str,
+        max_buffer: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        fsync: str = "never"
+    ):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"fsyncの方針が不正です: {fsync}")
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.written = 0
+        self.dropped = 0
+        self._closed = False
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._file = open(file_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="json-dump-writer", daemon=True)
+        self._thread.start()
+
+    def write(
+        self,
+        data: Union[Dict[str, Any], bytes],
+        is_request: bool = True,
+        record_id: Optional[str] = None
+    ) -> bool:
+        """レコードをバッファに積む。積めなかった場合はFalseを返す
+
+        record_id を指定すると、同じリクエストのリクエスト行とレスポンス行に同じidを付ける。
+        data には解析済みのJSONのbytes (リクエストボディ) も渡せ、解析し直さずにそのまま埋め込む。
+        """
+        record = {"type": "request" if is_request else "response"}
+        if record_id is not None:
+            record["id"] = record_id
+        record["data"] = data
+        record["timestamp"] = int(time.time())
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1:
+                logger.warning("JSONダンプのバッファが満杯のため、レコードを破棄しました")
+            return False
+        return True
+
+    @property
+    def pending(self) -> int:
+        """まだ書き出していないレコード数"""
+        return self._queue.qsize()
+
+    def flush(self) -> None:
+        """バッファに積まれたレコードがすべて書き出されるまで待つ"""
+        if self._closed:
+            return
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self) -> None:
+        """残りのレコードを書き出してからファイルを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._file.close()
+        if self.dropped:
+            logger.warning(f"JSONダンプで破棄したレコード: {self.dropped}件")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP or item is self._FLUSH:
+                    stopping = item is self._STOP
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    logger.error(f"JSONダンプの書き出しに失敗しました: {e}")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> str:
+        if not isinstance(record["data"], (bytes, bytearray)):
+            return json.dumps(record, ensure_ascii=False)
+        # JSONの文字列中には改行が現れないため、整形された本文の改行は空白にしてよい
+        data = bytes(record["data"]).strip().replace(b"\r", b" ").replace(b"\n", b" ")
+        fields = (
+            f"{json.dumps(key)}: "
+            + (data.decode("utf-8") if key == "data" else json.dumps(value, ensure_ascii=False))
+            for key, value in record.items()
+        )
+        return "{" + ", ".join(fields) + "}"
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        for record in batch:
+            self._file.write(self._encode(record) + "\n")
+            if self.fsync == "always":
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        self._file.flush()
+        if self.fsync == "batch":
+            os.fsync(self._file.fileno())
+        self.written += len(batch)
@@ -0,0 +1,145 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows など flock の無い環境
+    fcntl = None
+
+
+def flock_available() -> bool:
+    """FileSlot (--shared-lock) が使えればTrue"""
+    return fcntl is not None
+
+
+def default_lock_file(port: int) -> str:
+    """--shared-lock で使うロックファイルの既定のパス"""
+    return os.path.join(tempfile.gettempdir(), f"hal-{port}.lock")
+
+
+class FileSlot:
+    """ロックファイルの flock で複数プロセス間の同時処理数を制限する処理枠
+
+    Operator の slot として ConcurrencyLimiter と置き換えて使う。
+    limit 個のロックファイル (path, path.1, path.2, ...) をそれぞれ1つの枠とし、
+    どれかを flock できれば枠を確保できる。同じプロセスが確保済みの枠は flock を試さずに飛ばす。
+    プロセスが異常終了してもロックはOSが解放する。
+    """
+
+    def __init__(self, path: str, limit: int = 1):
+        if not flock_available():
+            raise RuntimeError("flock (fcntl) が使えない環境では FileSlot を使用できません")
+        self.path = path
+        self.limit = limit
+        self._fds = [
+            os.open(path if index == 0 else f"{path}.{index}", os.O_RDWR | os.O_CREAT, 0o600)
+            for index in range(limit)
+        ]
+        self._held: List[int] = []
+
+    @property
+    def in_use(self) -> int:
+        """このプロセスが確保している枠の数"""
+        return len(self._held)
+
+    @staticmethod
+    def _try_lock(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """枠を確保する。イベントループを止めないよう、空きが無ければ待たずにFalseを返す"""
+        for index, fd in enumerate(self._fds):
+            if index not in self._held and self._try_lock(fd):
+                self._held.append(index)
+                return True
+        return False
+
+    def release(self) -> None:
+        fcntl.flock(self._fds[self._held.pop()], fcntl.LOCK_UN)
+
+    def locked(self) -> bool:
+        """このプロセスか他のプロセスが全ての枠を確保していればTrue"""
+        for index, fd in enumerate(self._fds):
+            if index not in self._held and self._try_lock(fd):
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return False
+        return True
+
+    def close(self) -> None:
+        for fd in self._fds:
+            os.close(fd)
+
+
+def _listen_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(
+    server_options: Dict[str, Any], host: str, port: int, sock: Optional[socket.socket]
+) -> None:
+    import uvicorn
+
+    from .server import HALServer
+
+    if sock is None:
+        sock = _listen_socket(host, port, reuse_port=True)
+    server = HALServer(**server_options)
+    uvicorn.Server(uvicorn.Config(server.app, host=host, port=port)).run(sockets=[sock])
+
+
+def serve_workers(server_options: Dict[str, Any], host: str, port: int, workers: int) -> None:
+    """HALServerを workers 個のプロセスで起動し、いずれかが終了するまで待つ
+
+    SO_REUSEPORT が使える環境では各プロセスが同じポートに個別のソケットを作り、
+    カーネルが接続をプロセス間に振り分ける。使えない環境では親プロセスで作ったソケットを共有する。
+    いずれかのプロセスが終了した場合 (DELETE /api/you を含む) は残りのプロセスも終了させる。
+    """
+    # SIGTERMでも終了処理を通して子プロセスを終了させる
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    reuse_port = hasattr(socket, "SO_REUSEPORT")
+    shared = None if reuse_port else _listen_socket(host, port, reuse_port=False)
+
+    processes: List[multiprocessing.Process] = []
+    try:
+        for index in range(workers):
+            process = multiprocessing.Process(
+                target=_run_worker,
+                args=(server_options, host, port, shared),
+                name=f"hal-worker-{index}"
+            )
+            process.start()
+            processes.append(process)
+        logger.info(
+            f"{workers}個のワーカープロセスを起動しました "
+            f"({'SO_REUSEPORT' if reuse_port else '共有ソケット'})"
+        )
+        multiprocessing.connection.wait([process.sentinel for process in processes])
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        if shared is not None:
+            shared.close()
+        logger.info("ワーカープロセスを終了しました")
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import httpx
+import pytest
+from click.testing import CliRunner
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.chat_client.bench import LatencyHistogram, run_bench
+from src.chat_client.main import build_payload, cli
+from src.hal.server import HALServer
+
+URL = "http://testserver/v1/chat/completions"
+
+
+def test_latency_histogram_percentiles():
+    """HDR方式のヒストグラムのパーセンタイルが相対精度内に収まることのテスト"""
+    histogram = LatencyHistogram()
+    for value in range(1, 100001):
+        histogram.record(value)
+
+    assert histogram.count == 100000
+    assert histogram.min == 1
+    assert histogram.max == 100000
+    for percentile, expected in ((50, 50000), (90, 90000), (99, 99000), (99.9, 99900)):
+        assert abs(histogram.percentile(percentile) - expected) / expected < 0.02
+    assert histogram.percentile(100) == 100000
+
+
+def test_latency_histogram_small_values_exact():
+    """小さな値は区間に丸められず正確に記録されることのテスト"""
+    histogram = LatencyHistogram()
+    for value in (3, 3, 7, 100):
+        histogram.record(value)
+
+    assert histogram.percentile(50) == 3
+    assert histogram.percentile(75) == 7
+    assert histogram.percentile(99.9) == 100
+    assert LatencyHistogram().percentile(50) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_bench_closed_loop_against_daemon():
+    """クローズドループで指定件数を送り切ることのテスト"""
+    server = HALServer(fix_reply="テスト応答")
+    transport = httpx.ASGITransport(app=server.app)
+
+    result = await run_bench(
+        URL, build_payload("gpt-4", "system", "こんにちは", 100, 0.7),
+        concurrency=4, requests=25, transport=transport
+    )
+
+    assert result.mode == "closed"
+    assert result.requests == 25
+    assert result.statuses == {"200": 25}
+    data = result.to_dict()
+    assert data["throughput"] > 0
+    assert set(data["latency_ms"]) == {"min", "mean", "max", "p50", "p90", "p99", "p99.9"}
+    json.dumps(data)
+
+
+@pytest.mark.asyncio
+async def test_run_bench_open_loop_status_breakdown():
+    """オープンループでステータスコードと接続エラーが数えられることのテスト"""
+    calls = {"count": 0}
+
+    def handler(request):
+        calls["count"] += 1
+        if calls["count"] % 3 == 0:
+            raise httpx.ConnectError("refused")
+        if calls["count"] % 2 == 0:
+            return httpx.Response(503, json={"error": "server_busy"})
+        return httpx.Response(200, json={})
+
+    result = await run_bench(
+        URL, {}, concurrency=2, requests=12, rate=1000,
+        transport=httpx.MockTransport(handler)
+    )
+
+    assert result.mode == "open"
+    assert result.requests == 12
+    assert result.statuses == {"200": 4, "503": 4, "ConnectError": 4}
+
+
+def test_bench_command_json_output():
+    """benchコマンドが結果をJSONで出力することのテスト"""
+    server = HALServer(fix_reply="テスト応答")
+    original = httpx.AsyncClient
+
+    def client_factory(**kwargs):
+        kwargs["transport"] = httpx.ASGITransport(app=server.app)
+        return original(**kwargs)
+
+    runner = CliRunner()
+    with patch("src.chat_client.bench.httpx.AsyncClient", side_effect=client_factory):
+        result = runner.invoke(cli, ["bench", "-n", "10", "-c", "2", "--json-output", "-"], obj={})
+
+    assert result.exit_code == 0, result.output
+    data = json.loads(result.output)
+    assert data["requests"] == 10
+    assert data["status"] == {"200": 10}
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.server import ChatCompletionRequest, HALServer
+
+BODY = json.dumps({
+    "model": "gpt-4", "messages": [{"role": "user", "content": "x" * 2000}]
+}).encode("utf-8")
+
+
+async def _call(app, chunks, content_length=True):
+    """ボディを chunks に分けて送り、(ステータス, 応答ボディ, 読まれたチャンク数) を返す"""
+    headers = [(b"content-type", b"application/json")]
+    if content_length:
+        headers.append((b"content-length", str(sum(map(len, chunks))).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    read = 0
+    messages = []
+    
+    async def receive():
+        nonlocal read
+        if read < len(chunks):
+            read += 1
+            more_body = read < len(chunks)
+            return {"type": "http.request", "body": chunks[read - 1], "more_body": more_body}
+        await asyncio.sleep(3600)
+    
+    async def send(message):
+        messages.append(message)
+    
+    await app(scope, receive, send)
+    status = messages[0]["status"]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return status, json.loads(body), read
+
+
+def _chunks(body, size=500):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.asyncio
+async def test_body_over_limit_rejected_before_reading():
+    """Content-Length が上限を超えていればボディを読まずに413を返すことのテスト"""
+    server = HALServer(fix_reply="固定", max_body_size=1000)
+    
+    status, body, read = await _call(server.app, _chunks(BODY))
+    
+    assert status == 413
+    assert body == {"error": "request_too_large"}
+    assert read == 0
+    assert server.requests_total.values == {"request_too_large": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fast_path", [True, False])
+async def test_chunked_body_over_limit_stops_reading(fast_path):
+    """Content-Length が無くても、上限を超えた時点で読み込みをやめて413を返すことのテスト"""
+    server = HALServer(fix_reply="固定", max_body_size=1000, fast_path=fast_path)
+    
+    status, body, read = await _call(server.app, _chunks(BODY), content_length=False)
+    
+    assert status == 413
+    assert body == {"error": "request_too_large"}
+    assert read == 3 < len(_chunks(BODY))
+    assert server.requests_total.values == {"request_too_large": 1}
+
+
+@pytest.mark.asyncio
+async def test_body_within_limit_accepted():
+    """上限以内のボディは分割して届いても通常どおり処理されることのテスト"""
+    server = HALServer(fix_reply="固定", max_body_size=len(BODY), fast_path=False)
+    
+    status, body, read = await _call(server.app, _chunks(BODY), content_length=False)
+    
+    assert status == 200
+    assert body["choices"][0]["message"]["content"] == "固定"
+
+
+def test_invalid_body_is_validation_error():
+    """JSONとして不正なボディや項目の欠けたボディが422になることのテスト"""
+    client = TestClient(HALServer(fix_reply="固定", fast_path=False).app)
+    
+    response = client.post(
+        "/v1/chat/completions", content=b"{not json", headers={"content-type": "application/json"}
+    )
+    assert response.status_code == 422
+    assert response.json()["error"] == "validation_error"
+    
+    response = client.post("/v1/chat/completions", json={"model": "gpt-4"})
+    assert response.status_code == 422
+    assert "messages" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_tui_receives_validated_model():
+    """TUIに検証済みのモデルがそのまま渡されることのテスト"""
+    from src.hal import tui_fix
+    
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    future = asyncio.get_running_loop().create_future()
+    future.set_result({"content": "回答"})
+    
+    with patch.object(tui_fix, "_get_resident_app") as get_app:
+        get_app.return_value.submit_request.return_value = future
+        assert await tui_fix.process_request(request) == {"content": "回答"}
+    
+    assert get_app.return_value.submit_request.call_args.args[0] is request
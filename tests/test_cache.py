@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.cache import ResponseCache
+from src.hal.server import ChatCompletionRequest, HALServer
+
+
+def test_cache_lru_eviction():
+    """最大件数を超えた場合に最も使われていない応答から捨てることのテスト"""
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "応答A")
+    cache.put("b", "応答B")
+    assert cache.get("a") == "応答A"
+    
+    cache.put("c", "応答C")
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == "応答A"
+    assert cache.get("c") == "応答C"
+    assert cache.evictions == 1
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_cache_ttl_expiration():
+    """有効期間を過ぎた応答を返さないことのテスト"""
+    cache = ResponseCache(ttl=10)
+    
+    with patch("src.hal.cache.time.time", return_value=1000.0):
+        cache.put("a", "応答A")
+    with patch("src.hal.cache.time.time", return_value=1009.0):
+        assert cache.get("a") == "応答A"
+    with patch("src.hal.cache.time.time", return_value=1010.0):
+        assert cache.get("a") is None
+    
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+
+def test_cache_persistence(tmp_path):
+    """ファイルへの保存と起動時の読み込みのテスト"""
+    cache_file = str(tmp_path / "cache.json")
+    
+    cache = ResponseCache(file_path=cache_file)
+    cache.put("a", "応答A")
+    cache.save()
+    
+    restored = ResponseCache(file_path=cache_file)
+    assert restored.get("a") == "応答A"
+
+
+def _chat_route(server):
+    return [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+
+
+@pytest.mark.asyncio
+async def test_server_serves_cached_reply():
+    """同じ会話の2回目以降はオペレータを通さずキャッシュから返すことのテスト"""
+    server = HALServer(cache_size=10)
+    handler = AsyncMock(return_value={"content": "人間の応答"})
+    server.operator_pool.operators[0].handler = handler
+    
+    raw_request = MagicMock()
+    raw_request.headers = {}
+    first = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    second = ChatCompletionRequest(
+        model="gpt-4",
+        messages=[{"role": "user", "content": [{"type": "text", "text": "質問"}]}]
+    )
+    
+    await _chat_route(server).endpoint(first, raw_request)
+    response = await _chat_route(server).endpoint(second, raw_request)
+    
+    handler.assert_awaited_once()
+    assert response.headers["X-HAL-Cache"] == "hit"
+    assert json.loads(response.body)["choices"][0]["message"]["content"] == "人間の応答"
+    assert server.response_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_server_cache_opt_out():
+    """Cache-Control: no-cache を指定した場合はキャッシュを使わないことのテスト"""
+    server = HALServer(cache_size=10)
+    handler = AsyncMock(return_value={"content": "人間の応答"})
+    server.operator_pool.operators[0].handler = handler
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    
+    raw_request = MagicMock()
+    raw_request.headers = {"cache-control": "no-cache"}
+    await _chat_route(server).endpoint(request, raw_request)
+    await _chat_route(server).endpoint(request, raw_request)
+    
+    assert handler.await_count == 2
+    assert server.response_cache.hits == 0
@@ -1,12 +1,17 @@
+import json
 import os
 import sys
+import time
 from unittest.mock import MagicMock, patch
 
+import pytest
+import requests
 from click.testing import CliRunner
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
+from chat_client.batch import build_batch_payload
 from chat_client.main import cli
 
 
@@ -76,3 +81,69 @@ def test_daemon_command():
         assert result.exit_code == 0
         
         mock_delete.assert_called_once()
+
+
+def test_send_requires_user_or_input():
+    """--user も --input も無い場合にエラーになることのテスト"""
+    runner = CliRunner()
+    
+    result = runner.invoke(cli, ["send"], obj={})
+    
+    assert result.exit_code != 0
+    assert "--user または --input" in result.output
+
+
+def test_build_batch_payload():
+    """入力行の形式ごとにリクエストボディが組み立てられることのテスト"""
+    defaults = {"model": "gpt-4", "system": "既定", "max_tokens": 100, "temperature": 0.5}
+    
+    payload = build_batch_payload('"こんにちは"', defaults)
+    assert payload == {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "system", "content": "既定"},
+            {"role": "user", "content": "こんにちは"}
+        ],
+        "max_tokens": 100,
+        "temperature": 0.5
+    }
+    
+    payload = build_batch_payload('{"user": "質問", "system": "別", "model": "m"}', defaults)
+    assert payload["model"] == "m"
+    assert payload["messages"][0]["content"] == "別"
+    assert "user" not in payload
+    
+    messages = [{"role": "user", "content": "そのまま"}]
+    payload = build_batch_payload(json.dumps({"messages": messages}), defaults)
+    assert payload["messages"] == messages
+    assert payload["temperature"] == 0.5
+    
+    for line in ("[1]", '{"foo": 1}', "not json"):
+        with pytest.raises(ValueError):
+            build_batch_payload(line, defaults)
+
+
+def test_send_input_batch_keeps_order():
+    """--input の各行が並行して送信され、入力と同じ順序で出力されることのテスト"""
+    runner = CliRunner()
+    delays = {"1": 0.05, "2": 0.0, "3": 0.02}
+    
+    def fake_post(self, url, json=None, timeout=None):
+        user = json["messages"][1]["content"]
+        time.sleep(delays.get(user, 0))
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {"echo": user, "auth": self.headers["Authorization"]}
+        return response
+    
+    lines = '"1"\n"2"\n\n"3"\n[]\n'
+    with patch.object(requests.Session, "post", fake_post):
+        result = runner.invoke(
+            cli, ["send", "--input", "-", "--parallel", "3"], input=lines, obj={}
+        )
+    
+    assert result.exit_code == 0
+    outputs = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [o.get("echo") for o in outputs] == ["1", "2", "3", None]
+    assert outputs[0]["auth"] == "Bearer fake-token"
+    assert outputs[3]["error"] == "invalid_input"
@@ -0,0 +1,70 @@
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.conversation import ConversationTracker
+from src.hal.server import ChatCompletionRequest, HALServer
+
+
+def test_seen_count_for_continued_conversation():
+    """回答済みの会話の続きでは、応答までを既読の件数として返すことのテスト"""
+    tracker = ConversationTracker()
+    first = [
+        {"role": "system", "content": "あなたはアシスタントです"},
+        {"role": "user", "content": "こんにちは"},
+    ]
+    assert tracker.seen_count("gpt-4", first) == 0
+    tracker.record("gpt-4", first, "こんにちは！")
+    
+    followup = first + [
+        {"role": "assistant", "content": [{"type": "text", "text": "こんにちは！"}]},
+        {"role": "user", "content": "天気は？"},
+    ]
+    assert tracker.seen_count("gpt-4", followup) == 3
+    # 別のモデル、途中が書き換えられた会話、応答が異なる会話は続きとみなさない
+    assert tracker.seen_count("gpt-3.5", followup) == 0
+    edited = [first[0], {"role": "user", "content": "こんばんは"}] + followup[2:]
+    assert tracker.seen_count("gpt-4", edited) == 1
+    other_reply = first + [{"role": "assistant", "content": "別の応答"}, followup[3]]
+    assert tracker.seen_count("gpt-4", other_reply) == 2
+
+
+def test_tracker_forgets_oldest_prefixes():
+    """覚えておくハッシュの件数に上限があることのテスト"""
+    tracker = ConversationTracker(max_prefixes=4)
+    tracker.record("gpt-4", [{"role": "user", "content": "一つ目"}], "応答")
+    tracker.record("gpt-4", [{"role": "user", "content": "二つ目"}], "応答")
+    tracker.record("gpt-4", [{"role": "user", "content": "三つ目"}], "応答")
+    
+    assert len(tracker) == 4
+    assert tracker.seen_count("gpt-4", [{"role": "user", "content": "一つ目"}]) == 0
+    assert tracker.seen_count("gpt-4", [{"role": "user", "content": "三つ目"}]) == 1
+
+
+@pytest.mark.asyncio
+async def test_server_passes_seen_messages_to_tui():
+    """続きのリクエストで既読のメッセージ数がTUIに渡されることのテスト"""
+    server = HALServer()
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    history = [{"role": "user", "content": "注文を確認したい"}]
+    
+    with patch("src.hal.tui_fix.process_request", new_callable=AsyncMock) as mock_process:
+        mock_process.return_value = {"content": "注文番号を教えてください"}
+        await chat_route.endpoint(
+            ChatCompletionRequest(model="gpt-4", messages=history), MagicMock()
+        )
+        history = history + [
+            {"role": "assistant", "content": "注文番号を教えてください"},
+            {"role": "user", "content": "12345です"},
+        ]
+        await chat_route.endpoint(
+            ChatCompletionRequest(model="gpt-4", messages=history), MagicMock()
+        )
+    
+    assert mock_process.await_args_list[0].kwargs["seen_messages"] == 0
+    assert mock_process.await_args_list[1].kwargs["seen_messages"] == 2
+    assert HALServer(fix_reply="固定").conversations is None
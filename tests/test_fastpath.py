@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.fastpath import FixedReplyFastPath
+from src.hal.server import HALServer
+
+
+def test_render_matches_full_response():
+    """テンプレートから作った応答が通常経路と同じ形式になることのテスト"""
+    fast_path = FixedReplyFastPath(None, fix_reply="固定 \"応答\"")
+    
+    body = json.loads(fast_path.render('gpt-4 "quoted" モデル', prompt_tokens=12))
+    
+    assert body["id"].startswith("chatcmpl-")
+    assert len(body["id"]) == len("chatcmpl-") + 5
+    assert body["object"] == "chat.completion"
+    assert isinstance(body["created"], int)
+    assert body["model"] == 'gpt-4 "quoted" モデル'
+    assert body["choices"] == [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "固定 \"応答\""},
+        "finish_reason": "stop"
+    }]
+    completion_tokens = fast_path.completion_tokens
+    assert body["usage"] == {
+        "prompt_tokens": 12,
+        "completion_tokens": completion_tokens,
+        "total_tokens": 12 + completion_tokens
+    }
+
+
+def test_daemon_fast_path_response():
+    """デーモンモードで高速経路が使われることのテスト"""
+    server = HALServer(fix_reply="テスト応答")
+    assert server.fast_path
+    
+    client = TestClient(server.app)
+    response = client.post(
+        "/v1/chat/completions",
+        json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+    )
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["model"] == "gpt-4"
+    assert response.json()["choices"][0]["message"]["content"] == "テスト応答"
+    assert server.operator_pool.operators[0].handled == 0
+
+
+def test_daemon_fast_path_falls_back():
+    """高速経路で扱えないリクエストが通常の経路に回されることのテスト"""
+    server = HALServer(fix_reply="テスト応答")
+    client = TestClient(server.app)
+    
+    response = client.post("/v1/chat/completions", json={"messages": []})
+    assert response.status_code == 422
+    assert response.json()["error"] == "validation_error"
+    
+    response = client.post(
+        "/v1/chat/completions",
+        json={"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert server.operator_pool.operators[0].handled == 1
+
+
+def test_fast_path_disabled_when_logging(tmp_path):
+    """verboseやJSONダンプが有効な場合は高速経路を使わないことのテスト"""
+    assert not HALServer(fix_reply="テスト応答", verbose=True).fast_path
+    dump_server = HALServer(fix_reply="テスト応答", json_dump_log=str(tmp_path / "dump.ndjson"))
+    assert not dump_server.fast_path
+    dump_server.json_dump_writer.close()
+    assert not HALServer(fix_reply="テスト応答", fast_path=False).fast_path
+    assert not HALServer().fast_path
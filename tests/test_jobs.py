@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.jobs import JobStore
+
+
+async def _reply(value, delay=0.0):
+    await asyncio.sleep(delay)
+    return value
+
+
+@pytest.mark.asyncio
+async def test_job_store_wait_and_result():
+    """ジョブの完了を待ち、結果を取り出せることのテスト"""
+    store = JobStore()
+    job = store.submit(_reply("応答", delay=0.05))
+    
+    assert store.get(job.id) is job
+    assert store.pending == 1
+    assert not await store.wait(job, 0.001)
+    assert await store.wait(job, 1)
+    assert job.response == "応答"
+    assert store.pending == 0
+    assert store.get("job-unknown") is None
+
+
+@pytest.mark.asyncio
+async def test_job_store_ttl_expiration():
+    """完了から有効期間を過ぎたジョブを捨てることのテスト"""
+    store = JobStore(ttl=10)
+    with patch("src.hal.jobs.time.monotonic", return_value=1000.0):
+        job = store.submit(_reply("応答"))
+        await store.wait(job, 1)
+    
+    with patch("src.hal.jobs.time.monotonic", return_value=1009.0):
+        assert store.get(job.id) is job
+    with patch("src.hal.jobs.time.monotonic", return_value=1010.0):
+        assert store.get(job.id) is None
+    assert store.expirations == 1
+
+
+@pytest.mark.asyncio
+async def test_job_store_bounded():
+    """上限に達したら完了済みのジョブを古い順に捨て、全件が処理中なら受け付けないことのテスト"""
+    store = JobStore(max_jobs=2)
+    done = store.submit(_reply("完了"))
+    await store.wait(done, 1)
+    pending = store.submit(asyncio.Event().wait())
+    
+    third = store.submit(asyncio.Event().wait())
+    assert third is not None
+    assert store.get(done.id) is None
+    assert store.evictions == 1
+    
+    assert store.submit(_reply("溢れ")) is None
+    assert len(store) == 2
+    
+    store.cancel_all()
+    await asyncio.sleep(0)
+    assert pending.task.cancelled() and third.task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_job_store_cancel_and_error():
+    """ジョブの取り消しと、処理中の例外を500の応答にすることのテスト"""
+    store = JobStore()
+    job = store.submit(asyncio.Event().wait())
+    assert store.cancel(job.id) is job
+    await asyncio.sleep(0)
+    assert job.task.cancelled()
+    assert store.get(job.id) is None
+    assert store.cancel(job.id) is None
+    
+    async def fail():
+        raise RuntimeError("失敗")
+    
+    job = store.submit(fail())
+    await store.wait(job, 1)
+    assert job.response.status_code == 500
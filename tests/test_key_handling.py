@@ -1,7 +1,10 @@
+import asyncio
 import os
 import sys
 from unittest.mock import MagicMock, patch
 
+import pytest
+
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.hal.tui_fix import TUIApp
@@ -50,3 +53,36 @@ def test_key_handling_enter_logic():
             app.on_key(enter_event)
             
             mock_submit.assert_not_called()
+
+
+def test_text_area_changed_notifies_update():
+    """入力内容の変更がストリーミング用コールバックへ通知されることのテスト"""
+    request_data = {
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": "テスト"}]
+    }
+    updates = []
+    app = TUIApp(request_data, on_update=updates.append)
+    
+    event = MagicMock()
+    event.text_area.text = "入力途中"
+    app.on_text_area_changed(event)
+    
+    assert updates == ["入力途中"]
+
+
+@pytest.mark.asyncio
+async def test_suggestion_inserted_with_function_key():
+    """F5で過去の似た応答が応答欄に挿入されることのテスト"""
+    app = TUIApp()
+    
+    async with app.run_test() as pilot:
+        future = app.submit_request(
+            {"model": "gpt-4", "messages": [{"role": "user", "content": "テスト"}]},
+            suggestions=["候補の応答", "二つ目の候補"]
+        )
+        await pilot.pause()
+        assert "F6: 二つ目の候補" in str(app.query_one("#suggestions").render())
+        
+        await pilot.press("f6", "f12")
+        assert await asyncio.wait_for(future, 5) == {"content": "二つ目の候補"}
@@ -47,7 +47,26 @@ def test_main_verbose_mode():
                 mock_server.assert_called_once_with(
                     verbose=True, 
                     fix_reply=None, 
-                    json_dump_log=None
+                    json_dump_log=None,
+                    json_dump_fsync="never",
+                    queue_depth=0,
+                    queue_timeout=30.0,
+                    cache_size=0,
+                    cache_ttl=3600.0,
+                    cache_file=None,
+                    replay_from=None,
+                    slot_lock_file=None,
+                    max_concurrency=1,
+                    rules_file=None,
+                    operator_timeout=None,
+                    timeout_fallback="504",
+                    timeout_reply=None,
+                    max_body_size=64 * 1024 * 1024,
+                    max_jobs=1000,
+                    job_ttl=3600.0,
+                    headless=False,
+                    caller_weights=None,
+                    suggestion_size=100000
                 )
 
 
@@ -64,7 +83,26 @@ def test_main_daemon_mode():
             mock_server.assert_called_once_with(
                 verbose=False, 
                 fix_reply="固定応答", 
-                json_dump_log=None
+                json_dump_log=None,
+                json_dump_fsync="never",
+                queue_depth=0,
+                queue_timeout=30.0,
+                cache_size=0,
+                cache_ttl=3600.0,
+                cache_file=None,
+                replay_from=None,
+                slot_lock_file=None,
+                max_concurrency=1,
+                rules_file=None,
+                operator_timeout=None,
+                timeout_fallback="504",
+                timeout_reply=None,
+                max_body_size=64 * 1024 * 1024,
+                max_jobs=1000,
+                job_ttl=3600.0,
+                headless=False,
+                caller_weights=None,
+                suggestion_size=100000
             )
 
 
@@ -90,7 +128,26 @@ def test_main_log_file_option():
                     mock_server.assert_called_once_with(
                         verbose=False, 
                         fix_reply=None, 
-                        json_dump_log=None
+                        json_dump_log=None,
+                        json_dump_fsync="never",
+                        queue_depth=0,
+                        queue_timeout=30.0,
+                        cache_size=0,
+                        cache_ttl=3600.0,
+                        cache_file=None,
+                        replay_from=None,
+                        slot_lock_file=None,
+                        max_concurrency=1,
+                        rules_file=None,
+                        operator_timeout=None,
+                        timeout_fallback="504",
+                        timeout_reply=None,
+                        max_body_size=64 * 1024 * 1024,
+                        max_jobs=1000,
+                        job_ttl=3600.0,
+                        headless=False,
+                        caller_weights=None,
+                        suggestion_size=100000
                     )
     
     finally:
@@ -118,9 +175,110 @@ def test_main_json_dump_log_option():
                         verbose=False, log_file=None
                     )
                     mock_server.assert_called_once_with(
-                        verbose=False, fix_reply=None, json_dump_log=test_json_dump_log_file
+                        verbose=False,
+                        fix_reply=None,
+                        json_dump_log=test_json_dump_log_file,
+                        json_dump_fsync="never",
+                        queue_depth=0,
+                        queue_timeout=30.0,
+                        cache_size=0,
+                        cache_ttl=3600.0,
+                        cache_file=None,
+                        replay_from=None,
+                        slot_lock_file=None,
+                        max_concurrency=1,
+                        rules_file=None,
+                        operator_timeout=None,
+                        timeout_fallback="504",
+                        timeout_reply=None,
+                        max_body_size=64 * 1024 * 1024,
+                        max_jobs=1000,
+                        job_ttl=3600.0,
+                        headless=False,
+                        caller_weights=None,
+                        suggestion_size=100000
                     )
     
     finally:
         if os.path.exists(test_json_dump_log_file):
             os.unlink(test_json_dump_log_file)
+
+
+def test_main_queue_options():
+    """HALメイン関数の待ち行列オプションテスト"""
+    runner = CliRunner()
+    
+    with patch("src.hal.main.uvicorn.run"):
+        with patch("src.hal.main.HALServer") as mock_server:
+            result = runner.invoke(main, ["--queue-depth", "5", "--queue-timeout", "2.5"])
+            
+            assert result.exit_code == 0
+            
+            kwargs = mock_server.call_args.kwargs
+            assert kwargs["queue_depth"] == 5
+            assert kwargs["queue_timeout"] == 2.5
+
+
+def test_main_workers_requires_daemon_mode():
+    """--workers がデーモンモード以外や併用できないオプションで拒否されることのテスト"""
+    runner = CliRunner()
+    
+    with patch("src.hal.workers.serve_workers") as mock_serve:
+        result = runner.invoke(main, ["--workers", "2"])
+        assert result.exit_code != 0
+        assert "--fix-reply-daemon" in result.output
+        
+        result = runner.invoke(
+            main, ["--workers", "2", "--fix-reply-daemon", "x", "--cache-file", "c.json"]
+        )
+        assert result.exit_code != 0
+        
+        mock_serve.assert_not_called()
+
+
+def test_main_workers_option():
+    """--workers と --shared-lock でワーカープロセスが起動されることのテスト"""
+    runner = CliRunner()
+    
+    with patch("src.hal.main.uvicorn.run") as mock_run:
+        with patch("src.hal.workers.serve_workers") as mock_serve:
+            result = runner.invoke(
+                main,
+                ["--fix-reply-daemon", "固定応答", "--workers", "4", "--shared-lock",
+                 "--port", "8123"]
+            )
+            
+            assert result.exit_code == 0
+            mock_run.assert_not_called()
+            
+            options, host, port, workers = mock_serve.call_args.args
+            assert (host, port, workers) == ("127.0.0.1", 8123, 4)
+            assert options["fix_reply"] == "固定応答"
+            assert options["slot_lock_file"].endswith("hal-8123.lock")
+
+
+def test_main_shared_lock_requires_flock():
+    """flock (fcntl) の無い環境では --shared-lock が拒否されることのテスト"""
+    runner = CliRunner()
+    
+    with patch("src.hal.workers.fcntl", None):
+        with patch("src.hal.main.HALServer") as mock_server:
+            result = runner.invoke(main, ["--fix-reply-daemon", "x", "--shared-lock"])
+            assert result.exit_code != 0
+            assert "--shared-lock" in result.output
+            mock_server.assert_not_called()
+
+
+def test_main_max_concurrency_option():
+    """--max-concurrency 0 が無制限として渡されることのテスト"""
+    runner = CliRunner()
+    
+    with patch("src.hal.main.uvicorn.run"):
+        with patch("src.hal.main.HALServer") as mock_server:
+            result = runner.invoke(main, ["--fix-reply-daemon", "x", "--max-concurrency", "0"])
+            assert result.exit_code == 0
+            assert mock_server.call_args.kwargs["max_concurrency"] is None
+            
+            result = runner.invoke(main, ["--fix-reply-daemon", "x", "--max-concurrency", "4"])
+            assert result.exit_code == 0
+            assert mock_server.call_args.kwargs["max_concurrency"] == 4
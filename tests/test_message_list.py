@@ -0,0 +1,158 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.message_list import MessageList
+from src.hal.tui_fix import TUIApp
+
+
+def _visible_text(widget: MessageList) -> str:
+    return "\n".join(
+        widget.render_line(y).text for y in range(widget.scrollable_content_region.height)
+    )
+
+
+def _request(messages):
+    return {"model": "gpt-4", "messages": messages}
+
+
+@pytest.mark.asyncio
+async def test_long_messages_are_collapsed_and_expandable():
+    """長いメッセージが折りたたまれ、選択してスペースキーで展開できることのテスト"""
+    long_text = "\n".join(f"ツール出力{i}" for i in range(500))
+    app = TUIApp()
+    
+    async with app.run_test(size=(100, 40)) as pilot:
+        future = app.submit_request(_request([
+            {"role": "system", "content": "短いシステムプロンプト"},
+            {"role": "tool", "content": long_text},
+            {"role": "user", "content": [{"type": "text", "text": "要約して"}]},
+        ]))
+        await pilot.pause()
+        messages = app.query_one("#messages", MessageList)
+        
+        assert messages.item_count == 3
+        assert messages.cursor == 2
+        assert not messages.is_expanded(1)
+        assert messages.is_expanded(0) and messages.is_expanded(2)
+        text = _visible_text(messages)
+        assert "▶ [2/3] tool" in text
+        assert "ツール出力2" in text and "ツール出力3" not in text
+        assert "… 全500行" in text
+        assert "要約して" in text
+        
+        messages.focus()
+        await pilot.press("up", "space")
+        assert messages.is_expanded(1)
+        assert messages.virtual_size.height == 1 + 1 + (1 + 500) + 1 + 1
+        await pilot.press("space")
+        assert not messages.is_expanded(1)
+        
+        future.cancel()
+        await pilot.pause()
+
+
+@pytest.mark.asyncio
+async def test_many_messages_render_only_visible_lines():
+    """多数のメッセージでも見えている行だけが組み立てられることのテスト"""
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"メッセージ{i}\n" * 20}
+        for i in range(2000)
+    ]
+    app = TUIApp()
+    
+    async with app.run_test(size=(100, 40)) as pilot:
+        future = app.submit_request(_request(history))
+        await pilot.pause()
+        messages = app.query_one("#messages", MessageList)
+        
+        assert messages.item_count == 2000
+        # 最後のメッセージが表示され、行を組み立てたのは見えているメッセージだけ
+        assert "[2000/2000] assistant" in _visible_text(messages)
+        built = sum(1 for item in messages._items if item._width != -1)
+        assert built <= 3
+        
+        future.cancel()
+        await pilot.pause()
+
+
+@pytest.mark.asyncio
+async def test_wide_characters_are_wrapped():
+    """全角文字を含む行が表示幅で折り返されることのテスト"""
+    app = TUIApp()
+    
+    async with app.run_test(size=(40, 40)) as pilot:
+        future = app.submit_request(_request([{"role": "user", "content": "あ" * 50}]))
+        await pilot.pause()
+        messages = app.query_one("#messages", MessageList)
+        
+        lines = [line for line in _visible_text(messages).split("\n") if "あ" in line]
+        assert "".join(line.strip() for line in lines) == "あ" * 50
+        assert len(lines) > 1
+        
+        future.cancel()
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_seen_messages_are_folded():
+    """既読のメッセージが1行にまとめられ、新しいメッセージだけが表示されることのテスト"""
+    app = TUIApp()
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"過去の発言{i}"}
+        for i in range(40)
+    ]
+    
+    async with app.run_test(size=(100, 40)) as pilot:
+        future = app.submit_request(
+            _request(history + [{"role": "user", "content": "新しい質問"}]), seen_messages=40
+        )
+        await pilot.pause()
+        messages = app.query_one("#messages", MessageList)
+        
+        text = _visible_text(messages)
+        assert "前回までのメッセージ 40件" in text
+        assert "[41/41] 新規 user" in text
+        assert "過去の発言" not in text
+        assert "新規1件" in str(app.query_one("#params").render())
+        
+        messages.focus()
+        await pilot.press("up", "space")
+        assert messages.item_count == 41
+        assert "[1/41] user" in _visible_text(messages)
+        # 既読のメッセージを展開した後も、新しいメッセージは強調したまま
+        messages.scroll_end(animate=False, immediate=True)
+        await pilot.pause()
+        assert "[41/41] 新規 user" in _visible_text(messages)
+        assert "[40/41] assistant" in _visible_text(messages)
+        
+        future.cancel()
+        await pilot.pause()
+
+
+@pytest.mark.asyncio
+async def test_enter_in_message_list_does_not_submit():
+    """メッセージ一覧で Enter を押しても応答を送信せず、メッセージを展開することのテスト"""
+    long_text = "\n".join(f"ツール出力{i}" for i in range(500))
+    app = TUIApp()
+    
+    async with app.run_test(size=(100, 40)) as pilot:
+        future = app.submit_request(_request([
+            {"role": "user", "content": "質問"},
+            {"role": "tool", "content": long_text},
+        ]))
+        await pilot.pause()
+        messages = app.query_one("#messages", MessageList)
+        
+        messages.focus()
+        await pilot.press("enter")
+        await pilot.pause()
+        assert not future.done()
+        assert messages.is_expanded(1)
+        
+        future.cancel()
+        await pilot.pause()
@@ -0,0 +1,125 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.metrics import MetricsRegistry
+from src.hal.server import HALServer
+
+
+def _samples(text):
+    """Prometheusのテキスト形式から {サンプル名: 値} を取り出す"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_registry_renders_prometheus_text():
+    """カウンター・ゲージ・ヒストグラムがテキスト形式で出力されることのテスト"""
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "テスト", label="outcome")
+    registry.gauge("test_gauge", "テスト", lambda: 3)
+    histogram = registry.histogram("test_seconds", "テスト", buckets=(0.1, 1.0))
+
+    counter.inc("ok")
+    counter.inc("ok")
+    counter.inc('a"b')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    text = registry.render()
+    assert "# TYPE test_total counter" in text
+    assert "# TYPE test_seconds histogram" in text
+    samples = _samples(text)
+    assert samples['test_total{outcome="ok"}'] == 2
+    assert samples['test_total{outcome="a\\"b"}'] == 1
+    assert samples["test_gauge"] == 3
+    assert samples['test_seconds_bucket{le="0.1"}'] == 1
+    assert samples['test_seconds_bucket{le="1"}'] == 2
+    assert samples['test_seconds_bucket{le="+Inf"}'] == 3
+    assert samples["test_seconds_count"] == 3
+    assert samples["test_seconds_sum"] == 5.55
+
+
+def test_metrics_endpoint_counts_outcomes():
+    """/metrics にリクエストの結果・枠の保持時間・待ち行列の状態が出ることのテスト"""
+    server = HALServer(fix_reply="テスト応答", fast_path=False)
+    client = TestClient(server.app)
+
+    client.post(
+        "/v1/chat/completions",
+        json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+    )
+    client.post("/v1/chat/completions", json={"model": "gpt-4"})
+    server.operator_pool.operators[0].slot.acquire()
+    busy = client.post(
+        "/v1/chat/completions",
+        json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+    )
+    assert busy.status_code == 503
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+    assert samples['hal_requests_total{outcome="ok"}'] == 1
+    assert samples['hal_requests_total{outcome="validation_error"}'] == 1
+    assert samples['hal_requests_total{outcome="server_busy"}'] == 1
+    assert samples["hal_lock_held_seconds_count"] == 1
+    assert samples["hal_operator_think_seconds_count"] == 1
+    assert samples["hal_serialization_seconds_count"] == 1
+    assert samples["hal_operators"] == 1
+    assert samples["hal_operators_busy"] == 1
+    assert samples["hal_queue_depth"] == 0
+
+
+def test_metrics_fast_path_counts_requests():
+    """高速経路で返した応答も数えられることのテスト"""
+    server = HALServer(fix_reply="テスト応答")
+    assert server.fast_path
+    client = TestClient(server.app)
+
+    for _ in range(3):
+        client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+        )
+
+    samples = _samples(client.get("/metrics").text)
+    assert samples['hal_requests_total{outcome="ok"}'] == 3
+    assert samples["hal_serialization_seconds_count"] == 3
+    assert samples["hal_lock_held_seconds_count"] == 0
+
+
+def test_metrics_cache_and_replay_counters(tmp_path):
+    """応答キャッシュとリプレイのヒット・ミスが /metrics に出ることのテスト"""
+    dump_file = tmp_path / "dump.ndjson"
+    dump_file.write_text("")
+    server = HALServer(
+        fix_reply="固定応答", fast_path=False, cache_size=10, replay_from=str(dump_file)
+    )
+    client = TestClient(server.app)
+
+    for _ in range(3):
+        client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+        )
+
+    text = client.get("/metrics").text
+    assert "# TYPE hal_cache_hits_total counter" in text
+    samples = _samples(text)
+    assert samples["hal_cache_hits_total"] == 2
+    assert samples["hal_cache_misses_total"] == 1
+    assert samples["hal_cache_evictions_total"] == 0
+    assert samples["hal_replay_hits_total"] == 0
+    assert samples["hal_replay_misses_total"] == 3
+    assert "hal_cache_hits_total" not in _samples(
+        TestClient(HALServer(fix_reply="x").app).get("/metrics").text
+    )
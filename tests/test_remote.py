@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.chat_client.console import ConsoleApp
+from src.hal.server import ChatCompletionRequest, HALServer
+
+
+class FakeWebSocket:
+    """テスト用のWebSocket。コンソール側の送受信をキューで行う"""
+
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.outgoing: asyncio.Queue = asyncio.Queue()
+        self.closed_code = None
+
+    async def accept(self):
+        pass
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        await self.outgoing.put(json.loads(text))
+
+    async def close(self, code=1000):
+        self.closed_code = code
+
+    def reply(self, frame):
+        self.incoming.put_nowait({"type": "websocket.receive", "text": json.dumps(frame)})
+
+    def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+    async def next_frame(self, kind):
+        while True:
+            frame = await asyncio.wait_for(self.outgoing.get(), 5)
+            if frame["type"] == kind:
+                return frame
+
+
+def _routes(server):
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    console_route = [r for r in server.app.routes if r.path == "/v1/operators/ws"][0]
+    return chat_route, console_route
+
+
+async def _connect(server, console_route, name):
+    websocket = FakeWebSocket()
+    session = asyncio.ensure_future(console_route.endpoint(websocket, name=name))
+    hello = await websocket.next_frame("hello")
+    assert hello["operator"] == f"remote:{name}"
+    return websocket, session
+
+
+def _request(content="質問"):
+    return ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": content}])
+
+
+@pytest.mark.asyncio
+async def test_remote_console_answers_request():
+    """WebSocketで接続したオペレータにリクエストを送り、応答・判定を返せることのテスト"""
+    server = HALServer(headless=True)
+    chat_route, console_route = _routes(server)
+    assert server.operator_pool.operators == []
+    websocket, session = await _connect(server, console_route, "alice")
+    assert len(server.operator_pool.operators) == 1
+
+    response = asyncio.ensure_future(chat_route.endpoint(_request(), MagicMock()))
+    frame = await websocket.next_frame("request")
+    assert frame["messages"] == [["user", "質問"]]
+    assert frame["seen"] == 0 and frame["stream"] is False
+    websocket.reply({"type": "reply", "id": frame["id"], "content": "回答"})
+    assert (await response).choices[0]["message"]["content"] == "回答"
+
+    # 回答済みの会話の続きは既読の件数が添えられる
+    follow_up = ChatCompletionRequest(model="gpt-4", messages=[
+        {"role": "user", "content": "質問"},
+        {"role": "assistant", "content": "回答"},
+        {"role": "user", "content": "続き"}
+    ])
+    response = asyncio.ensure_future(chat_route.endpoint(follow_up, MagicMock()))
+    frame = await websocket.next_frame("request")
+    assert frame["seen"] == 2
+    websocket.reply({"type": "verdict", "id": frame["id"], "error": "forbidden"})
+    assert (await response).status_code == 403
+
+    websocket.disconnect()
+    await session
+    assert server.operator_pool.operators == []
+
+
+@pytest.mark.asyncio
+async def test_remote_console_disconnect_reassigns_request():
+    """処理中のオペレータが切断したら、別のオペレータに割り当て直すことのテスト"""
+    server = HALServer(headless=True, queue_depth=10)
+    chat_route, console_route = _routes(server)
+
+    # 接続中のオペレータがいない間は待ち行列で待ち、接続した時点で割り当てる
+    response = asyncio.ensure_future(chat_route.endpoint(_request(), MagicMock()))
+    await asyncio.sleep(0.01)
+    assert server.admission.depth == 1
+    first, first_session = await _connect(server, console_route, "alice")
+    await first.next_frame("request")
+
+    second, second_session = await _connect(server, console_route, "bob")
+    first.disconnect()
+    await first_session
+
+    frame = await second.next_frame("request")
+    second.reply({"type": "reply", "id": frame["id"], "content": "引き継いだ回答"})
+    assert (await response).choices[0]["message"]["content"] == "引き継いだ回答"
+    assert server.reassigned_total.values == {"": 1}
+    assert [operator.name for operator in server.operator_pool.operators] == ["remote:bob"]
+
+    second.disconnect()
+    await second_session
+
+
+@pytest.mark.asyncio
+async def test_remote_console_cancel_and_heartbeat():
+    """応答期限切れで cancel を送り、ping に応答しないコンソールを切断することのテスト"""
+    server = HALServer(headless=True, operator_timeout=0.05)
+    server.heartbeat_interval = 0.2
+    chat_route, console_route = _routes(server)
+    websocket, session = await _connect(server, console_route, "alice")
+
+    response = asyncio.ensure_future(chat_route.endpoint(_request(), MagicMock()))
+    frame = await websocket.next_frame("request")
+    cancel = await websocket.next_frame("cancel")
+    assert cancel["id"] == frame["id"]
+    assert (await response).status_code == 504
+
+    await websocket.next_frame("ping")
+    await asyncio.wait_for(session, 5)
+    assert websocket.closed_code == 1001
+    assert server.operator_pool.operators == []
+
+
+class OfflineConsoleApp(ConsoleApp):
+    async def relay(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_console_app_sends_reply_and_drafts():
+    """コンソールがTUIの入力を draft と reply のフレームにして送ることのテスト"""
+    app = OfflineConsoleApp("ws://test/v1/operators/ws")
+    outbox = asyncio.Queue()
+
+    async with app.run_test() as pilot:
+        app._accept({
+            "type": "request", "id": "r1", "model": "gpt-4",
+            "messages": [["user", "こんにちは"]], "stream": True, "seen": 0, "suggestions": []
+        }, outbox)
+        await pilot.pause()
+        assert app.request_data["messages"] == [{"role": "user", "content": "こんにちは"}]
+        await pilot.press("o", "k")
+        await pilot.press("f12")
+        await pilot.pause()
+
+        frames = [outbox.get_nowait() for _ in range(outbox.qsize())]
+        assert frames[0] == {"type": "draft", "id": "r1"}
+        assert app._drafts == {}
+        assert frames[-1] == {"type": "reply", "id": "r1", "content": "ok"}
+
+        app._accept({"type": "request", "id": "r2", "model": "gpt-4", "messages": []}, outbox)
+        await pilot.pause()
+        await pilot.press("f1")
+        await pilot.pause()
+        assert outbox.get_nowait() == {"type": "verdict", "id": "r2", "error": "cannot_answer"}
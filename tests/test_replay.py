@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.replay import ReplayIndex
+from src.hal.server import ChatCompletionRequest, HALServer
+from src.hal.utils import JsonDumpWriter
+
+
+def _request(text):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": text}]}
+
+
+def test_replay_index_pairs_by_id(tmp_path):
+    """idで対応付けたリクエストと応答が索引されることのテスト"""
+    dump_file = str(tmp_path / "dump.ndjson")
+    writer = JsonDumpWriter(dump_file)
+    writer.write(_request("一件目"), is_request=True, record_id="a")
+    writer.write(_request("二件目"), is_request=True, record_id="b")
+    writer.write({"error": "forbidden"}, is_request=False, record_id="b")
+    writer.write({"role": "assistant", "content": "一件目の応答"}, is_request=False, record_id="a")
+    writer.close()
+    
+    index = ReplayIndex(dump_file)
+    
+    assert len(index) == 2
+    assert index.lookup("gpt-4", _request("一件目")["messages"]) == {"content": "一件目の応答"}
+    assert index.lookup("gpt-4", _request("二件目")["messages"]) == {"error": "forbidden"}
+    assert index.lookup("gpt-4", _request("三件目")["messages"]) is None
+    assert (index.hits, index.misses) == (2, 1)
+    index.close()
+
+
+def test_replay_index_legacy_records(tmp_path):
+    """idの無い古い記録は直前のリクエストと対応付けることのテスト"""
+    dump_file = tmp_path / "dump.ndjson"
+    lines = [
+        {"type": "request", "data": _request("質問"), "timestamp": 1},
+        {"type": "response", "data": {"error": "cannot_answer"}, "timestamp": 2},
+        {"type": "response", "data": {"role": "assistant", "content": "孤立"}, "timestamp": 3},
+        {"type": "request", "data": _request("質問"), "timestamp": 4},
+        {"type": "response", "data": {"role": "assistant", "content": "最新"}, "timestamp": 5},
+    ]
+    dump_file.write_text(
+        "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines) + "壊れた行",
+        encoding="utf-8"
+    )
+    
+    index = ReplayIndex(str(dump_file))
+    
+    assert len(index) == 1
+    assert index.lookup("gpt-4", _request("質問")["messages"]) == {"content": "最新"}
+    index.close()
+
+
+def test_replay_index_skips_timeouts(tmp_path):
+    """応答期限切れの記録が、同じ会話のそれ以前の応答を上書きしないことのテスト"""
+    dump_file = str(tmp_path / "dump.ndjson")
+    writer = JsonDumpWriter(dump_file)
+    writer.write(_request("質問"), is_request=True, record_id="a")
+    writer.write({"role": "assistant", "content": "人間の応答"}, is_request=False, record_id="a")
+    writer.write(_request("質問"), is_request=True, record_id="b")
+    writer.write({"error": "timeout"}, is_request=False, record_id="b")
+    writer.write(_request("期限切れだけ"), is_request=True, record_id="c")
+    writer.write({"error": "timeout"}, is_request=False, record_id="c")
+    writer.close()
+    
+    index = ReplayIndex(dump_file)
+    
+    assert len(index) == 1
+    assert index.lookup("gpt-4", _request("質問")["messages"]) == {"content": "人間の応答"}
+    assert index.lookup("gpt-4", _request("期限切れだけ")["messages"]) is None
+    index.close()
+
+
+def test_replay_index_empty_file(tmp_path):
+    """空のファイルを読み込めることのテスト"""
+    dump_file = tmp_path / "empty.ndjson"
+    dump_file.write_text("")
+    
+    index = ReplayIndex(str(dump_file))
+    assert len(index) == 0
+    assert index.lookup("gpt-4", []) is None
+    index.close()
+
+
+@pytest.mark.asyncio
+async def test_server_replays_recorded_session(tmp_path):
+    """記録したセッションをリプレイし、一致しないものは固定返答で返すことのテスト"""
+    dump_file = str(tmp_path / "dump.ndjson")
+    
+    recorder = HALServer(json_dump_log=dump_file)
+    recorder.operator_pool.operators[0].handler = AsyncMock(return_value={"content": "人間の応答"})
+    raw_request = MagicMock()
+    raw_request.body = AsyncMock(return_value=json.dumps(_request("記録する質問")).encode("utf-8"))
+    chat_route = [r for r in recorder.app.routes if r.path == "/v1/chat/completions"][0]
+    await chat_route.endpoint(ChatCompletionRequest(**_request("記録する質問")), raw_request)
+    recorder.json_dump_writer.close()
+    
+    server = HALServer(fix_reply="既定の応答", replay_from=dump_file)
+    assert not server.fast_path
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    
+    hit = await chat_route.endpoint(ChatCompletionRequest(**_request("記録する質問")), MagicMock())
+    miss = await chat_route.endpoint(ChatCompletionRequest(**_request("新しい質問")), MagicMock())
+    
+    assert hit.choices[0]["message"]["content"] == "人間の応答"
+    assert miss.choices[0]["message"]["content"] == "既定の応答"
+    assert server.operator_pool.operators[0].handled == 1
+    
+    # ストリーミング要求にも記録済みの応答をSSEで返す
+    stream = await chat_route.endpoint(
+        ChatCompletionRequest(**_request("記録する質問"), stream=True), MagicMock()
+    )
+    frames = [frame async for frame in stream.body_iterator]
+    events = [frame.decode("utf-8")[len("data: "):].strip() for frame in frames]
+    assert events[-1] == "[DONE]"
+    assert json.loads(events[1])["choices"][0]["delta"] == {"content": "人間の応答"}
+    assert server.operator_pool.operators[0].handled == 1
+    server.replay_index.close()
+
+
+@pytest.mark.asyncio
+async def test_timeout_fallback_is_not_replayed(tmp_path):
+    """期限切れで代わりに返した応答は記録されず、リプレイでは以前の応答を返すことのテスト"""
+    dump_file = str(tmp_path / "dump.ndjson")
+    
+    recorder = HALServer(
+        json_dump_log=dump_file, operator_timeout=0.05,
+        timeout_fallback="reply", timeout_reply="担当者が不在です"
+    )
+    handler = AsyncMock(return_value={"content": "人間の応答"})
+    recorder.operator_pool.operators[0].handler = handler
+    raw_request = MagicMock()
+    raw_request.body = AsyncMock(return_value=json.dumps(_request("質問")).encode("utf-8"))
+    chat_route = [r for r in recorder.app.routes if r.path == "/v1/chat/completions"][0]
+    await chat_route.endpoint(ChatCompletionRequest(**_request("質問")), raw_request)
+    
+    async def never_answers(*args, **kwargs):
+        await asyncio.sleep(10)
+    
+    handler.side_effect = never_answers
+    fallback = await chat_route.endpoint(ChatCompletionRequest(**_request("質問")), raw_request)
+    assert fallback.choices[0]["message"]["content"] == "担当者が不在です"
+    recorder.json_dump_writer.close()
+    
+    with open(dump_file, encoding="utf-8") as f:
+        assert json.loads(f.readlines()[-1])["data"] == {"error": "timeout"}
+    
+    index = ReplayIndex(dump_file)
+    assert index.lookup("gpt-4", _request("質問")["messages"]) == {"content": "人間の応答"}
+    index.close()
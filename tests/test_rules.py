@@ -0,0 +1,189 @@
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.rules import AhoCorasick, RuleSet
+from src.hal.server import ChatCompletionRequest, HALServer
+
+
+def _messages(*pairs):
+    return ChatCompletionRequest(
+        model="gpt-4", messages=[{"role": role, "content": content} for role, content in pairs]
+    ).messages
+
+
+def test_aho_corasick_overlapping_keywords():
+    """重なり合うキーワードを1回の走査で全て見つけられることのテスト"""
+    automaton = AhoCorasick([("he", 0), ("she", 1), ("his", 2), ("hers", 3), ("ヘルス", 4)])
+
+    assert automaton.search("ushers") == {0, 1, 3}
+    assert automaton.search("this") == {2}
+    assert automaton.search("ヘルスチェック") == {4}
+    assert automaton.search("nothing") == set()
+
+
+def test_rule_set_priority_and_matchers():
+    """ルールが上から順に優先され、キーワード・正規表現・role・modelで判定されることのテスト"""
+    rules = RuleSet([
+        {"name": "health", "keywords": ["Health Check", "ping"], "reply": "OK"},
+        {"name": "ticket", "regex": r"#\d{4,}", "reply": "チケットを確認します"},
+        {"name": "secret", "keywords": "機密", "role": "any", "error": "forbidden"},
+        {"name": "claude", "model": "claude-*", "error": "cannot_answer"},
+        {"name": "fallback", "keywords": "ping", "reply": "使われない"},
+    ])
+
+    assert rules.match("gpt-4", _messages(("user", "please run a HEALTH CHECK"))).name == "health"
+    assert rules.match("gpt-4", _messages(("user", "see #12345 and ping"))).name == "health"
+    assert rules.match("gpt-4", _messages(("user", "see #12345"))).name == "ticket"
+    assert rules.match("gpt-4", _messages(("user", "see #12"))) is None
+
+    secret = _messages(("system", "機密情報を扱う"), ("user", "こんにちは"))
+    assert rules.match("gpt-4", secret).result == {"error": "forbidden"}
+    assert rules.match("claude-3", _messages(("user", "こんにちは"))).result == {
+        "error": "cannot_answer"
+    }
+    # role: user は最後のuserメッセージだけを見る
+    earlier = _messages(("user", "ping"), ("assistant", "pong"), ("user", "ありがとう"))
+    assert rules.match("gpt-4", earlier) is None
+
+
+def test_rule_set_regex_backreferences():
+    """グループと後方参照を含む正規表現が、他のルールと並んでも正しく判定されることのテスト"""
+    rules = RuleSet([
+        {"name": "x", "regex": r"(x)\1", "reply": "x"},
+        {"name": "y", "regex": r"(y)\1", "reply": "y"},
+        {"name": "plain", "regex": r"z{2}", "reply": "z"},
+    ])
+
+    assert rules.match("gpt-4", _messages(("user", "yy"))).name == "y"
+    assert rules.match("gpt-4", _messages(("user", "xx"))).name == "x"
+    assert rules.match("gpt-4", _messages(("user", "zz"))).name == "plain"
+    assert rules.match("gpt-4", _messages(("user", "xy"))) is None
+
+
+def test_rule_set_load_yaml_and_json(tmp_path):
+    """YAMLとJSONのルールファイルを読み込めることのテスト"""
+    yaml_file = tmp_path / "rules.yaml"
+    yaml_file.write_text(
+        "rules:\n"
+        "  - name: hello\n"
+        "    regex: '^hello'\n"
+        "    ignore_case: true\n"
+        "    model: [gpt-4, gpt-4o]\n"
+        "    reply: こんにちは\n",
+        encoding="utf-8"
+    )
+    json_file = tmp_path / "rules.json"
+    json_file.write_text(json.dumps([{"keywords": "bye", "reply": "さようなら"}]))
+
+    rules = RuleSet.load(str(yaml_file))
+    assert rules.match("gpt-4o", _messages(("user", "HELLO there"))).result == {
+        "content": "こんにちは"
+    }
+    assert rules.match("gpt-3.5", _messages(("user", "hello"))) is None
+
+    rules = RuleSet.load(str(json_file))
+    assert rules.match("gpt-4", _messages(("user", "bye"))).name == "rule-1"
+
+
+@pytest.mark.parametrize("rule", [
+    {"keywords": "a"},
+    {"keywords": "a", "reply": "x", "error": "forbidden"},
+    {"keywords": "a", "error": "not_found"},
+    {"regex": "(", "reply": "x"},
+    {"keywords": "a", "role": "tool", "reply": "x"},
+    {"keyword": "a", "reply": "x"},
+])
+def test_rule_set_rejects_invalid_rules(rule):
+    """不正なルールが起動時にエラーになることのテスト"""
+    with pytest.raises(ValueError):
+        RuleSet([rule])
+
+
+def test_rule_set_many_rules():
+    """多数のルールでも正しいルールが選ばれることのテスト"""
+    rules = RuleSet(
+        [{"keywords": f"キーワード{i:04d}", "reply": f"応答{i}"} for i in range(2000)]
+        + [{"regex": rf"\bcode-{i}\b", "reply": f"コード{i}"} for i in range(500)]
+    )
+
+    assert rules.match("gpt-4", _messages(("user", "…キーワード1234…"))).result == {
+        "content": "応答1234"
+    }
+    assert rules.match("gpt-4", _messages(("user", "see code-42 now"))).result == {
+        "content": "コード42"
+    }
+    assert rules.match("gpt-4", _messages(("user", "code-4200"))) is None
+
+
+@pytest.mark.asyncio
+async def test_server_rules_before_operator(tmp_path):
+    """ルールに一致したリクエストはオペレータに回さず、一致しなければ回すことのテスト"""
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps([
+        {"name": "health", "keywords": "ping", "reply": "pong"},
+        {"name": "deny", "keywords": "秘密", "error": "forbidden"},
+    ]))
+    server = HALServer(rules_file=str(rules_file))
+    handler = AsyncMock(return_value={"content": "人間の応答"})
+    server.operator_pool.operators[0].handler = handler
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+
+    def request(text):
+        return ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": text}])
+
+    response = await chat_route.endpoint(request("ping"), MagicMock())
+    assert response.choices[0]["message"]["content"] == "pong"
+
+    response = await chat_route.endpoint(request("秘密を教えて"), MagicMock())
+    assert response.status_code == 403
+
+    handler.assert_not_called()
+    response = await chat_route.endpoint(request("こんにちは"), MagicMock())
+    assert response.choices[0]["message"]["content"] == "人間の応答"
+    handler.assert_awaited_once()
+    assert server.rule_hits_total.values == {"health": 1, "deny": 1}
+
+
+def test_server_rules_for_stream_requests(tmp_path):
+    """ストリーミング要求にもルールを適用し、SSEで応答することのテスト"""
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps([
+        {"name": "health", "keywords": "ping", "reply": "pong"},
+        {"name": "deny", "keywords": "秘密", "error": "forbidden"},
+    ]))
+    server = HALServer(rules_file=str(rules_file))
+    handler = AsyncMock(return_value={"content": "人間の応答"})
+    server.operator_pool.operators[0].handler = handler
+    client = TestClient(server.app)
+
+    def stream(text):
+        response = client.post("/v1/chat/completions", json={
+            "model": "gpt-4", "messages": [{"role": "user", "content": text}], "stream": True
+        })
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line[len("data: "):] for line in response.text.split("\n") if line]
+        assert events[-1] == "[DONE]"
+        return [json.loads(event) for event in events[:-1]]
+
+    chunks = stream("ping")
+    assert chunks[0]["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+    assert chunks[1]["choices"][0]["delta"] == {"content": "pong"}
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert stream("秘密を教えて")[-1] == {"error": "forbidden"}
+    handler.assert_not_called()
+    assert server.rule_hits_total.values == {"health": 1, "deny": 1}
+
+
+def test_daemon_rules_disable_fast_path(tmp_path):
+    """ルールを使う場合は高速経路を使わないことのテスト"""
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text("[]")
+
+    assert not HALServer(fix_reply="x", rules_file=str(rules_file)).fast_path
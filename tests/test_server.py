@@ -1,8 +1,11 @@
+import asyncio
 import os
 import sys
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import pytest
+from fastapi import Request
 
 # プロジェクトルートをパスに追加
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -14,6 +17,7 @@ from src.hal.server import (
     MessageContentPart,
     authenticate,
 )
+from src.hal.utils import conversation_key
 
 
 def test_server_initialization():
@@ -76,8 +80,8 @@ async def test_chat_completions_busy():
     """リクエスト処理中の排他制御テスト"""
     server = HALServer()
     
-    with patch("src.hal.server.request_lock") as mock_lock:
-        mock_lock.acquire.return_value = False
+    with patch.object(server.operator_pool.operators[0], "slot") as mock_slot:
+        mock_slot.acquire.return_value = False
         
         request = ChatCompletionRequest(
             model="gpt-4", 
@@ -101,32 +105,73 @@ async def test_chat_completions_busy():
 @pytest.mark.asyncio
 async def test_verbose_request_logging():
     """verboseモードでのHTTPリクエスト詳細ログのテスト"""
+    from loguru import logger
+    
     server = HALServer(verbose=True)
+    messages = []
+    sink_id = logger.add(lambda message: messages.append(message.record["message"]), level="DEBUG")
     
-    with patch("src.hal.server.logger") as mock_logger:
-        with patch("src.hal.server.request_lock") as mock_lock:
-            mock_lock.acquire.return_value = True
-            
-            request = ChatCompletionRequest(
-                model="gpt-4", 
-                messages=[{"role": "user", "content": "こんにちは"}]
-            )
-            
-            mock_raw_request = MagicMock()
-            mock_raw_request.headers = {"Content-Type": "application/json"}
-            mock_raw_request.body = AsyncMock(return_value=b'{"test": "data"}')
-            
-            routes = server.app.routes
-            chat_route = [r for r in routes if r.path == "/v1/chat/completions"][0]
-            
-            with patch("src.hal.server.authenticate", return_value=True):
-                with patch("src.hal.tui_fix.process_request") as mock_process:
-                    mock_process.return_value = {"content": "テスト応答"}
-                    await chat_route.endpoint(request, mock_raw_request)
-                    
-                    headers_dict = dict(mock_raw_request.headers)
-                    mock_logger.debug.assert_any_call(f"HTTPリクエストヘッダー: {headers_dict}")
-                    mock_logger.debug.assert_any_call("HTTPリクエストボディ: {\"test\": \"data\"}")
+    try:
+        request = ChatCompletionRequest(
+            model="gpt-4", 
+            messages=[{"role": "user", "content": "こんにちは"}]
+        )
+        
+        mock_raw_request = MagicMock()
+        mock_raw_request.headers = {"Content-Type": "application/json"}
+        mock_raw_request.body = AsyncMock(return_value=b'{"test": "data"}')
+        
+        routes = server.app.routes
+        chat_route = [r for r in routes if r.path == "/v1/chat/completions"][0]
+        
+        with patch("src.hal.server.authenticate", return_value=True):
+            with patch("src.hal.tui_fix.process_request") as mock_process:
+                mock_process.return_value = {"content": "テスト応答"}
+                await chat_route.endpoint(request, mock_raw_request)
+                
+                headers_dict = dict(mock_raw_request.headers)
+                assert f"HTTPリクエストヘッダー: {headers_dict}" in messages
+                assert "HTTPリクエストボディ: {\"test\": \"data\"}" in messages
+                mock_raw_request.body.assert_awaited_once()
+    finally:
+        logger.remove(sink_id)
+
+
+@pytest.mark.asyncio
+async def test_verbose_logging_is_lazy_and_truncated():
+    """ログが出力されない場合は整形せず、大きなボディは切り詰めることのテスト"""
+    from loguru import logger
+    
+    server = HALServer(verbose=True)
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    
+    mock_raw_request = MagicMock()
+    mock_raw_request.body = AsyncMock(return_value=b"x" * 100000)
+    mock_raw_request.headers = MagicMock()
+    
+    server.operator_pool.operators[0].handler = AsyncMock(return_value={"content": "ok"})
+    
+    logger.remove()
+    sink_id = logger.add(lambda message: None, level="INFO")
+    try:
+        await chat_route.endpoint(request, mock_raw_request)
+    finally:
+        logger.remove(sink_id)
+        logger.add(sys.stderr, level="INFO")
+    mock_raw_request.headers.keys.assert_not_called()
+    mock_raw_request.headers.__iter__.assert_not_called()
+    
+    messages = []
+    sink_id = logger.add(lambda message: messages.append(message.record["message"]), level="DEBUG")
+    try:
+        await chat_route.endpoint(request, mock_raw_request)
+    finally:
+        logger.remove(sink_id)
+    body_logs = [m for m in messages if m.startswith("HTTPリクエストボディ: ")]
+    assert len(body_logs) == 1
+    assert len(body_logs[0]) < 3000
+    assert body_logs[0].endswith("(truncated, 100000 bytes)")
 
 
 def test_message_model_array_content():
@@ -172,8 +217,8 @@ async def test_server_daemon_array_content():
     
     request = ChatCompletionRequest(**request_data)
     
-    with patch("src.hal.server.request_lock") as mock_lock:
-        mock_lock.acquire.return_value = True
+    with patch.object(server.operator_pool.operators[0], "slot") as mock_slot:
+        mock_slot.acquire.return_value = True
         
         with patch("src.hal.server.authenticate", return_value=True):
             routes = server.app.routes
@@ -203,8 +248,8 @@ async def test_json_dump_log():
     try:
         server = HALServer(verbose=True, json_dump_log=test_json_dump_file)
         
-        with patch("src.hal.server.request_lock") as mock_lock:
-            mock_lock.acquire.return_value = True
+        with patch.object(server.operator_pool.operators[0], "slot") as mock_slot:
+            mock_slot.acquire.return_value = True
             
             request = ChatCompletionRequest(
                 model="gpt-4", 
@@ -228,6 +273,9 @@ async def test_json_dump_log():
                     mock_process.return_value = {"content": "こんにちは、お元気ですか？"}
                     
                     await chat_route.endpoint(request, mock_raw_request)
+                    server.json_dump_writer.close()
+                    # ダンプのためにボディを解析し直さない
+                    mock_raw_request.json.assert_not_called()
                     
                     assert os.path.exists(test_json_dump_file)
                     
@@ -249,3 +297,628 @@ async def test_json_dump_log():
     finally:
         if os.path.exists(test_json_dump_file):
             os.unlink(test_json_dump_file)
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_hands_operator_in_order():
+    """待ち行列が到着順にオペレータを引き渡すことのテスト"""
+    from src.hal.server import AdmissionQueue, Operator, OperatorPool
+
+    operator = Operator("test", AsyncMock())
+    queue = AdmissionQueue(OperatorPool([operator]), max_depth=2, max_wait=5)
+    order = []
+
+    assert await queue.acquire() == (operator, None)
+
+    async def waiter(name):
+        assigned, status = await queue.acquire()
+        order.append((name, assigned, status))
+        queue.release(assigned)
+
+    tasks = [asyncio.create_task(waiter("first")), asyncio.create_task(waiter("second"))]
+    await asyncio.sleep(0)
+    assert queue.depth == 2
+
+    queue.release(operator)
+    await asyncio.gather(*tasks)
+
+    assert order == [("first", operator, None), ("second", operator, None)]
+    assert queue.depth == 0
+    assert not operator.busy
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_overflow_and_timeout():
+    """待ち行列の溢れ(503)と待ち時間切れ(429)のテスト"""
+    from src.hal.server import AdmissionQueue, Operator, OperatorPool
+
+    operator = Operator("test", AsyncMock())
+    queue = AdmissionQueue(OperatorPool([operator]), max_depth=1, max_wait=0.05)
+    assert await queue.acquire() == (operator, None)
+
+    pending = asyncio.create_task(queue.acquire())
+    await asyncio.sleep(0)
+
+    assert await queue.acquire() == (None, 503)
+    assert await pending == (None, 429)
+    assert queue.depth == 0
+
+    queue.release(operator)
+    assert not operator.busy
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_fair_share_priority_and_deadline():
+    """待ち行列が優先度・呼び出し元ごとの公平さ・期限の順にオペレータを引き渡すことのテスト"""
+    from src.hal.server import AdmissionQueue, Operator, OperatorPool, SchedulingKey
+
+    operator = Operator("test", AsyncMock())
+    queue = AdmissionQueue(OperatorPool([operator]), max_depth=20, max_wait=5)
+    assert await queue.acquire() == (operator, None)
+    order = []
+
+    async def waiter(name, key):
+        assigned, _ = await queue.acquire(key)
+        order.append(name)
+        queue.release(assigned)
+
+    keys = [(f"noisy{i}", SchedulingKey(caller="noisy")) for i in range(4)]
+    keys += [
+        ("quiet", SchedulingKey(caller="quiet")),
+        ("urgent", SchedulingKey(caller="quiet2", deadline=1.0)),
+        ("soon", SchedulingKey(caller="noisy", deadline=1.0)),
+        ("vip", SchedulingKey(priority=1, caller="noisy")),
+    ]
+    tasks = []
+    for name, key in keys:
+        tasks.append(asyncio.create_task(waiter(name, key)))
+        await asyncio.sleep(0)
+    assert queue.depth == 8
+
+    queue.release(operator)
+    await asyncio.gather(*tasks)
+
+    # 優先度の高いものが先。同じ優先度では呼び出し元ごとに順番が回り、大量に送った noisy の後でも
+    # quiet・quiet2 はすぐに割り当てられる。同じ呼び出し元の中では期限のある soon が先
+    assert order == ["vip", "soon", "quiet", "urgent", "noisy0", "noisy1", "noisy2", "noisy3"]
+    assert queue.depth == 0
+    assert not operator.busy
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_weights_and_abandoned_waiters():
+    """呼び出し元の重みに応じて割り当て、抜けた待ち手を読み飛ばすことのテスト"""
+    from src.hal.server import AdmissionQueue, Operator, OperatorPool, SchedulingKey
+
+    with pytest.raises(ValueError):
+        AdmissionQueue(OperatorPool(), weights={"a": 0})
+
+    operator = Operator("test", AsyncMock())
+    queue = AdmissionQueue(OperatorPool([operator]), max_depth=20, max_wait=5, weights={"a": 2})
+    assert await queue.acquire() == (operator, None)
+    order = []
+
+    async def waiter(name, caller):
+        assigned, _ = await queue.acquire(SchedulingKey(caller=caller))
+        order.append(name)
+        queue.release(assigned)
+
+    tasks = [asyncio.create_task(waiter(f"b{i}", "b")) for i in range(3)]
+    tasks += [asyncio.create_task(waiter(f"a{i}", "a")) for i in range(4)]
+    await asyncio.sleep(0)
+    abandoned = asyncio.create_task(queue.acquire(SchedulingKey(caller="c")))
+    await asyncio.sleep(0)
+    abandoned.cancel()
+    await asyncio.wait([abandoned])
+    assert queue.depth == 7
+
+    queue.release(operator)
+    await asyncio.gather(*tasks)
+
+    assert order == ["a0", "b0", "a1", "a2", "b1", "a3", "b2"]
+    assert queue.depth == 0
+    assert not operator.busy
+
+
+def test_scheduling_key_from_headers():
+    """優先度と呼び出し元をリクエストヘッダから読み取ることのテスト"""
+    server = HALServer()
+
+    def raw_request(headers):
+        return Request({
+            "type": "http", "method": "POST",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        })
+
+    key = server._scheduling_key(
+        raw_request({"Authorization": "Bearer token-a", "X-HAL-Priority": "5"}), 10.0
+    )
+    assert (key.priority, key.deadline, key.caller) == (5, 10.0, "token-a")
+    key = server._scheduling_key(raw_request({"X-HAL-Priority": "high"}), None)
+    assert (key.priority, key.caller) == (0, "")
+    assert server._scheduling_key(MagicMock(), 3.0).deadline == 3.0
+
+
+def test_operator_pool_least_busy_assignment():
+    """オペレータプールが空いている中で最も負荷の少ないオペレータを選ぶことのテスト"""
+    from src.hal.server import Operator, OperatorPool
+
+    veteran = Operator("veteran", AsyncMock())
+    veteran.handled = 10
+    veteran.busy_seconds = 120.0
+    newcomer = Operator("newcomer", AsyncMock())
+    pool = OperatorPool([veteran, newcomer])
+
+    assert pool.try_acquire() is newcomer
+    assert pool.try_acquire() is veteran
+    assert pool.try_acquire() is None
+    assert pool.idle_count == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_uses_idle_operator():
+    """複数オペレータがいる場合、処理中でないオペレータに割り当てられることのテスト"""
+    from src.hal.server import Operator
+
+    server = HALServer()
+    first = server.operator_pool.operators[0]
+    second_handler = AsyncMock(return_value={"content": "二人目の応答"})
+    server.operator_pool.add(Operator("second", second_handler))
+    first.slot.acquire()
+
+    request = ChatCompletionRequest(
+        model="gpt-4",
+        messages=[{"role": "user", "content": "こんにちは"}]
+    )
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+
+    try:
+        response = await chat_route.endpoint(request, MagicMock())
+    finally:
+        first.slot.release()
+
+    second_handler.assert_awaited_once_with(request, on_update=None)
+    assert response.choices[0]["message"]["content"] == "二人目の応答"
+    assert server.operator_pool.idle_count == 2
+
+
+def test_concurrency_limiter():
+    """同時処理数の上限まで枠を確保でき、無制限なら常に確保できることのテスト"""
+    from src.hal.server import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(2)
+    assert limiter.acquire()
+    assert not limiter.locked()
+    assert limiter.acquire()
+    assert limiter.locked()
+    assert not limiter.acquire()
+    assert limiter.in_use == 2
+
+    limiter.release()
+    assert not limiter.locked()
+    limiter.release()
+    with pytest.raises(RuntimeError):
+        limiter.release()
+
+    unlimited = ConcurrencyLimiter(None)
+    for _ in range(100):
+        assert unlimited.acquire()
+    assert not unlimited.locked()
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_max_concurrency():
+    """同時処理数の枠が全て使用中になった時だけ503を返すことのテスト"""
+    server = HALServer(fix_reply="固定応答", fast_path=False, max_concurrency=2)
+    operator = server.operator_pool.operators[0]
+    release = asyncio.Event()
+
+    async def slow_handler(request, on_update=None):
+        await release.wait()
+        return {"content": "固定応答"}
+
+    operator.handler = slow_handler
+    requests = [
+        ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": f"質問{i}"}])
+        for i in range(3)
+    ]
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+
+    tasks = [
+        asyncio.create_task(chat_route.endpoint(request, MagicMock()))
+        for request in requests[:2]
+    ]
+    await asyncio.sleep(0.01)
+    assert operator.slot.in_use == 2
+
+    busy = await chat_route.endpoint(requests[2], MagicMock())
+    assert busy.status_code == 503
+
+    release.set()
+    responses = await asyncio.gather(*tasks)
+    assert all(r.choices[0]["message"]["content"] == "固定応答" for r in responses)
+    assert operator.slot.in_use == 0
+
+
+def test_max_concurrency_per_mode():
+    """同時処理数はデーモンモードでのみ変更でき、TUIモードでは1に固定されることのテスト"""
+    def limit(server):
+        return server.operator_pool.operators[0].slot.limit
+
+    assert limit(HALServer(fix_reply="x", max_concurrency=None)) is None
+    assert limit(HALServer(fix_reply="x")) == 1
+    assert limit(HALServer(max_concurrency=5)) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_coalesces_identical_requests():
+    """処理中の同じ会話のリクエストが1回の応答を共有し、別々のidで返されることのテスト"""
+    server = HALServer()
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_handler(request, on_update=None):
+        calls.append(request)
+        await release.wait()
+        return {"content": "一度だけの応答"}
+
+    server.operator_pool.operators[0].handler = slow_handler
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    same = [
+        ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "こんにちは"}]),
+        ChatCompletionRequest(
+            model="gpt-4",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "こんにちは"}]}]
+        ),
+        ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "こんにちは"}]),
+    ]
+
+    tasks = [asyncio.create_task(chat_route.endpoint(r, MagicMock())) for r in same]
+    await asyncio.sleep(0.01)
+    other = await chat_route.endpoint(
+        ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "別の質問"}]),
+        MagicMock()
+    )
+    assert other.status_code == 503
+
+    release.set()
+    responses = await asyncio.gather(*tasks)
+
+    assert len(calls) == 1
+    assert [r.choices[0]["message"]["content"] for r in responses] == ["一度だけの応答"] * 3
+    assert len({r.id for r in responses}) == 3
+    assert server.coalesced_total.values == {"": 2}
+    assert len(server.single_flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancels_when_all_callers_leave():
+    """待っている呼び出し元が全員取り消された時だけ処理を取り消すことのテスト"""
+    from src.hal.server import SingleFlight
+
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    first = asyncio.create_task(flight.do("key", work))
+    second = asyncio.create_task(flight.do("key", work))
+    await started.wait()
+
+    first.cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert len(flight) == 0
+
+
+async def _read_sse_events(response):
+    """StreamingResponseからSSEのdataフレームを取り出す"""
+    import json
+    
+    events = []
+    async for chunk in response.body_iterator:
+        text = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+        for frame in text.split("\n\n"):
+            if frame.startswith("data: "):
+                data = frame[len("data: "):]
+                events.append(data if data == "[DONE]" else json.loads(data))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_stream_releases_slot_when_client_leaves_early():
+    """本文の送信前にクライアントが切断しても、オペレータの枠が解放されることのテスト"""
+    server = HALServer()
+    handled = asyncio.Event()
+    
+    async def slow_handler(request, on_update=None):
+        handled.set()
+        await asyncio.sleep(10)
+    
+    server.operator_pool.operators[0].handler = slow_handler
+    request = ChatCompletionRequest(
+        model="gpt-4", messages=[{"role": "user", "content": "こんにちは"}], stream=True
+    )
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    await asyncio.wait_for(handled.wait(), 1)
+    assert server.operator_pool.idle_count == 0
+    
+    async def receive():
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        pass
+    
+    await response({"type": "http", "asgi": {"spec_version": "2.3"}}, receive, send)
+    await asyncio.sleep(0)
+    assert server.operator_pool.idle_count == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_stream_incremental():
+    """stream: true で入力途中の応答が差分として送られることのテスト"""
+    server = HALServer()
+    server.stream_interval = 0.01
+    
+    async def typing_handler(request, on_update=None):
+        on_update("こん")
+        await asyncio.sleep(0.05)
+        on_update("こんにちは")
+        await asyncio.sleep(0.05)
+        return {"content": "こんにちは！"}
+    
+    operator = server.operator_pool.operators[0]
+    operator.handler = typing_handler
+    
+    request = ChatCompletionRequest(
+        model="gpt-4",
+        messages=[{"role": "user", "content": "こんにちは"}],
+        stream=True
+    )
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    
+    assert response.media_type == "text/event-stream"
+    events = await _read_sse_events(response)
+    
+    assert events[-1] == "[DONE]"
+    chunks = events[:-1]
+    assert all(c["object"] == "chat.completion.chunk" for c in chunks)
+    assert len({c["id"] for c in chunks}) == 1
+    assert chunks[0]["choices"][0]["delta"] == {"role": "assistant", "content": ""}
+    
+    deltas = [c["choices"][0]["delta"].get("content", "") for c in chunks[1:]]
+    assert deltas == ["こん", "にちは", "！", ""]
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    
+    await asyncio.sleep(0)
+    assert not operator.busy
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_stream_error():
+    """stream: true でオペレータがエラーを選んだ場合のテスト"""
+    server = HALServer()
+    server.operator_pool.operators[0].handler = AsyncMock(return_value={"error": "forbidden"})
+    
+    request = ChatCompletionRequest(
+        model="gpt-4",
+        messages=[{"role": "user", "content": "こんにちは"}],
+        stream=True
+    )
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    events = await _read_sse_events(response)
+    
+    assert events[-2] == {"error": "forbidden"}
+    assert events[-1] == "[DONE]"
+
+
+async def _never_answer(request, on_update=None):
+    await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_operator_timeout():
+    """応答期限を過ぎたら504を返し、オペレータの処理を取り消して枠を解放することのテスト"""
+    server = HALServer(operator_timeout=0.05)
+    operator = server.operator_pool.operators[0]
+    operator.handler = AsyncMock(side_effect=_never_answer)
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    
+    response = await chat_route.endpoint(request, MagicMock())
+    
+    assert response.status_code == 504
+    assert response.body == b'{"error":"timeout"}'
+    await asyncio.sleep(0)
+    assert not operator.busy
+    assert server.requests_total.values == {"timeout": 1}
+    
+    operator.handler = AsyncMock(return_value={"content": "回答"})
+    response = await chat_route.endpoint(request, MagicMock())
+    assert response.choices[0]["message"]["content"] == "回答"
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_timeout_fallbacks():
+    """期限切れ時に固定の応答文・500を返せることのテスト"""
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    
+    server = HALServer(
+        operator_timeout=0.01, timeout_fallback="reply", timeout_reply="後ほど回答します"
+    )
+    server.operator_pool.operators[0].handler = _never_answer
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    assert response.choices[0]["message"]["content"] == "後ほど回答します"
+    
+    server = HALServer(operator_timeout=0.01, timeout_fallback="500")
+    server.operator_pool.operators[0].handler = _never_answer
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    assert response.status_code == 500
+    
+    with pytest.raises(ValueError):
+        HALServer(timeout_fallback="reply")
+    with pytest.raises(ValueError):
+        HALServer(timeout_fallback="404")
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_timeout_header_and_cache_fallback():
+    """X-HAL-Timeout ヘッダの期限で、キャッシュ済みの応答を返せることのテスト"""
+    server = HALServer(cache_size=10, timeout_fallback="cache")
+    server.operator_pool.operators[0].handler = _never_answer
+    messages = [{"role": "user", "content": "質問"}]
+    request = ChatCompletionRequest(model="gpt-4", messages=messages)
+    server.response_cache.put(conversation_key(request.model, request.messages), "前回の回答")
+    
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": messages},
+            headers={"Cache-Control": "no-cache", "X-HAL-Timeout": "0.05"}
+        )
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "前回の回答"
+        
+        response = await client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "別の質問"}]},
+            headers={"X-HAL-Timeout": "0.05"}
+        )
+        assert response.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_client_disconnect():
+    """クライアントが切断したらオペレータへのリクエストを取り下げることのテスト"""
+    server = HALServer()
+    server.disconnect_poll_interval = 0.01
+    operator = server.operator_pool.operators[0]
+    operator.handler = _never_answer
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    
+    async def receive():
+        return {"type": "http.disconnect"}
+    
+    raw_request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "質問"}])
+    response = await chat_route.endpoint(request, raw_request)
+    
+    assert response.status_code == 499
+    await asyncio.sleep(0)
+    assert not operator.busy
+    assert server.requests_total.values == {"client_disconnected": 1}
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_stream_timeout():
+    """stream: true で応答期限を過ぎたらエラーを送って終了することのテスト"""
+    server = HALServer(operator_timeout=0.05)
+    server.stream_interval = 0.01
+    operator = server.operator_pool.operators[0]
+    operator.handler = _never_answer
+    
+    request = ChatCompletionRequest(
+        model="gpt-4",
+        messages=[{"role": "user", "content": "こんにちは"}],
+        stream=True
+    )
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    response = await chat_route.endpoint(request, MagicMock())
+    events = await _read_sse_events(response)
+    
+    assert events[-2] == {"error": "timeout"}
+    assert events[-1] == "[DONE]"
+    await asyncio.sleep(0)
+    assert not operator.busy
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_async_job():
+    """Prefer: respond-async で202を返し、GET /v1/jobs/{id} で応答を取り出せることのテスト"""
+    server = HALServer()
+    answer = asyncio.Event()
+    
+    async def handler(request, on_update=None):
+        await answer.wait()
+        return {"content": "ジョブの応答"}
+    
+    server.operator_pool.operators[0].handler = handler
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "質問"}]},
+            headers={"Prefer": "respond-async, wait=10"}
+        )
+        assert response.status_code == 202
+        assert response.headers["preference-applied"] == "respond-async"
+        job = response.json()
+        assert job["status"] == "pending"
+        assert response.headers["location"] == f"/v1/jobs/{job['id']}"
+        
+        response = await client.get(f"/v1/jobs/{job['id']}")
+        assert response.status_code == 202
+        assert server.jobs.pending == 1
+        
+        asyncio.get_running_loop().call_later(0.05, answer.set)
+        response = await client.get(f"/v1/jobs/{job['id']}", params={"wait": 5})
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "ジョブの応答"
+        
+        response = await client.get("/v1/jobs/job-unknown")
+        assert response.status_code == 404
+        assert response.json() == {"error": "job_not_found"}
+    
+    assert server.requests_total.values == {"ok": 1}
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_async_job_cancel_and_timeout():
+    """ジョブの取り消しでオペレータの枠が解放され、応答期限切れは504の結果になることのテスト"""
+    server = HALServer(operator_timeout=0.05)
+    operator = server.operator_pool.operators[0]
+    operator.handler = _never_answer
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "質問"}]},
+            headers={"Prefer": "respond-async", "X-HAL-Timeout": "60"}
+        )
+        job_id = response.json()["id"]
+        await asyncio.sleep(0.01)
+        assert operator.busy
+        
+        response = await client.delete(f"/v1/jobs/{job_id}")
+        assert response.json()["status"] == "cancelled"
+        await asyncio.sleep(0.01)
+        assert not operator.busy
+        assert (await client.get(f"/v1/jobs/{job_id}")).status_code == 404
+        
+        response = await client.post(
+            "/v1/chat/completions",
+            json={"model": "gpt-4", "messages": [{"role": "user", "content": "質問"}]},
+            headers={"Prefer": "respond-async"}
+        )
+        response = await client.get(f"/v1/jobs/{response.json()['id']}", params={"wait": 5})
+        assert response.status_code == 504
+        assert response.json() == {"error": "timeout"}
+    
+    assert server.requests_total.values == {"cancelled": 1, "timeout": 1}
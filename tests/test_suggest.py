@@ -0,0 +1,111 @@
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.server import ChatCompletionRequest, HALServer
+from src.hal.suggest import SuggestionIndex
+
+
+def test_search_ranks_similar_replies():
+    """似たリクエストへの応答が上位に来ることのテスト"""
+    index = SuggestionIndex()
+    index.add("パスワードを忘れました", "再設定用のリンクをお送りします。")
+    index.add("注文をキャンセルしたい", "注文履歴からキャンセルできます。")
+    index.add("配送状況を知りたい", "追跡番号をご確認ください。")
+    
+    results = index.search("パスワードを忘れてしまいました", k=2)
+    
+    assert results[0][1] == "再設定用のリンクをお送りします。"
+    assert len(results) <= 2
+    assert all(score > 0 for score, _ in results)
+
+
+def test_search_deduplicates_replies():
+    """同じ応答は一度だけ返すことのテスト"""
+    index = SuggestionIndex()
+    index.add("営業時間は？", "平日9時から18時です。")
+    index.add("営業時間を教えて", "平日9時から18時です。")
+    index.add("営業日は？", "土日祝はお休みです。")
+    
+    replies = [reply for _, reply in index.search("営業時間", k=3)]
+    
+    assert replies.count("平日9時から18時です。") == 1
+    assert len(index) == 3
+
+
+def test_search_empty_index():
+    """索引が空の場合は候補が無いことのテスト"""
+    index = SuggestionIndex()
+    assert index.search("こんにちは") == []
+    
+    index.add("こんにちは", "こんにちは！")
+    assert index.search("こんにちは", k=0) == []
+    assert index.search("全く関係のない文") == []
+
+
+@pytest.mark.asyncio
+async def test_server_passes_suggestions_to_tui():
+    """回答済みの応答が次の似たリクエストで候補としてTUIに渡されることのテスト"""
+    server = HALServer()
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    
+    with patch("src.hal.tui_fix.process_request", new_callable=AsyncMock) as mock_process:
+        mock_process.return_value = {"content": "再設定用のリンクをお送りします。"}
+        await chat_route.endpoint(
+            ChatCompletionRequest(
+                model="gpt-4", messages=[{"role": "user", "content": "パスワードを忘れました"}]
+            ),
+            MagicMock()
+        )
+        await chat_route.endpoint(
+            ChatCompletionRequest(
+                model="gpt-4", messages=[{"role": "user", "content": "パスワードを忘れた"}]
+            ),
+            MagicMock()
+        )
+    
+    assert mock_process.await_args_list[0].kwargs["suggestions"] == []
+    assert mock_process.await_args_list[1].kwargs["suggestions"] == [
+        "再設定用のリンクをお送りします。"
+    ]
+    assert HALServer(fix_reply="固定").suggestion_index is None
+
+
+def test_index_evicts_oldest_entries():
+    """max_entries 件を超えたら古いものから捨て、転置リストからも取り除くことのテスト"""
+    index = SuggestionIndex(max_entries=2)
+    index.add("パスワードを忘れました", "再設定用のリンクをお送りします。")
+    index.add("注文をキャンセルしたい", "注文履歴からキャンセルできます。")
+    index.add("配送状況を知りたい", "追跡番号をご確認ください。")
+    
+    assert len(index) == 2
+    assert index.search("パスワードを忘れました") == []
+    assert index.search("配送状況")[0][1] == "追跡番号をご確認ください。"
+    
+    index.add("営業時間は？", "平日9時から18時です。")
+    # 2件捨てた時点で、読まれていない転置リストからも捨てた文書が取り除かれる
+    assert all(
+        min(doc_ids) >= index._first_id for doc_ids, _ in index._postings.values()
+    )
+    assert "キャン" not in index._postings
+    assert index._total_length == sum(index._lengths)
+    assert [reply for _, reply in index.search("注文をキャンセル 営業時間")] == [
+        "平日9時から18時です。"
+    ]
+
+
+def test_search_frequent_question_over_budget():
+    """転置リストが max_postings を超える頻出の質問でも、新しい応答から候補を返すことのテスト"""
+    index = SuggestionIndex(max_postings=100)
+    index.add("営業時間は？", "古い応答です。")
+    for _ in range(500):
+        index.add("営業時間は？", "平日9時から18時です。")
+    
+    results = index.search("営業時間は？")
+    assert [reply for _, reply in results] == ["平日9時から18時です。"]
+    
+    assert HALServer(suggestion_size=5).suggestion_index.max_entries == 5
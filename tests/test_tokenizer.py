@@ -0,0 +1,160 @@
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.server import ChatCompletionRequest, HALServer
+from src.hal.tokenizer import ApproximateTokenizer, TokenCounter
+
+
+class CountingTokenizer(ApproximateTokenizer):
+    def __init__(self):
+        self.calls = 0
+
+    def tokenize(self, text):
+        self.calls += 1
+        return super().tokenize(text)
+
+
+def test_approximate_tokenizer():
+    """トークンをつなげると元の文字列に戻り、おおよそBPEと同じ単位で区切られることのテスト"""
+    tokenizer = ApproximateTokenizer()
+    text = "Hello, world! I'm 12345 こんにちは\n\n  snake_case_name\t→ ok"
+    
+    tokens = tokenizer.tokenize(text)
+    assert "".join(tokens) == text
+    assert tokens[:4] == ["Hello", ",", " world", "!"]
+    assert " 123" in tokens and "45" in tokens
+    assert "こ" in tokens and "は" in tokens
+    assert tokenizer.count("") == 0
+    
+    assert tokenizer.truncate("one two three four", 2) == ("one two", True)
+    assert tokenizer.truncate("one two", 2) == ("one two", False)
+
+
+def test_token_counter_memoizes_messages():
+    """送り直された履歴のメッセージはトークナイズし直さないことのテスト"""
+    tokenizer = CountingTokenizer()
+    counter = TokenCounter(tokenizer)
+    history = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Hello"},
+    ]
+    
+    first = counter.prompt_tokens(history)
+    assert first == 3 + sum(
+        3 + tokenizer.count(m["role"]) + tokenizer.count(m["content"]) for m in history
+    )
+    
+    tokenizer.calls = 0
+    history.append({"role": "assistant", "content": [{"type": "text", "text": "Hi!"}]})
+    second = counter.prompt_tokens(
+        ChatCompletionRequest(model="gpt-4", messages=history).messages
+    )
+    # 新しいメッセージ1件分 (role と本文) だけトークナイズする
+    assert tokenizer.calls == 2
+    assert second == first + 3 + tokenizer.count("assistant") + tokenizer.count("Hi!")
+
+
+@pytest.mark.asyncio
+async def test_chat_completions_usage_and_max_tokens():
+    """応答に usage が付き、max_tokens を超えた応答は切り詰められることのテスト"""
+    server = HALServer()
+    chat_route = [r for r in server.app.routes if r.path == "/v1/chat/completions"][0]
+    
+    async def reply(request, on_update=None):
+        return {"content": "one two three four five"}
+    
+    server.operator_pool.operators[0].handler = reply
+    messages = [{"role": "user", "content": "count to five"}]
+    
+    response = await chat_route.endpoint(
+        ChatCompletionRequest(model="gpt-4", messages=messages), MagicMock()
+    )
+    prompt_tokens = server.token_counter.prompt_tokens(messages)
+    assert response.choices[0]["finish_reason"] == "stop"
+    assert response.usage == {
+        "prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5
+    }
+    
+    response = await chat_route.endpoint(
+        ChatCompletionRequest(model="gpt-4", messages=messages, max_tokens=3), MagicMock()
+    )
+    assert response.choices[0]["message"]["content"] == "one two three"
+    assert response.choices[0]["finish_reason"] == "length"
+    assert response.usage["completion_tokens"] == 3
+    
+    # max_tokens を指定しなければ、既定値を超える長さの応答も切り詰めない
+    long_reply = " ".join(["word"] * 1500)
+    server.operator_pool.operators[0].handler = AsyncMock(return_value={"content": long_reply})
+    response = await chat_route.endpoint(
+        ChatCompletionRequest(model="gpt-4", messages=messages), MagicMock()
+    )
+    assert response.choices[0]["message"]["content"] == long_reply
+    assert response.choices[0]["finish_reason"] == "stop"
+    assert response.usage["completion_tokens"] == 1500
+
+
+def test_stream_truncation_and_usage():
+    """ストリーミングでも切り詰められ、include_usage で usage が送られることのテスト"""
+    server = HALServer()
+    
+    async def reply(request, on_update=None):
+        return {"content": "one two three four five"}
+    
+    server.operator_pool.operators[0].handler = reply
+    client = TestClient(server.app)
+    response = client.post("/v1/chat/completions", json={
+        "model": "gpt-4",
+        "messages": [{"role": "user", "content": "count"}],
+        "max_tokens": 2,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    })
+    events = [
+        line[len("data: "):] for line in response.text.split("\n") if line.startswith("data: ")
+    ]
+    chunks = [json.loads(event) for event in events[:-1]]
+    
+    content = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+    assert content == "one two"
+    assert chunks[-2]["choices"][0]["finish_reason"] == "length"
+    assert chunks[-1]["choices"] == []
+    assert chunks[-1]["usage"]["completion_tokens"] == 2
+    assert events[-1] == "[DONE]"
+
+
+def test_fast_path_usage_matches_normal_path():
+    """高速経路の usage が通常経路と同じで、切り詰めが必要なら通常経路に回すことのテスト"""
+    body = {
+        "model": "gpt-4",
+        "messages": [{"role": "system", "content": "短く"}, {"role": "user", "content": "やあ"}]
+    }
+    fast = TestClient(HALServer(fix_reply="ただいま休暇中です").app)
+    normal = TestClient(HALServer(fix_reply="ただいま休暇中です", fast_path=False).app)
+    
+    fast_body = fast.post("/v1/chat/completions", json=body).json()
+    normal_body = normal.post("/v1/chat/completions", json=body).json()
+    assert fast_body["usage"] == normal_body["usage"]
+    assert fast_body["usage"]["completion_tokens"] == 9
+    
+    server = HALServer(fix_reply="ただいま休暇中です")
+    truncated = TestClient(server.app).post(
+        "/v1/chat/completions", json=dict(body, max_tokens=3)
+    ).json()
+    assert truncated["choices"][0]["message"]["content"] == "ただい"
+    assert truncated["choices"][0]["finish_reason"] == "length"
+    assert server.operator_pool.operators[0].handled == 1
+    
+    # max_tokens を指定しなければ、既定値を超える長さの固定返答も高速経路でそのまま返す
+    long_reply = " ".join(["word"] * 1500)
+    server = HALServer(fix_reply=long_reply)
+    response = TestClient(server.app).post("/v1/chat/completions", json=body).json()
+    assert response["choices"][0]["message"]["content"] == long_reply
+    assert response["choices"][0]["finish_reason"] == "stop"
+    assert server.operator_pool.operators[0].handled == 0
@@ -1,12 +1,13 @@
 import asyncio
 import os
 import sys
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from src.hal.server import ChatCompletionRequest
 from src.hal.tui import TUIApp, process_request
 
 
@@ -42,20 +43,66 @@ def test_tui_app_verbose_mode():
 @pytest.mark.asyncio
 async def test_process_request():
     """process_request関数のテスト"""
-    request_data = MagicMock()
-    request_data.dict.return_value = {
-        "model": "test-model",
-        "messages": [{"role": "user", "content": "テストメッセージ"}]
-    }
+    request_data = ChatCompletionRequest(
+        model="test-model", messages=[{"role": "user", "content": "テストメッセージ"}]
+    )
+    
+    future = asyncio.get_running_loop().create_future()
+    future.set_result({"content": "応答テスト"})
     
     mock_app = MagicMock()
-    mock_app.response_data = {"content": "応答テスト"}
-    mock_app.response_ready = asyncio.Event()
+    mock_app.submit_request.return_value = future
     
-    mock_app.response_ready.set()
+    with patch("src.hal.tui._get_resident_app", return_value=mock_app):
+        result = await process_request(request_data)
+        
+        assert result == {"content": "応答テスト"}
+        # 検証済みのリクエストをダンプし直さずにそのまま渡す
+        mock_app.submit_request.assert_called_once_with(request_data)
+
+
+@pytest.mark.asyncio
+async def test_resident_app_is_reused():
+    """常駐TUIアプリがリクエストごとに作り直されないことのテスト"""
+    from src.hal import tui
     
-    with patch("src.hal.tui.TUIApp", return_value=mock_app):
-        with patch.object(mock_app, "run_async"):
-            result = await process_request(request_data)
+    stop = asyncio.Event()
+    mock_app = MagicMock()
+    mock_app.run_async = AsyncMock(side_effect=stop.wait)
+    
+    with patch("src.hal.tui.TUIApp", return_value=mock_app) as mock_cls:
+        with patch.object(tui, "_resident_app", None), patch.object(tui, "_resident_task", None):
+            assert tui._get_resident_app() is mock_app
+            assert tui._get_resident_app() is mock_app
+            mock_cls.assert_called_once()
             
-            assert result == {"content": "応答テスト"}
+            stop.set()
+            await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_resident_app_swaps_requests_in_place():
+    """常駐TUIアプリが同じ画面でリクエストを順に差し替えて処理することのテスト"""
+    app = TUIApp()
+    
+    async with app.run_test() as pilot:
+        first = app.submit_request(
+            {"model": "gpt-4", "messages": [{"role": "user", "content": "一件目"}]}
+        )
+        await pilot.pause()
+        await pilot.press("o", "k", "ctrl+m")
+        assert await asyncio.wait_for(first, 5) == {"content": "ok"}
+        
+        second = app.submit_request(ChatCompletionRequest(
+            model="gpt-3.5", messages=[{"role": "user", "content": "二件目"}]
+        ))
+        await pilot.pause()
+        assert app.query_one("#response-input").text == ""
+        assert app.request_data.model == "gpt-3.5"
+        assert "- user: 二件目" in str(app.query_one("#messages").render())
+        await pilot.press("f1")
+        assert await asyncio.wait_for(second, 5) == {"error": "cannot_answer"}
+        
+        await pilot.pause()
+        assert app.request_data is None
+        assert app.is_running
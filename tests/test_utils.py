@@ -6,7 +6,13 @@ from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.hal.utils import format_json_response, setup_logging
+from src.hal.utils import (
+    JsonDumpWriter,
+    conversation_key,
+    format_json_response,
+    setup_logging,
+    truncate_for_log,
+)
 
 
 def test_format_json_response():
@@ -63,3 +69,100 @@ def test_setup_logging_with_file():
     finally:
         if os.path.exists(test_log_file):
             os.unlink(test_log_file)
+
+
+def test_json_dump_writer_batches_records(tmp_path):
+    """JSONダンプライターが順序を保ってまとめて書き出すことのテスト"""
+    dump_file = tmp_path / "dump.ndjson"
+    writer = JsonDumpWriter(str(dump_file), batch_size=2, flush_interval=5, fsync="batch")
+    
+    for i in range(5):
+        assert writer.write({"n": i}, is_request=(i % 2 == 0))
+    writer.flush()
+    
+    lines = [json.loads(line) for line in dump_file.read_text(encoding="utf-8").splitlines()]
+    assert [line["data"]["n"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line["type"] for line in lines] == [
+        "request", "response", "request", "response", "request"
+    ]
+    assert writer.written == 5
+    
+    writer.write({"n": 5})
+    writer.close()
+    assert len(dump_file.read_text(encoding="utf-8").splitlines()) == 6
+    
+    assert writer.write({"n": 6}) is False
+    assert writer.dropped == 1
+
+
+def test_json_dump_writer_embeds_raw_body(tmp_path):
+    """リクエストボディのbytesを解析し直さずに1行のレコードとして書き出すことのテスト"""
+    dump_file = tmp_path / "dump.ndjson"
+    writer = JsonDumpWriter(str(dump_file))
+    body = (
+        '{\r\n  "model": "gpt-4",\n'
+        '  "messages": [{"role": "user", "content": "改行\\nあり"}]\n}\n'
+    )
+    
+    writer.write(body.encode("utf-8"), record_id="r1")
+    writer.close()
+    
+    lines = dump_file.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert list(record) == ["type", "id", "data", "timestamp"]
+    assert record["data"] == json.loads(body)
+    assert record["data"]["messages"][0]["content"] == "改行\nあり"
+
+
+def test_json_dump_writer_drops_when_full(tmp_path):
+    """バッファが満杯の場合にレコードを破棄して数えることのテスト"""
+    import threading
+    
+    release = threading.Event()
+    writer = JsonDumpWriter(str(tmp_path / "dump.ndjson"), max_buffer=2, flush_interval=0)
+    original_write_batch = writer._write_batch
+    
+    def blocked_write_batch(batch):
+        release.wait()
+        original_write_batch(batch)
+    
+    with patch.object(writer, "_write_batch", side_effect=blocked_write_batch):
+        writer.write({"n": 0})
+        while writer.pending:
+            pass
+        
+        results = [writer.write({"n": i}) for i in range(1, 5)]
+        assert results == [True, True, False, False]
+        assert writer.dropped == 2
+        
+        release.set()
+        writer.close()
+    
+    assert writer.written == 3
+
+
+def test_truncate_for_log():
+    """ログ出力用の切り詰め関数のテスト"""
+    assert truncate_for_log("短い文字列") == "短い文字列"
+    assert truncate_for_log("あいう".encode("utf-8")) == "あいう"
+    
+    truncated = truncate_for_log("a" * 50, limit=10)
+    assert truncated == "aaaaaaaaaa... (truncated, 50 chars)"
+    
+    truncated = truncate_for_log(b"b" * 50, limit=10)
+    assert truncated == "bbbbbbbbbb... (truncated, 50 bytes)"
+
+
+def test_conversation_key_normalizes_content():
+    """文字列とテキストパートのリストが同じ会話として扱われることのテスト"""
+    from src.hal.server import Message
+    
+    as_string = [{"role": "user", "content": "こんにちは"}]
+    as_parts = [Message(role="user", content=[{"type": "text", "text": "こんにちは"}])]
+    
+    assert conversation_key("gpt-4", as_string) == conversation_key("gpt-4", as_parts)
+    assert conversation_key("gpt-4", as_string) != conversation_key("gpt-3.5", as_string)
+    assert conversation_key("gpt-4", as_string) != conversation_key(
+        "gpt-4", [{"role": "system", "content": "こんにちは"}]
+    )
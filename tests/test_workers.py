@@ -0,0 +1,193 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.hal.server import HALServer
+from src.hal.workers import FileSlot
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _hold_slot(path, acquired, release):
+    slot = FileSlot(path)
+    slot.acquire()
+    acquired.set()
+    release.wait(5)
+    slot.release()
+
+
+def test_file_slot_excludes_within_process(tmp_path):
+    """同じプロセス内で同じ枠を二重に確保できないことのテスト"""
+    slot = FileSlot(str(tmp_path / "hal.lock"))
+
+    assert not slot.locked()
+    assert slot.acquire(blocking=False)
+    assert slot.locked()
+    assert not slot.acquire(blocking=False)
+
+    slot.release()
+    assert not slot.locked()
+    slot.close()
+
+
+def test_file_slot_excludes_across_processes(tmp_path):
+    """他のプロセスが確保している間は枠を確保できないことのテスト"""
+    path = str(tmp_path / "hal.lock")
+    acquired = multiprocessing.Event()
+    release = multiprocessing.Event()
+    process = multiprocessing.Process(target=_hold_slot, args=(path, acquired, release))
+    process.start()
+    try:
+        assert acquired.wait(5)
+        slot = FileSlot(path)
+        assert slot.locked()
+        assert not slot.acquire(blocking=False)
+
+        release.set()
+        process.join(5)
+        assert not slot.locked()
+        assert slot.acquire(blocking=False)
+        slot.release()
+        slot.close()
+    finally:
+        release.set()
+        process.join(5)
+
+
+def test_file_slot_limit(tmp_path):
+    """limit 個の枠をロックファイルで共有できることのテスト"""
+    path = str(tmp_path / "hal.lock")
+    first = FileSlot(path, limit=2)
+    second = FileSlot(path, limit=2)
+
+    assert first.acquire()
+    assert not second.locked()
+    assert second.acquire()
+    assert first.locked() and second.locked()
+    assert not first.acquire()
+    assert (first.in_use, second.in_use) == (1, 1)
+
+    second.release()
+    assert first.acquire()
+    assert first.in_use == 2
+    assert not second.acquire()
+    first.release()
+    first.release()
+    first.close()
+    second.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_lock_busy_across_servers(tmp_path):
+    """ロックファイルを共有するサーバー間で処理中の判定が共有されることのテスト"""
+    path = str(tmp_path / "hal.lock")
+    first = HALServer(fix_reply="一台目", slot_lock_file=path)
+    second = HALServer(fix_reply="二台目", slot_lock_file=path)
+    assert not first.fast_path
+
+    operator = first.operator_pool.operators[0]
+    assert operator.slot.acquire(blocking=False)
+    try:
+        transport = httpx.ASGITransport(app=second.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(
+                "/v1/chat/completions",
+                json={"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+            )
+        assert response.status_code == 503
+        assert response.json() == {"error": "server_busy"}
+        assert second.operator_pool.idle_count == 0
+    finally:
+        operator.slot.release()
+
+
+@pytest.mark.asyncio
+async def test_shared_lock_queue_waits_for_other_process(tmp_path):
+    """他のプロセスが共有の枠を解放したら、待ち行列の待ち手に割り当てられることのテスト"""
+    path = str(tmp_path / "hal.lock")
+    server = HALServer(fix_reply="固定応答", slot_lock_file=path, queue_depth=1, queue_timeout=2)
+    other = FileSlot(path)
+    assert other.acquire()
+
+    async def release_later():
+        await asyncio.sleep(0.05)
+        other.release()
+
+    releaser = asyncio.ensure_future(release_later())
+    started = time.monotonic()
+    operator, status = await server.admission.acquire()
+    assert status is None and operator is not None
+    assert time.monotonic() - started < 1
+    assert server.admission.depth == 0
+    server.admission.release(operator)
+    await releaser
+    other.close()
+
+
+def test_serve_workers_end_to_end():
+    """複数のワーカープロセスが同じポートで応答し、まとめて終了することのテスト"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    code = (
+        "from src.hal.workers import serve_workers; "
+        f"serve_workers({{'fix_reply': '固定応答'}}, '127.0.0.1', {port}, 2)"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", code], cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        body = {"model": "gpt-4", "messages": [{"role": "user", "content": "こんにちは"}]}
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                response = httpx.post(url, json=body)
+                break
+            except httpx.ConnectError:
+                assert time.monotonic() < deadline
+                time.sleep(0.1)
+
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "固定応答"
+        for _ in range(10):
+            assert httpx.post(url, json=body).status_code == 200
+    finally:
+        process.terminate()
+        process.wait(10)
+
+    with pytest.raises(httpx.ConnectError):
+        httpx.post(url, json=body)
+
+
+def test_starts_without_fcntl():
+    """fcntl の無い環境 (Windows) でも起動でき、--shared-lock だけが拒否されることのテスト"""
+    code = (
+        "import runpy, sys; sys.modules['fcntl'] = None; "
+        "from src.hal import workers; assert not workers.flock_available(); "
+        "sys.argv = ['hal'] + sys.argv[1:]; "
+        "runpy.run_path('bin/hal', run_name='__main__')"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, "--help"], cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert "--workers" in result.stdout
+
+    result = subprocess.run(
+        [sys.executable, "-c", code, "--fix-reply-daemon", "x", "--shared-lock"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.returncode == 2
+    assert "--shared-lock は flock (fcntl) が使えない環境では使用できません" in result.stderr